@@ -5,7 +5,9 @@ Prepare BBR.
 
 The purpose of this script is to prepare boundary based registration. Relevant
 files are copied, a wm masked is created, opening operation applied, and the
-mask is dilated.
+mask is dilated. Thresholding and binarisation are performed in memory; the
+wm estimate is obtained with FSL FAST, or (optionally) with a two-class
+intensity model without leaving python.
 (C) Ingo Marquardt, 2017
 """
 
@@ -14,11 +16,17 @@ mask is dilated.
 # *** Import modules
 
 import os
+import sys
+import subprocess
 import numpy as np
 import nibabel as nib
-from skimage import morphology as skimrp
-from skimage.measure import label
 from shutil import copyfile
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.nii_io import find_nii  #noqa
+from pacman_utils.nii_io import save_nii  #noqa
+from pacman_utils.mask import make_mask  #noqa
+from pacman_utils.mask import two_class_mask  #noqa
 # *****************************************************************************
 
 
@@ -54,8 +62,35 @@ strPthBbr02 = (pacman_data_path
                + pacman_sub_id
                + '/nii/mp2rage/03_reg/04_reg/02_bbr_prep/')
 
+# Intensity threshold for T1 image (lower values are set to zero before
+# tissue classification):
+varT1Thr = 1000.0
+
+# Use FSL FAST for wm estimation? Otherwise, a two-class intensity model (Otsu
+# threshold) of the thresholded T1 image is used as a fast approximate wm
+# estimate (wm is the class with short T1):
+lgcFast = True
+
+# Upper intensity limit for the two-class intensity model (voxels with longer
+# T1, e.g. CSF, are excluded from the model):
+varT1Max = 3000.0
+
+# Path of FSL FAST:
+strFast = '/usr/share/fsl/5.0/bin/fast'
+
 # Cluster size threshold:
 varCluSzeThr = 200
+
+# Connectivity of clusters (maximum number of orthogonal steps between
+# neighbouring voxels, 1 to 3):
+varCon = 2
+
+# Morphological operations applied to the WM estimation before the cluster
+# size threshold:
+lstMrphPre = ['opening']
+
+# Morphological operations applied after the cluster size threshold:
+lstMrphPost = [('dilation', 5)]
 # *****************************************************************************
 
 
@@ -79,79 +114,78 @@ print('---Creating brain mask for BBR')
 # We would like to create a very conservative brain mask - a dilated WM mask.
 # The following steps are performed:
 # (1) Threshold the T1 image at an intensity of 1000
-# (2) Run FSL FAST
-# (3) Binarise FAST WM estimation
+# (2) Run FSL FAST (or two-class intensity model)
+# (3) Binarise WM estimation
 # (4) Perform opening operation on WM estimation
 # (5) Apply cluster size threshold
 # (6) Dilate WM mask
 
 # (1) Threshold the T1 image at an intensity of 1000
 print('------Threshold the T1 image')
-strBshCmd = ('fslmaths ' + strPthBbr01 + strT1 + ' -thr 1000 ' + strPthBbr02
-             + strT1 + '_thr')
-os.system(strBshCmd)
-
-# (2) Run FSL FAST
-print('------Running FSL FAST')
-strBshCmd = ('/usr/share/fsl/5.0/bin/fast '
-             + '-t 1 -n 3 -H 0.1 -I 4 -l 20.0 -g -B -b -o '
-             + strPthBbr02 + 'ch01_cl03 '
-             + strPthBbr02 + strT1 + '_thr')
-os.system(strBshCmd)
-
-# (3) Binarise FAST WM estimation
-print('------Binarising FAST WM estimation')
-strBshCmd = ('fslmaths ' + strPthBbr02 + 'ch01_cl03_seg_0' + ' -bin '
-             + strPthBbr02 + 'bbrmask')
-os.system(strBshCmd)
-
-# (4) Perform opening operation on WM estimation
-print('------Opening operation')
-
-# Load the nii file (this doesn't load the data into memory though):
-niiIn = nib.load((strPthBbr02 + 'bbrmask.nii.gz'))
-# Load the data into memory:
-aryData = niiIn.get_data()
-aryData = np.array(aryData)
 
-# Perform opening:
-aryData = skimrp.binary_opening(aryData)
-
-# (5) Apply cluster size threshold
-print('------Apply cluster size threshold')
-
-# Find connected clusters
-
-# Create labelled clusters:
-aryData = label(aryData, connectivity=2)
-
-# Vectors of cluster labels & number of voxels in each cluster:
-vecLbls, vecCnt = np.unique(aryData, return_counts=True)
-
-# Labels and label indicies of same data type:
-aryData = aryData.astype(np.int64)
-vecLbls = vecLbls.astype(np.int64)
-
-# Applying connected clusters threshold:
-for idxClst in vecLbls:
-    if np.less(vecCnt[idxClst], varCluSzeThr):
-        aryData[aryData == idxClst] = 0
-aryData[aryData != 0] = 1
-
-# (6) Dilate WM mask
-print('------Dilating WM mask')
-aryData = skimrp.binary_dilation(aryData)
-aryData = skimrp.binary_dilation(aryData)
-aryData = skimrp.binary_dilation(aryData)
-aryData = skimrp.binary_dilation(aryData)
-aryData = skimrp.binary_dilation(aryData)
+niiIn = nib.load(find_nii(strPthBbr01 + strT1 + '.nii.gz'))
+aryT1 = np.asarray(niiIn.dataobj, dtype=np.float32)
+aryT1[np.less(aryT1, varT1Thr)] = 0.0
+
+if lgcFast:
+
+    # (2) Run FSL FAST. The thresholded image is the only file written for
+    # FAST (uncompressed, so that it does not need to be compressed and
+    # decompressed again):
+    print('------Running FSL FAST')
+    strPthThr = (strPthBbr02 + strT1 + '_thr.nii')
+    niiThr = nib.Nifti1Image(aryT1, niiIn.affine, header=niiIn.header)
+    niiThr.set_data_dtype(np.float32)
+    niiThr.header.set_slope_inter(None, None)
+    nib.save(niiThr, strPthThr)
+    subprocess.check_call([strFast,
+                           '-t', '1', '-n', '3', '-H', '0.1', '-I', '4',
+                           '-l', '20.0', '-g', '-B', '-b', '-o',
+                           (strPthBbr02 + 'ch01_cl03'),
+                           strPthThr])
+    os.remove(strPthThr)
+
+    # (3) Binarise FAST WM estimation (output format of FAST depends on
+    # FSLOUTPUTTYPE):
+    print('------Binarising FAST WM estimation')
+    strPthSeg = (strPthBbr02 + 'ch01_cl03_seg_0.nii.gz')
+    if not os.path.isfile(strPthSeg):
+        strPthSeg = strPthSeg[:-3]
+    aryData = np.not_equal(np.asarray(nib.load(strPthSeg).dataobj), 0)
+
+else:
+
+    # (2) & (3) Two-class intensity model (WM is the class with short T1;
+    # voxels below the intensity threshold or above the upper limit are
+    # excluded):
+    print('------Two-class intensity model')
+    aryData, varThr = two_class_mask(
+        aryT1,
+        aryMsk=np.logical_and(np.greater(aryT1, 0.0),
+                              np.less_equal(aryT1, varT1Max)),
+        lgcLow=True)
+    print('---------WM threshold: ' + str(varThr))
+
+del(aryT1)
+
+# (4) Perform opening operation on WM estimation, (5) apply cluster size
+# threshold, and (6) dilate WM mask
+print('------Opening operation, cluster size threshold, dilation')
+
+aryData = make_mask(aryData,
+                    varCluSzeThr=varCluSzeThr,
+                    varCon=varCon,
+                    lstMrphPre=lstMrphPre,
+                    lstMrphPost=lstMrphPost)
 
 # Save mask:
 
 # Create output nii object:
-niiOt = nib.Nifti1Image(aryData,
+niiOt = nib.Nifti1Image(aryData.astype(np.uint8),
                         niiIn.affine,
                         header=niiIn.header)
+niiOt.set_data_dtype(np.uint8)
+niiOt.header.set_slope_inter(None, None)
 # Save image:
-nib.save(niiOt, (strPthBbr02 + 'bbrmask.nii.gz'))
+save_nii(niiOt, (strPthBbr02 + 'bbrmask.nii.gz'), varLvl='mask')
 # *****************************************************************************
@@ -4,6 +4,11 @@ Convert event-related time course vtk meshes to npy format.
 
 The collection of single-volume vtk meshes is converted into a single npy
 format for faster access and to conserve disk space.
+
+The vtk files of all condition directories are parsed in parallel (process
+pool). Each worker writes its volume directly into a preallocated,
+memory-mapped npy file per condition, so that memory usage does not depend on
+the number of volumes.
 """
 
 # Part of py_depthsampling library
@@ -25,8 +30,13 @@ format for faster access and to conserve disk space.
 
 import os
 from os import listdir
+import multiprocessing as mp
 import numpy as np
 from loadVtkMulti import funcLoadVtkMulti
+# Shared analysis utilities (located in the analysis parent directory; the
+# path is added by `loadVtkMulti`):
+from pacman_utils.vtk_io import get_index_path  #noqa
+from pacman_utils.ert_chunks import write_chunks  #noqa
 
 
 # *****************************************************************************
@@ -36,6 +46,12 @@ from loadVtkMulti import funcLoadVtkMulti
 pacman_data_path = str(os.environ['pacman_data_path'])
 pacman_sub_id = str(os.environ['pacman_sub_id'])
 
+# Number of parallel processes:
+try:
+    varPar = int(os.environ['pacman_cpu'])
+except (KeyError, ValueError):
+    varPar = mp.cpu_count()
+
 # List of directories with vtk files to be converted:
 lstDir = [(pacman_data_path + pacman_sub_id + '/cbs/lh_era/bright_square'),
           (pacman_data_path + pacman_sub_id + '/cbs/lh_era/dark_square'),
@@ -53,71 +69,146 @@ strPrcdData = 'SCALARS'
 
 # Number of lines between vertex-identification-string and first data point:
 varNumLne = 2
-# *****************************************************************************
 
+# Additionally create a vertex-chunked copy of each npy file (directory
+# `aryErt_<condition>_chunks`, see `pacman_utils.ert_chunks`)? ROI time
+# courses are read much faster from the chunked copy, at the cost of twice the
+# disk space:
+lgcChk = False
 
+# Number of vertices per chunk:
+varChkSze = 1024
 # *****************************************************************************
-# *** Convert vtk files to npy files
-
-print('----------------------------------------------------------------------')
-
-print('-vtk to npy conversion')
-
-# Loop through target directories:
-for strDirTmp in lstDir:
 
-    print(('--Target directory: ' + strDirTmp))
 
-    # Condition name (needed for file names):
-    strCondTmp = os.path.split(strDirTmp)[1]
-
-    # Get list of files in target directory:
-    lstFls = listdir(strDirTmp)
-
-    # Ignore files that do not have vtk file extension:
-    lstFls = [f for f in lstFls if '.vtk' in f]
-
-    # Sort files:
-    lstFls = sorted(lstFls)
+# *****************************************************************************
+# *** Define functions
 
-    # Number of volumes:
-    varNumVol = len(lstFls)
+# Memory-mapped npy files opened by the current worker process (key: file
+# path):
+dicMmap = {}
 
-    # Loop through volumes (i.e. through 3D vtk files):
-    for idxVol in range(0, varNumVol):
 
-        print(('---Volume: ' + str(idxVol)))
+def convert_vtk(strPthNpy, idxVol, strPthVtk):
+    """Load vtk file and put its data into memory-mapped npy file."""
+    # Open memory-mapped output array (only once per process & file):
+    if strPthNpy not in dicMmap:
+        dicMmap[strPthNpy] = np.load(strPthNpy, mmap_mode='r+')
+    aryErt = dicMmap[strPthNpy]
 
-        # Path of current vtk file:
-        strPthVtkTmp = os.path.join(strDirTmp, lstFls[idxVol])
+    # Load vtk mesh for current timepoint (read only once, so that its index
+    # is not cached):
+    aryTmp = funcLoadVtkMulti(strPthVtk,
+                              strPrcdData,
+                              varNumLne,
+                              varNumDpth,
+                              lgcCache=False)
 
-        # Load vtk mesh for current timepoint:
-        aryTmp = funcLoadVtkMulti(strPthVtkTmp,
-                                  strPrcdData,
-                                  varNumLne,
-                                  varNumDpth).astype(np.float32)
+    # Put current volume into array:
+    aryErt[:, idxVol, :] = aryTmp.T
+    aryErt.flush()
 
-        # Get number of vertices for first volume (has to be equal across
-        # volumes) and preallocate np array:
-        if idxVol == 0:
+    # Delete vtk file (only after its data have been written), and its index
+    # if one was left behind by a previous run:
+    os.remove(strPthVtk)
+    if os.path.isfile(get_index_path(strPthVtk)):
+        os.remove(get_index_path(strPthVtk))
 
-            # Number of vertices:
-            varNumVrtc = aryTmp.shape[0]
+    return idxVol
 
-            # Array to be filled with data:
-            aryErt = np.zeros((varNumDpth, varNumVol, varNumVrtc),
-                              dtype=np.float32)
 
-        # Put current volume into array:
-        aryErt[:, idxVol, :] = aryTmp.T
+def convert_vtk_star(tplArgs):
+    """Unpack arguments for `convert_vtk` (for use with `imap_unordered`)."""
+    return convert_vtk(*tplArgs)
+# *****************************************************************************
 
-        # Delete vtk file:
-        os.remove(strPthVtkTmp)
 
-    # Save array to disk:
-    strPthNpy = os.path.join(strDirTmp, ('aryErt_' + strCondTmp + '.npy'))
-    print(('--Saving to disk: ' + strPthNpy))
-    np.save(strPthNpy, aryErt)
 # *****************************************************************************
+# *** Convert vtk files to npy files
 
-print('--Done.')
+if __name__ == '__main__':
+
+    print('------------------------------------------------------------------'
+          + '----')
+
+    print('-vtk to npy conversion')
+
+    # List of conversion tasks (output npy file, volume index, vtk file) for
+    # all target directories:
+    lstTsk = []
+
+    # Npy files that are created:
+    lstPthNpy = []
+
+    # Loop through target directories:
+    for strDirTmp in lstDir:
+
+        print(('--Target directory: ' + strDirTmp))
+
+        # Condition name (needed for file names):
+        strCondTmp = os.path.split(strDirTmp)[1]
+
+        # Get list of files in target directory:
+        lstFls = listdir(strDirTmp)
+
+        # Ignore files that do not have vtk file extension (e.g. cached vtk
+        # indices):
+        lstFls = [f for f in lstFls if f.endswith('.vtk')]
+
+        # Sort files:
+        lstFls = sorted(lstFls)
+
+        # Number of volumes:
+        varNumVol = len(lstFls)
+
+        if varNumVol == 0:
+            print('---No vtk files found, skipping directory.')
+            continue
+
+        # Get number of vertices from first volume (has to be equal across
+        # volumes):
+        varNumVrtc = funcLoadVtkMulti(os.path.join(strDirTmp, lstFls[0]),
+                                      strPrcdData,
+                                      varNumLne,
+                                      varNumDpth,
+                                      lgcCache=False).shape[0]
+
+        # Preallocate memory-mapped array on disk, to be filled with data
+        # (shape: depth, volume, vertex):
+        strPthNpy = os.path.join(strDirTmp, ('aryErt_' + strCondTmp + '.npy'))
+        print(('---Creating: ' + strPthNpy))
+        aryErt = np.lib.format.open_memmap(strPthNpy,
+                                           mode='w+',
+                                           dtype=np.float32,
+                                           shape=(varNumDpth,
+                                                  varNumVol,
+                                                  varNumVrtc))
+        del(aryErt)
+        lstPthNpy.append(strPthNpy)
+
+        for idxVol in range(0, varNumVol):
+            lstTsk.append((strPthNpy,
+                           idxVol,
+                           os.path.join(strDirTmp, lstFls[idxVol])))
+
+    print(('--Converting ' + str(len(lstTsk)) + ' vtk files ('
+           + str(varPar) + ' processes)'))
+
+    # Parse vtk files in parallel (unordered, because each worker writes to
+    # its own volume in the output array):
+    objPool = mp.Pool(processes=varPar)
+    for idxTsk, _ in enumerate(objPool.imap_unordered(convert_vtk_star,
+                                                      lstTsk,
+                                                      chunksize=4)):
+        if (idxTsk % 100) == 0:
+            print(('---Volume ' + str(idxTsk) + ' of ' + str(len(lstTsk))))
+    objPool.close()
+    objPool.join()
+
+    if lgcChk:
+        for strPthNpy in lstPthNpy:
+            print(('--Creating vertex-chunked copy of: ' + strPthNpy))
+            write_chunks(strPthNpy, varChkSze=varChkSze)
+
+    print('--Done.')
+# *****************************************************************************
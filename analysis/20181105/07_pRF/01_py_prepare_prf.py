@@ -15,10 +15,13 @@ EPI image followed by a cluster size threshold and morphological operations
 # *** Import modules
 
 import os
+import sys
 import numpy as np
 import nibabel as nib
-from skimage import morphology as skimrp
-from skimage.measure import label
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.nii_io import save_nii  #noqa
+from pacman_utils.mask import make_mask  #noqa
 # *****************************************************************************
 
 
@@ -46,6 +49,14 @@ varIntThr = 5000.0
 
 # Cluster size threshold:
 varCluSzeThr = 100000
+
+# Connectivity of clusters (maximum number of orthogonal steps between
+# neighbouring voxels, 1 to 3):
+varCon = 2
+
+# Morphological operations applied after the cluster size threshold (dilation
+# followed by closing operation):
+lstMrph = ['dilation', 'dilation', 'erosion']
 # *****************************************************************************
 
 
@@ -70,31 +81,13 @@ aryData = np.array(aryData).astype(np.float32)
 
 print('---Creating mask')
 
-# Apply intensity threshold:
-aryMsk = np.greater_equal(aryData, float(varIntThr))
-
-# Find connected clusters
-
-# Create labelled clusters:
-aryLbls = label(aryMsk, connectivity=2)
-
-# Vectors of cluster labels & number of voxels in each cluster:
-vecLbls, vecCnt = np.unique(aryLbls, return_counts=True)
-
-# Labels and label indicies of same data type:
-aryLbls = aryLbls.astype(np.int64)
-vecLbls = vecLbls.astype(np.int64)
-
-# Applying connected clusters threshold:
-for idxClst in vecLbls:
-    if np.less(vecCnt[idxClst], varCluSzeThr):
-        aryLbls[aryLbls == idxClst] = 0
-aryLbls[aryLbls != 0] = 1
-
-# Perform morphological operation (dilation followed by closing operation):
-aryLbls = skimrp.binary_dilation(aryLbls)
-aryLbls = skimrp.binary_dilation(aryLbls)
-aryLbls = skimrp.binary_erosion(aryLbls)
+# Apply intensity threshold, cluster size threshold, and morphological
+# operations:
+aryLbls = make_mask(aryData,
+                    varIntThr=varIntThr,
+                    varCluSzeThr=varCluSzeThr,
+                    varCon=varCon,
+                    lstMrphPost=lstMrph)
 # *****************************************************************************
 
 
@@ -109,5 +102,5 @@ niiOt = nib.Nifti1Image(aryLbls,
                         header=niiIn.header)
 
 # Save image:
-nib.save(niiOt, (strPathOut + strMsk))
+save_nii(niiOt, (strPathOut + strMsk), varLvl='mask')
 # *****************************************************************************
@@ -9,6 +9,11 @@ registry with the following run). Since the last volume cannot be selected as
 the reference volume in SPM, one has to change the order to volumes, as a
 workaround.
 
+Volumes are streamed from the input file in reverse order directly into the
+output file, so that only a few volumes are held in memory at a time.
+Several runs can be specified (as command line arguments), which are
+processed in parallel.
+
 (C) Ingo Marquardt, 2017
 """
 
@@ -17,8 +22,13 @@ workaround.
 # *** Import modules
 
 import os
-import numpy as np  #noqa
-import nibabel as nib
+import sys
+import multiprocessing as mp
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.nii_iter import iter_vols  #noqa
+from pacman_utils.nii_iter import load_hdr  #noqa
+from pacman_utils.nii_iter import save_vols  #noqa
 # *****************************************************************************
 
 
@@ -29,73 +39,97 @@ import nibabel as nib
 pacman_data_path = str(os.environ['pacman_data_path'])
 pacman_sub_id = str(os.environ['pacman_sub_id'])
 
-# Path to images to be swapped:
-lstPathIn = [(pacman_data_path
-              + pacman_sub_id
-              + '/nii/func_se_op/func_00.nii.gz')]
-
-# Output file paths:
-lstPathOt = [(pacman_data_path
-              + pacman_sub_id
-              + '/nii/func_se_op_inv/func_00.nii.gz')]
+# Number of CPUs (shared between parallel processes, one run per process, and
+# the compression threads of each process):
+try:
+    varCpu = max(int(os.environ['pacman_cpu']), 1)
+except (KeyError, ValueError):
+    varCpu = mp.cpu_count()
+
+# Runs to be swapped (can be specified as command line arguments, e.g.
+# `python n_01_py_inverse_order_func_op.py func_00 func_01`):
+if len(sys.argv) > 1:
+    lstRun = sys.argv[1:]
+else:
+    lstRun = ['func_00']
+
+# Path to images to be swapped (run ID left open):
+strPathIn = (pacman_data_path
+             + pacman_sub_id
+             + '/nii/func_se_op/{}.nii.gz')
+
+# Output file paths (run ID left open):
+strPathOt = (pacman_data_path
+             + pacman_sub_id
+             + '/nii/func_se_op_inv/{}.nii.gz')
+
+# Number of volumes per block (only a few blocks are held in memory at a
+# time):
+varNumVol = 4
 # *****************************************************************************
 
 
 # *****************************************************************************
-# ***  Define functions
+# *** Define functions
 
-def fncLoadNii(strPathIn):
-    """Load nii files."""
-    print(('------Loading: ' + strPathIn))
+def inverse_order(strPathInTmp, strPathOtTmp, varNumThrd=None):
+    """Reverse the temporal order of volumes in a 4D nii file."""
+    print(('------Reversing: ' + strPathInTmp))
 
-    # Load nii file (this doesn't load the data into memory yet):
-    niiTmp = nib.load(strPathIn)
+    # Header & affine of input file (the data are not loaded):
+    hdrNii, aryAff = load_hdr(strPathInTmp)
 
-    # Load data into array:
-    aryTmp = niiTmp.get_data()
+    # Blocks of volumes are read starting from the end of the time series.
+    # Reversing the order of volumes within each block (i.e. along the fourth
+    # dimension) results in the reversed time series.
+    itrBlk = (aryBlk[:, :, :, ::-1] for _, aryBlk
+              in iter_vols(strPathInTmp, varNumVol=varNumVol, lgcRev=True))
 
-    # Get headers:
-    hdrTmp = niiTmp.header
+    # Save corrected image, block by block:
+    save_vols(itrBlk,
+              strPathOtTmp,
+              hdrNii,
+              aryAff,
+              varLvl='timeseries',
+              varNumThrd=varNumThrd)
 
-    # Get 'affine':
-    aryAff = niiTmp.affine
+    # Delete original file:
+    # os.remove(strPathInTmp)
 
-    # Output nii data as numpy array and header:
-    return aryTmp, hdrTmp, aryAff
+    return strPathOtTmp
 # *****************************************************************************
 
 
 # *****************************************************************************
 # *** Perform correction
 
-print('-Swap temporal order of volumes in 4D nii file.')
-
-print('---Performing correction')
+if __name__ == '__main__':
 
-# Loop through input files:
+    print('-Swap temporal order of volumes in 4D nii file.')
 
-for idxIn in range(0, len(lstPathIn)):
+    print('---Performing correction')
 
-    # print('------File: ' + lstPathIn[idxIn])
+    # Input and output files:
+    lstPathIn = [strPathIn.format(strRun) for strRun in lstRun]
+    lstPathOt = [strPathOt.format(strRun) for strRun in lstRun]
 
-    # Load the nii file:
-    aryData, hdrNii, aryAff = fncLoadNii(lstPathIn[idxIn])
+    # Number of parallel processes, and of compression threads per process:
+    varPar = max(min(varCpu, len(lstRun)), 1)
+    varNumThrd = max(1, (varCpu // varPar))
 
-    # Reverse the order of the array elements along the fourth dimenstion
-    # (i.e. time):
-    aryData = aryData[:, :, :, ::-1]
-
-    # Create new nii image:
-    niiOut = nib.Nifti1Image(aryData,
-                             aryAff,
-                             header=hdrNii)
-
-    # Save correctedimage:
-    nib.save(niiOut,
-             lstPathOt[idxIn])
-
-    # Delete original file:
-    # os.remove(lstPathIn[idxIn])
+    if varPar == 1:
+        # Loop through input files:
+        for idxIn in range(0, len(lstPathIn)):
+            inverse_order(lstPathIn[idxIn], lstPathOt[idxIn],
+                          varNumThrd=varNumThrd)
+    else:
+        # Process runs in parallel:
+        objPool = mp.Pool(processes=varPar)
+        objPool.starmap(inverse_order,
+                        [(strPthI, strPthO, varNumThrd) for strPthI, strPthO
+                         in zip(lstPathIn, lstPathOt)])
+        objPool.close()
+        objPool.join()
 
-print('---Done.')
+    print('---Done.')
 # *****************************************************************************
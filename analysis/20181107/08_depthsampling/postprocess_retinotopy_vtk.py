@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Postprocess VTK retinotopy.
+
+The purpose of this script is to mask a vtk file with values from another vtk
+file. This functionality is needed in order to threshold pRF results (polar
+angle and eccentricity) with a map of explained variance (R2); vertices with a
+low explained variance are not supposed to be shown in the retinotopic maps.
+Additionally, for polar angle maps, the values can be converted from radians
+ranging from -pi to pi into degrees ranging from 0 to 360 (starting at three
+o'clock and moving clockwise); this may improve visualisation in paraview.
+
+Hemispheres and input files can be specified as command line arguments, e.g.:
+
+    python postprocess_retinotopy_vtk.py --hemi lh rh --in file_a.vtk
+
+(C) Ingo Marquardt, 30.08.2016
+"""
+
+# *****************************************************************************
+# *** Import modules
+import os
+import sys
+import argparse
+import numpy as np
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.vtk_io import read_scalars  #noqa
+from pacman_utils.vtk_io import replace_scalars  #noqa
+from pacman_utils.surface import create_surface  #noqa
+from pacman_utils.surface import add_layer  #noqa
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Define parameters
+
+# Load environmental variables defining the input data path:
+pacman_data_path = str(os.environ['pacman_data_path'])
+pacman_sub_id = str(os.environ['pacman_sub_id'])
+
+# Directory of vtk files (hemisphere left open):
+strPthVtk = (pacman_data_path
+             + pacman_sub_id
+             + '/cbs/{}/')
+
+# Hemispheres:
+lstHmsph = ['lh', 'rh']
+
+# Names of the vtk files to be masked (the output files are saved with suffix
+# '_thr'):
+lstVtkIn = ['pRF_results_polar_angle_mid_GM.vtk']
+
+# Name of the vtk file used for thresholding (reference):
+strVtkRf = 'pRF_results_R2_mid_GM.vtk'
+
+# Lower threhold (vertices with a value below this in the reference image will
+# be set to the substitute value in the input vtk file):
+varThrLw = 0.1
+# Low substitute value (vertices below the threhold will be replaced with this
+# values):
+varSubLw = 0.0
+
+# Name of data array which is to be masked:
+strPrcdData = 'EmbedVertex'
+
+# Name of output array (saved in vtk file, will be displayed in paraview):
+strOtName = 'PolarAngle'
+
+# Convert radians (range -pi to pi) to degree (range 0 to 360 degrees)?
+lgcRad2Dgr = True
+
+# Also store the maps (input, reference, and thresholded output) as layers of
+# the per-hemisphere surface dataset (in directory 'surface' next to the vtk
+# files; see `pacman_utils.surface`)? The mesh geometry is only stored once.
+lgcSrf = True
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Define functions
+
+def rad2dgr(vecRad):
+    """
+    Convert polar angle from radians to degrees.
+
+    Radians in the range -pi to pi are converted into degrees in the range 0
+    to 360 (starting at three o'clock and moving clockwise).
+    """
+    # Convert radians (-pi to pi) to degrees (-180 to 180):
+    vecDgr = np.rad2deg(vecRad)
+
+    # Values outside of the expected range are not changed:
+    vecLgcOut = np.logical_or(np.less(vecDgr, -180.0),
+                              np.greater(vecDgr, 180.0))
+    if np.any(vecLgcOut):
+        print('------------ERROR: ' + str(np.sum(vecLgcOut))
+              + ' angles outside of expected range.')
+        print('------------' + str(vecDgr[vecLgcOut]))
+
+    # Change range from [-180 to 180 degree] to [0 to 360 degree]:
+    vecLgcNeg = np.logical_and(np.greater_equal(vecDgr, -180.0),
+                               np.less(vecDgr, 0.0))
+    vecLgcPos = np.logical_and(np.greater(vecDgr, 0.0),
+                               np.less_equal(vecDgr, 180.0))
+    vecDgr[vecLgcNeg] = np.multiply(vecDgr[vecLgcNeg], -1.0)
+    vecDgr[vecLgcPos] = np.subtract(360.0, vecDgr[vecLgcPos])
+
+    return vecDgr
+
+
+def mask_vtk(strVtkIn, strVtkRf, strVtkOt):
+    """Threshold vtk file with reference file, save result."""
+    print('------Input: ' + strVtkIn)
+
+    # Vertex data of input & reference file:
+    aryIn = read_scalars(strVtkIn, [strPrcdData])[strPrcdData]
+    aryInRaw = aryIn.copy()
+    aryRf = read_scalars(strVtkRf, [strPrcdData])[strPrcdData]
+
+    # Only continue if the input file and the reference file have the same
+    # number of vertices:
+    if aryIn.shape[0] != aryRf.shape[0]:
+        print('---ERROR: Input file and reference file contain different '
+              + 'number of vertices.')
+        return
+
+    # Convert radians (range -pi to pi) to degree (range 0 to 360 degrees):
+    if lgcRad2Dgr:
+        print('---------Convert radians (range -pi to pi) to degree (range '
+              + '0 to 360 degrees).')
+        aryIn = rad2dgr(aryIn)
+
+    print('---------Replacing data values in input file that are below the '
+          + 'threshold in the reference file.')
+
+    # Replace values in input file if value in reference file is below
+    # threshold (the first component of the reference is used for all
+    # components of the input):
+    aryIn[np.less(aryRf[:, 0], varThrLw), :] = varSubLw
+
+    print('------Saving result to disk: ' + strVtkOt)
+
+    # Replace data section (all other sections are copied unchanged):
+    replace_scalars(strVtkIn, strVtkOt, strPrcdData, aryIn,
+                    strNameOut=strOtName)
+
+    if lgcSrf:
+
+        # Surface dataset of current hemisphere:
+        strPthSrf = os.path.join(os.path.dirname(strVtkOt), 'surface')
+
+        # The mesh geometry is only parsed if the dataset does not exist yet:
+        if not os.path.isfile(os.path.join(strPthSrf, 'points.npy')):
+            print('------Creating surface dataset: ' + strPthSrf)
+            create_surface(strPthSrf, strVtkIn, lgcLyr=False)
+
+        # Layer names are taken from the file names:
+        for strPthTmp, aryTmp in zip((strVtkIn, strVtkRf, strVtkOt),
+                                     (aryInRaw, aryRf, aryIn)):
+            add_layer(strPthSrf,
+                      os.path.splitext(os.path.basename(strPthTmp))[0],
+                      aryTmp)
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Mask vtk files
+
+if __name__ == '__main__':
+
+    print('-VTK masking')
+
+    # Command line arguments (the parameters defined above are used as
+    # default values):
+    objPrsr = argparse.ArgumentParser(description='Threshold vtk files.')
+    objPrsr.add_argument('--hemi', nargs='+', default=lstHmsph,
+                         help='Hemispheres (e.g. lh rh).')
+    objPrsr.add_argument('--in', nargs='+', default=lstVtkIn, dest='vtk_in',
+                         help='Names of vtk files to be masked.')
+    objPrsr.add_argument('--ref', default=strVtkRf,
+                         help='Name of reference vtk file.')
+    objArgs = objPrsr.parse_args()
+
+    for strHmsph in objArgs.hemi:
+
+        print('---Hemisphere: ' + strHmsph)
+
+        strPthTmp = strPthVtk.format(strHmsph)
+
+        for strVtkIn in objArgs.vtk_in:
+            mask_vtk((strPthTmp + strVtkIn),
+                     (strPthTmp + objArgs.ref),
+                     (strPthTmp + strVtkIn.replace('.vtk', '_thr.vtk')))
+
+    print('-Done.')
+# *****************************************************************************
@@ -3,10 +3,20 @@
 Deface MP2RAGE images and correct truncation error in T1 image.
 
 MP2RAGE images are anonymised (i.e. 'defaced') by setting anterior voxels to
-zero. Additionally, truncation errors in the T1 image are removed (high
-intensity voxels have a value of zero in these images, probably due to a bug
-in the reconstruction software). These voxels are set to the maximum value in
-the images.
+zero. The face mask (a bounding box anterior to the head) is computed once from
+one contrast (PDw image) and its affine, and applied to all images (see
+`pacman_utils.deface`). Additionally, truncation errors in the T1 image are
+removed (high intensity voxels have a value of zero in these images, probably
+due to a bug in the reconstruction software). These voxels are set to the
+maximum value in the images.
+
+The face mask is computed from a subsample of slices of the PDw image, and the
+minimum & maximum of the T1 image are obtained in one pass over the T1 image.
+The images are then processed in parallel (one process per image). Each image
+is read and written slab-by-slab (along the last dimension), so that only a
+few slabs are held in memory at a time; the truncation error is corrected in
+the same pass as the defacing. The images are saved with their original
+on-disk data type and scaling.
 """
 
 # Part of PacMan analysis pipeline.
@@ -26,101 +36,34 @@ the images.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import sys
+import multiprocessing as mp
 import numpy as np
-import nibabel as nb
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.nii_iter import iter_vols  #noqa
+from pacman_utils.nii_iter import load_hdr  #noqa
+from pacman_utils.nii_iter import save_vols  #noqa
+from pacman_utils.deface import project  #noqa
+from pacman_utils.deface import face_box  #noqa
+from pacman_utils.deface import box_min_max  #noqa
+from pacman_utils.deface import apply_box  #noqa
+from pacman_utils.deface import save_box  #noqa
+from pacman_utils.deface import load_box  #noqa
 
 # ------------------------------------------------------------------------------
-# ### Function definitions
-
-
-def load_nii(strPathIn, varSzeThr=5000.0):
-    """
-    Load nii file.
-
-    Parameters
-    ----------
-    strPathIn : str
-        Path to nii file to load.
-    varSzeThr : float
-        If the nii file is larger than this threshold (in MB), the file is
-        loaded volume-by-volume in order to prevent memory overflow. Default
-        threshold is 1000 MB.
-
-    Returns
-    -------
-    aryNii : np.array
-        Array containing nii data. 32 bit floating point precision.
-    objHdr : header object
-        Header of nii file.
-    aryAff : np.array
-        Array containing 'affine', i.e. information about spatial positioning
-        of nii data.
-
-    Notes
-    -----
-    If the nii file is larger than the specified threshold (`varSzeThr`), the
-    file is loaded volume-by-volume in order to prevent memory overflow. The
-    reason for this is that nibabel imports data at float64 precision, which
-    can lead to a memory overflow even for relatively small files.
-    """
-    # Load nii file (this does not load the data into memory yet):
-    objNii = nb.load(strPathIn)
-
-    # Get size of nii file:
-    varNiiSze = os.path.getsize(strPathIn)
-
-    # Convert to MB:
-    varNiiSze = np.divide(float(varNiiSze), 1000000.0)
-
-    # Load volume-by-volume or all at once, depending on file size:
-    if np.greater(varNiiSze, float(varSzeThr)):
-
-        # Load large nii file
-
-        print(('---------Large file size ('
-              + str(np.around(varNiiSze))
-              + ' MB), reading volume-by-volume'))
-
-        # Get image dimensions:
-        tplSze = objNii.shape
-
-        # Create empty array for nii data:
-        aryNii = np.zeros(tplSze, dtype=np.float32)
-
-        # Loop through volumes:
-        for idxVol in range(tplSze[3]):
-            aryNii[..., idxVol] = np.asarray(
-                  objNii.dataobj[..., idxVol]).astype(np.float32)
-
-    else:
-
-        # Load small nii file
-
-        # Load nii file (this doesn't load the data into memory yet):
-        objNii = nb.load(strPathIn)
-
-        # Load data into array:
-        aryNii = np.asarray(objNii.dataobj).astype(np.float32)
-
-    # Get headers:
-    objHdr = objNii.header
-
-    # Get 'affine':
-    aryAff = objNii.affine
-
-    # Output nii data (as numpy array), header, and 'affine':
-    return aryNii, objHdr, aryAff
-
-
-# ------------------------------------------------------------------------------
-# ### Deface MP2RAGE images
-
-print('-Deface MP2RAGE images')
+# ### Parameters
 
 # Load environmental variables defining the input data path:
 pacman_data_path = str(os.environ['pacman_data_path'])
 pacman_sub_id_bids = str(os.environ['pacman_sub_id_bids'])
 
+# Number of parallel processes:
+try:
+    varPar = int(os.environ['pacman_cpu'])
+except (KeyError, ValueError):
+    varPar = mp.cpu_count()
+
 # Full input data path:
 strPathIn = (pacman_data_path
              + 'BIDS/'
@@ -135,77 +78,175 @@ lstIn = ['mp2rage_inv1.nii.gz',
          'mp2rage_t1.nii.gz',
          'mp2rage_uni.nii.gz']
 
-# Loop through images:
-for strImage in lstIn:
+# T1 image (truncation error is corrected) and PDw image (reference for
+# truncation error correction):
+strT1 = 'mp2rage_t1.nii.gz'
+strPdw = 'mp2rage_pdw.nii.gz'
+
+# Compute face mask from the data? Otherwise, anterior voxels (along the
+# second dimension), starting at index `varFceSrt`, are set to zero:
+lgcFceAuto = True
+varFceSrt = 250
+
+# Image from which the face mask is computed:
+strFceRef = 'mp2rage_pdw.nii.gz'
+
+# Depth of face mask [mm] (distance from the most anterior point of the face
+# to the posterior boundary of the face mask):
+varFceDpth = 25.0
+
+# Distance [mm] from the most superior point of the head to the superior
+# boundary of the face mask (the forehead is left out, so that the face mask
+# does not reach the frontal lobe):
+varFceTop = 100.0
+
+# Height of face mask [mm] above the inferior boundary of the field of view
+# (overrides `varFceTop` if not None):
+varFceHgt = None
+
+# The face mask is computed from every n-th slice (along the last dimension)
+# of the reference image:
+varFceStp = 4
+
+# Path of face mask (bounding box; if it exists, e.g. when the images have been
+# defaced before, it is reused, because the face mask cannot be computed from
+# defaced images; it has to be removed, and the original images restored, if
+# the above parameters are changed):
+strPthBox = (pacman_data_path
+             + 'BIDS/derivatives/deface/'
+             + pacman_sub_id_bids
+             + '_face_box.json')
 
-    # Complete path of image to load:
-    strPthTmp = (strPathIn + strImage)
+# Number of slices (along the last dimension) per slab:
+varNumSlc = 16
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# ### Define functions
+
+def process_image(strPthIn, lstBox, strPthRef=None, varMin=None,
+                  varMax=None, varNumThrd=None):
+    """
+    Deface image, and optionally correct truncation error, slab-by-slab.
+
+    Parameters
+    ----------
+    strPthIn : str
+        Path of image (overwritten with the defaced image).
+    lstBox : list
+        Face mask (bounding box, see `pacman_utils.deface.face_box`).
+    strPthRef : str
+        Path of reference image (PDw) for truncation error correction. Voxels
+        that are minimum in the (defaced) image, but not in the (defaced)
+        reference image, are set to the maximum of the image. No correction
+        if None.
+    varMin, varMax : float
+        Minimum & maximum of the defaced image (for truncation error
+        correction).
+    varNumThrd : int
+        Number of compression threads (see `pacman_utils.nii_gzip.write_gz`).
+    """
+    print(('---Defacing: ' + strPthIn))
 
-    print(('---Defacing: ' + strPthTmp))
+    # Header (on-disk data type & scaling are kept) and affine:
+    objHdr, aryAff = load_hdr(strPthIn)
 
-    # Load image:
-    aryNiiTmp, objHdrTmp, aryAffTmp = load_nii(strPthTmp)
+    itrIn = iter_vols(strPthIn, varNumVol=varNumSlc)
 
-    # Set anterior voxels to zero:
-    aryNiiTmp[:, 250:, :] = 0.0
+    if strPthRef is None:
+        itrOut = (apply_box(aryBlk, idxSrt, lstBox)
+                  for idxSrt, aryBlk in itrIn)
 
-    # Create output nii object:
-    niiOut = nb.Nifti1Image(aryNiiTmp,
-                            aryAffTmp,
-                            header=objHdrTmp
-                            )
-    # Save nii:
-    nb.save(niiOut, strPthTmp)
+    else:
+        print(('---Correcting truncation errors: ' + strPthIn))
+
+        def _correct(itrIn, itrRef):
+            """Deface & correct truncation error, slab-by-slab."""
+            for (idxSrt, aryBlk), (_, aryRef) in zip(itrIn, itrRef):
+                apply_box(aryBlk, idxSrt, lstBox)
+                apply_box(aryRef, idxSrt, lstBox)
+                aryBlk[np.logical_and(np.equal(aryBlk, varMin),
+                                      np.not_equal(aryRef, varMin))] = varMax
+                yield aryBlk
+
+        itrOut = _correct(itrIn, iter_vols(strPthRef, varNumVol=varNumSlc))
+
+    # The image is written to a temporary file while it is being read, and
+    # replaced at the end:
+    strPthTmp = strPthIn.replace('.nii', '_tmp.nii')
+    save_vols(itrOut, strPthTmp, objHdr, aryAff, varNumThrd=varNumThrd)
+    os.replace(strPthTmp, strPthIn)
 # ------------------------------------------------------------------------------
 
 
 # ------------------------------------------------------------------------------
-# ### Correct truncation errors in T1 image
+# ### Deface MP2RAGE images & correct truncation errors in T1 image
 
-print('-Correct truncation errors in T1 image')
+if __name__ == '__main__':
 
-# Load environmental variables defining the input data path:
-# pacman_data_path = str(os.environ['pacman_data_path'])
-# pacman_sub_id_bids = str(os.environ['pacman_sub_id_bids'])
+    print('-Deface MP2RAGE images & correct truncation errors in T1 image')
 
-# Full input data path:
-# strPathIn = (pacman_data_path
-#              + 'BIDS/'
-#              + pacman_sub_id_bids
-#              + '/anat/')
+    # Parameters of face mask (stored with the face mask):
+    if lgcFceAuto:
+        dicFcePrm = {'auto': True, 'depth': varFceDpth, 'top': varFceTop,
+                     'height': varFceHgt, 'step': varFceStp}
+    else:
+        dicFcePrm = {'auto': False, 'start': varFceSrt}
 
-# List of images to deface:
-lstIn = ['mp2rage_inv1.nii.gz',
-         'mp2rage_inv1_phase.nii.gz',
-         'mp2rage_pdw.nii.gz',
-         'mp2rage_pdw_phase.nii.gz',
-         'mp2rage_t1.nii.gz',
-         'mp2rage_uni.nii.gz']
+    # Face mask (bounding box):
+    lstBox = load_box(strPthBox, dicPrm=dicFcePrm)
+    if lstBox is not None:
+        print('---Using existing face mask: ' + strPthBox)
+    else:
+        print('---Computing face mask')
+        if lgcFceAuto:
+            aryMip, _, aryAff, tplShp = project(
+                (strPathIn + strFceRef), varNumSlc=varNumSlc,
+                varStp=varFceStp)
+            lstBox = face_box(aryMip, aryAff, tplShp, varDpth=varFceDpth,
+                              varTop=varFceTop, varHgt=varFceHgt)
+        else:
+            tplShp = load_hdr(strPathIn + strFceRef)[0].get_data_shape()
+            lstBox = [[0, tplShp[0]], [varFceSrt, tplShp[1]], [0, tplShp[2]]]
+        if not os.path.isdir(os.path.dirname(strPthBox)):
+            os.makedirs(os.path.dirname(strPthBox))
+        save_box(strPthBox, lstBox, (strPathIn + strFceRef), dicPrm=dicFcePrm)
+    print('---Face mask (bounding box): ' + str(lstBox))
+
+    # Minimum & maximum projections of T1 image (for minimum & maximum after
+    # defacing):
+    print('---Computing T1 range')
+    aryMaxT1, aryMinT1, aryAff, _ = project((strPathIn + strT1),
+                                            varNumSlc=varNumSlc, lgcMin=True)
+
+    varMin, varMax = box_min_max(aryMinT1, aryMaxT1, aryAff, lstBox)
+
+    # Number of parallel processes, and of compression threads per process
+    # (the CPUs are shared between them):
+    varNumPrc = max(min(varPar, len(lstIn)), 1)
+    varNumThrd = max(1, (varPar // varNumPrc))
+
+    # One task per image (the T1 image is corrected with reference to the PDw
+    # image; images are replaced atomically, so that the PDw image can be
+    # read while it is processed):
+    lstTsk = []
+    for strImage in lstIn:
+        if strImage == strT1:
+            lstTsk.append(((strPathIn + strImage), lstBox,
+                           (strPathIn + strPdw), varMin, varMax, varNumThrd))
+        else:
+            lstTsk.append(((strPathIn + strImage), lstBox, None, None, None,
+                           varNumThrd))
+
+    if varNumPrc > 1:
+        objPool = mp.Pool(processes=varNumPrc)
+        objPool.starmap(process_image, lstTsk)
+        objPool.close()
+        objPool.join()
+    else:
+        for tplTsk in lstTsk:
+            process_image(*tplTsk)
 
-# Complete paths of images to load:
-strPthT1 = (strPathIn + 'mp2rage_t1.nii.gz')
-strPthPdw = (strPathIn + 'mp2rage_pdw.nii.gz')
-
-# Load images:
-aryNiiT1, objHdrT1, aryAffT1 = load_nii(strPthT1)
-aryNiiPwd, _, _ = load_nii(strPthPdw)
-
-# Minimum and maximum in T1 image:
-varMin = np.amin(aryNiiT1)
-varMax = np.amax(aryNiiT1)
-
-# Find voxels that are minimum (zero) in the T1 image, but not in the PDw
-# image, and set them to max:
-aryLgc01 = np.equal(aryNiiT1, varMin)
-aryLgc02 = np.not_equal(aryNiiPwd, varMin)
-aryLgc03 = np.logical_and(aryLgc01, aryLgc02)
-aryNiiT1[aryLgc03] = varMax
-
-# Create output nii object:
-niiT1Out = nb.Nifti1Image(aryNiiT1,
-                          aryAffT1,
-                          header=objHdrT1
-                          )
-# Save nii:
-nb.save(niiT1Out, strPthT1)
+    print('-Done.')
 # ------------------------------------------------------------------------------
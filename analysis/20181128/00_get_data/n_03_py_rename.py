@@ -6,6 +6,10 @@ The dicom to nii conversion tool (dcm2niix) sometime appends a suffix (`_e1`)
 to nii files. It does not seem to be possible to disable this, and it is not
 clear under which circumstances the suffix is added. Thus, it has to be
 removed.
+
+The rename rule is defined in `group/rename_config.json` (stage 'dcm2niix',
+see `pacman_utils.rename`). Renamed files are recorded in a manifest, so that
+only new files are renamed when the script is run again.
 """
 
 # Part of LGN pRF analysis pipeline.
@@ -25,29 +29,23 @@ removed.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-from os.path import isfile, join
+import sys
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.rename import load_config  #noqa
+from pacman_utils.rename import rename_sessions  #noqa
 
 # Load environmental variables defining the input data path:
 strDataPth = str(os.environ['pacman_data_path'])
 strSubId = str(os.environ['pacman_sub_id'])
 
-# Full directory, e.g. '/media/sf_D_DRIVE/MRI_Data_PhD/08_lgn_prf/
-# derivatives/sub-01/raw_data/ses-01/':
-strPathIn = (strDataPth
-             + strSubId
-             + '/nii/raw_data/')
-
-# Get list of files in results directory:
-lstFls = [f for f in os.listdir(strPathIn) if isfile(join(strPathIn, f))]
-
-# Rename nii files with '_e1' suffix:
-for strTmp in lstFls:
-    if '_e1.' in strTmp:
+# Rename config:
+strPthCfg = (str(os.environ['pacman_anly_path'])
+             + 'group/rename_config.json')
 
-        # Split into file path+name (without '_e1') and suffix (e.g.
-        # 'nii.gz').
-        strPth, strSuff = tuple(strTmp.split('_e1.'))
+# Rename nii files with '_e1' suffix (in '<data>/<sub>/nii/raw_data/'):
+dicOut = rename_sessions(strDataPth, load_config(strPthCfg), [strSubId],
+                         ['dcm2niix'])
 
-        # Rename file:
-        os.rename((strPathIn + strTmp),
-                  (strPathIn + strPth + '.' + strSuff))
+for strDir, dicRen in sorted(dicOut[strSubId].items()):
+    print('---Directory: ' + strDir + ' (' + str(len(dicRen)) + ' files)')
@@ -14,8 +14,13 @@ need to be of the same length.
 import os
 import copy
 import time
+import sys
 import numpy as np
 import nibabel as nb
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.nii_io import load_nii  #noqa
+from pacman_utils.nii_io import save_nii  #noqa
 
 # -----------------------------------------------------------------------------
 # *** Check time
@@ -155,12 +160,12 @@ for index_02 in range(0, varNumIn_01):
 
     print('------Loading 4D nii data')
 
-    # Load input 4D nii files:
-    niiTmp = nb.load(
-                     (strPathParent + lstIn_01[index_02])
-                     )
-    # Load data of current run into memory:
-    aryTmpRun = niiTmp.get_data().astype(np.float32)
+    # Load input 4D nii files (an uncompressed working copy is used if
+    # available, in which case the data are memory-mapped):
+    aryTmpRun, hdrTmp, aryAffTmp = load_nii(
+                                            (strPathParent
+                                             + lstIn_01[index_02])
+                                            )
 
     # -------------------------------------------------------------------------
     # *** Preparations after loading the first nii file
@@ -169,7 +174,7 @@ for index_02 in range(0, varNumIn_01):
 
         # Get header of first input image (headers, and therefore image
         # dimensions, are assummed to be identical across runs):
-        hdr_01 = niiTmp.header
+        hdr_01 = hdrTmp
         # Image dimensions:
         aryDim = np.copy(hdr_01['dim'])
         # Calculate length of segments to be created during the averaging:
@@ -314,7 +319,7 @@ for index_02 in range(0, varNumIn_01):
 
             # Create nii object:
             niiTmpTrial = nb.Nifti1Image(aryTmpTrial,
-                                         niiTmp.affine,
+                                         aryAffTmp,
                                          header=hdr_02
                                          )
 
@@ -374,14 +379,15 @@ print('---Saving resulting 4D nii file (average across runs)')
 
 # Create nii object:
 niiAvrg = nb.Nifti1Image(aryAvrg,
-                         niiTmp.affine,
+                         aryAffTmp,
                          header=hdr_01
                          )
 
-# Save nii image:
-nb.save(niiAvrg,
-        (strPathOut + strOutFileName)
-        )
+# Save nii image (compressed, as expected by the subsequent shell stage, which
+# upsamples the average with FSL):
+save_nii(niiAvrg,
+         (strPathOut + strOutFileName),
+         varLvl='timeseries')
 
 # -----------------------------------------------------------------------------
 # *** Check time
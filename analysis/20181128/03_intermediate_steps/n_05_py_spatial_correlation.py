@@ -19,8 +19,12 @@ motion correction can be assessed.
 # *** Import modules
 
 import os
+import sys
 import numpy as np
-import nibabel as nb
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.nii_io import load_nii  #noqa
+from pacman_utils.nii_iter import iter_vols  #noqa
 import matplotlib
 # Configure matplotlib for use in docker container (i.e. without display):
 matplotlib.use('Agg')
@@ -98,11 +102,8 @@ for strSub, lstRun in dicSubId.items():  #noqa
 
         # *** Load reference image
 
-        # Load reference nii file (this doesn't load the data into memory yet):
-        niiTmpRef = nb.load(strPathRefTmp)
-
-        # Load the data into memory:
-        aryTmpRef = niiTmpRef.get_data()
+        # Load reference nii file:
+        aryTmpRef, _, _ = load_nii(strPathRefTmp)
         aryTmpRef = np.array(aryTmpRef)
 
         # Use reference mask?
@@ -110,9 +111,7 @@ for strSub, lstRun in dicSubId.items():  #noqa
             strPathMskTmp = strPathMsk.format(strSub, strSub)
             print('---Applying mask:')
             print('------' + strPathMskTmp)
-            niiTmpMsk = nb.load(strPathMskTmp)
-            # Load data into memory:
-            aryTmpMsk = niiTmpMsk.get_data()
+            aryTmpMsk, _, _ = load_nii(strPathMskTmp)
             aryTmpMsk = np.array(aryTmpMsk)
             # Flatten the array into a vector:
             vecTmpMsk = aryTmpMsk.flatten(order='C')
@@ -122,6 +121,9 @@ for strSub, lstRun in dicSubId.items():  #noqa
         # one column, with one row per voxel:
         aryTmpRef = aryTmpRef.flatten(order='C')
 
+        # Replace NaNs with zeros in the reference image:
+        aryTmpRef = np.nan_to_num(aryTmpRef)
+
         # *** Load time series:
 
         # Path of timeseries of current run:
@@ -130,75 +132,72 @@ for strSub, lstRun in dicSubId.items():  #noqa
         print('---Time series image:')
         print('------' + strPathInTmp)
 
-        # Load 4D nii file (this doesn't load the data into memory yet):
-        niiTmpSrc = nb.load(strPathInTmp)
-        # Load the data into memory:
-        aryTmpSrc = niiTmpSrc.get_data()
-        aryTmpSrc = np.array(aryTmpSrc)
-        # Get the shape of the 4D file:
-        vecTmpShape = aryTmpSrc.shape
-
-        # Get the number of volumes in the 4D file (assuming that the 4th
-        # image dimension corresponds to time):
-        varTmpNumVols = vecTmpShape[3]
         if idxRun == 0:
             # On the first iteration of the loop, we create a list that will
             # be filled with the correlation coefficients of all volumes:
             lstCorr = [None] * varNumInRef
 
-        # Array for correlation coefficients of all volumes of current run:
-        aryTmpCorr = np.zeros(varTmpNumVols)
+        # List for correlation coefficients of all volumes of current run:
+        lstTmpCorr = []
 
         # *** Secondary loop (volumes in 4D file)
 
-        for idxVol in range(0, varTmpNumVols):
-
-            # Get 3D file:
-            aryTmpSrc_3D = aryTmpSrc[:, :, :, idxVol]
-            # Flatten the array into a vector:
-            aryTmpSrc_3D = aryTmpSrc_3D.flatten(order='C')
-
-            # *** Replace NaNs with zeros
-
-            # Replace NaNs with zeros in the reference image:
-            aryTmpRef = np.nan_to_num(aryTmpRef)
-            # Replace NaNs with zeros in the source image:
-            aryTmpSrc_3D = np.nan_to_num(aryTmpSrc_3D)
-
-            # *** Exclude zero-elements
-
-            # We have to exclude all datapoints that have a zero as a value in
-            # both of the images. We first add both vectors. In the resulting
-            # vector, datapoints that are zero in both images remain zero. All
-            # other datapoints are non-zero.
-            vecTmpSum = np.absolute(aryTmpRef) + np.absolute(aryTmpSrc_3D)
-
-            # Use mask?
-            if lgcMsk:
-                # Apply mask:
-                vecTmpSum = np.multiply(vecTmpSum,
-                                        vecTmpMsk)
-            # We create an array with the indices of the non-zero elements:
-            vecTmpIdxNonzero = np.array(np.nonzero(vecTmpSum))
-
-            # print('---------Volume: ' +
-            #       str(idxVol) +
-            #       ' Number of nonzero voxels: ' +
-            #       str(vecTmpIdxNonzero.size))
-
-            # We create a temporary vector with the non-zero elements for each
-            # of the images:
-            vecTmpNonzeroRef = aryTmpRef[vecTmpIdxNonzero]
-            vecTmpNonzeroSrc = aryTmpSrc_3D[vecTmpIdxNonzero]
-
-            # *** Calculate correlations
-
-            # Calculate correlation coefficient. The output is a covariance
-            # matrix:
-            aryTmpCov = np.corrcoef(vecTmpNonzeroRef,
-                                    vecTmpNonzeroSrc)
-            # Access correlation between reference image and source image:
-            aryTmpCorr[idxVol] = aryTmpCov[0][1]
+        # The 4D file is read in blocks of volumes (the next block is read in
+        # the background while the current block is processed), so that the
+        # full time series does not need to be held in memory:
+        for idxVol, aryTmpBlk in iter_vols(strPathInTmp, varNumVol=10):
+
+            for idxBlk in range(aryTmpBlk.shape[3]):
+
+                # Get 3D file:
+                aryTmpSrc_3D = aryTmpBlk[:, :, :, idxBlk]
+                # Flatten the array into a vector:
+                aryTmpSrc_3D = aryTmpSrc_3D.flatten(order='C')
+
+                # *** Replace NaNs with zeros
+
+                # Replace NaNs with zeros in the source image:
+                aryTmpSrc_3D = np.nan_to_num(aryTmpSrc_3D)
+
+                # *** Exclude zero-elements
+
+                # We have to exclude all datapoints that have a zero as a value
+                # in both of the images. We first add both vectors. In the
+                # resulting vector, datapoints that are zero in both images
+                # remain zero. All other datapoints are non-zero.
+                vecTmpSum = (np.absolute(aryTmpRef)
+                             + np.absolute(aryTmpSrc_3D))
+
+                # Use mask?
+                if lgcMsk:
+                    # Apply mask:
+                    vecTmpSum = np.multiply(vecTmpSum,
+                                            vecTmpMsk)
+                # We create an array with the indices of the non-zero
+                # elements:
+                vecTmpIdxNonzero = np.array(np.nonzero(vecTmpSum))
+
+                # print('---------Volume: ' +
+                #       str(idxVol + idxBlk) +
+                #       ' Number of nonzero voxels: ' +
+                #       str(vecTmpIdxNonzero.size))
+
+                # We create a temporary vector with the non-zero elements for
+                # each of the images:
+                vecTmpNonzeroRef = aryTmpRef[vecTmpIdxNonzero]
+                vecTmpNonzeroSrc = aryTmpSrc_3D[vecTmpIdxNonzero]
+
+                # *** Calculate correlations
+
+                # Calculate correlation coefficient. The output is a
+                # covariance matrix:
+                aryTmpCov = np.corrcoef(vecTmpNonzeroRef,
+                                        vecTmpNonzeroSrc)
+                # Access correlation between reference image and source
+                # image:
+                lstTmpCorr.append(aryTmpCov[0][1])
+
+        aryTmpCorr = np.array(lstTmpCorr)
 
         # Put correlation values of current run into list:
         lstCorr[idxRun] = aryTmpCorr
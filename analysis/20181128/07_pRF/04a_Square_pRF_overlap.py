@@ -31,6 +31,14 @@ import numpy as np
 import nibabel as nib
 import time
 import multiprocessing as mp
+import sys
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.timing import get_worker_timing  #noqa
+from pacman_utils.timing import summarise_timing  #noqa
+from pacman_utils.timing import save_timing_report  #noqa
+from pacman_utils.nii_io import load_nii  #noqa
+from pacman_utils.nii_io import save_nii  #noqa
 # *****************************************************************************
 
 
@@ -140,21 +148,6 @@ varTme01 = time.time()
 # *** Define functions
 
 
-def fncLoadNii(strPathIn):
-    """Load nii files."""
-    print(('---------Loading: ' + strPathIn))
-    # Load nii file (this doesn't load the data into memory yet):
-    niiTmp = nib.load(strPathIn)
-    # Load data into array:
-    aryTmp = niiTmp.get_data()
-    # Get headers:
-    hdrTmp = niiTmp.header
-    # Get 'affine':
-    niiAff = niiTmp.affine
-    # Output nii data as numpy array and header:
-    return aryTmp, hdrTmp, niiAff
-
-
 def fncPrfOvrlp(idxPrc,
                 aryNiiXChnk,
                 aryNiiYChnk,
@@ -177,6 +170,9 @@ def fncPrfOvrlp(idxPrc,
     # Number of voxels in this chunk of data:
     varNumVoxChnk = aryNiiXChnk.size
 
+    # Start time of this worker (for throughput report):
+    varTmeSrt = time.time()
+
     # Array for result (overlap ratio) for this chunk of data:
     aryRatioChnk = np.zeros(varNumVoxChnk)
 
@@ -227,6 +223,14 @@ def fncPrfOvrlp(idxPrc,
                              ' voxels out of ' +
                              str(int(varNumVoxChnk) * varPar))
 
+                # Throughput of this worker so far:
+                varTmeTmp = time.time() - varTmeSrt
+                if varTmeTmp > 0.0:
+                    strStsMsg = (strStsMsg
+                                 + ' --- '
+                                 + str(int(varCntSts02 / varTmeTmp))
+                                 + ' voxels/s per worker')
+
                 print(strStsMsg)
 
                 # Only increment counter if the last value has not been
@@ -305,10 +309,15 @@ def fncPrfOvrlp(idxPrc,
             # Increment status indicator counter:
             varCntSts02 = varCntSts02 + 1
 
+    # Timing information of this worker (number of voxels, processing time,
+    # throughput, peak memory):
+    dicTmng = get_worker_timing(idxPrc, varNumVoxChnk, varTmeSrt)
+
     # Prepare output list:
     lstOut = [idxPrc,
               aryRatioChnk,
-              aryCentreChnk]
+              aryCentreChnk,
+              dicTmng]
 
     queOut.put(lstOut)
 # *****************************************************************************
@@ -321,10 +330,10 @@ print('---Preparations')
 
 # Load nii files:
 print('------Loading nii files')
-aryNiiX, hdrNiiX, aryAffX = fncLoadNii(strNiiX)
-aryNiiY, hdrNiiY, aryAffY = fncLoadNii(strNiiY)
-aryNiiSd, hdrNiiSd, aryAffSd = fncLoadNii(strNiiSd)
-aryNiiR2, hdrNiiR2, aryAffR2 = fncLoadNii(strNiiR2)
+aryNiiX, hdrNiiX, aryAffX = load_nii(strNiiX)
+aryNiiY, hdrNiiY, aryAffY = load_nii(strNiiY)
+aryNiiSd, hdrNiiSd, aryAffSd = load_nii(strNiiSd)
+aryNiiR2, hdrNiiR2, aryAffR2 = load_nii(strNiiR2)
 
 print('------Preparing arrays')
 
@@ -431,6 +440,11 @@ vecNiiShp = aryNiiX.shape
 # *****************************************************************************
 
 
+# List for timing information of each ROI (for timing report):
+lstRoiTmng = []
+# *****************************************************************************
+
+
 # *****************************************************************************
 # *** Loop through ROIs (central square, edge, periphery)
 
@@ -454,6 +468,9 @@ for idxRoi in range(4):  #noqa
 
     print('---Calculating stimulus-pRF overlap')
 
+    # Start time for current ROI:
+    varTmeRoi = time.time()
+
     # Empty lists for chunks of nii data:
     lstNiiX = [None] * varPar
     lstNiiY = [None] * varPar
@@ -570,6 +587,7 @@ for idxRoi in range(4):  #noqa
     # the correct (original) order:
     lstResRatio = [None] * varPar
     lstResCentre = [None] * varPar
+    lstResTmng = [None] * varPar
 
     # Put output into correct order:
     for idxRes in range(0, varPar):
@@ -580,6 +598,7 @@ for idxRoi in range(4):  #noqa
         # Put fitting results into list, in correct order:
         lstResRatio[varTmpIdx] = lstRes[idxRes][1]
         lstResCentre[varTmpIdx] = lstRes[idxRes][2]
+        lstResTmng[varTmpIdx] = lstRes[idxRes][3]
 
     # Concatenate output vectors (into the same order as the voxels that were
     # included in the parallel processes):
@@ -662,8 +681,10 @@ for idxRoi in range(4):  #noqa
         strHmf = 'diamond'
 
     # Save nii to disk:
-    nib.save(niiOtRatio, (strNiiOt + 'ovrlp_ratio_' + strHmf + '.nii.gz'))
-    nib.save(niiOtCentre, (strNiiOt + 'ovrlp_ctnr_' + strHmf + '.nii.gz'))
+    save_nii(niiOtRatio, (strNiiOt + 'ovrlp_ratio_' + strHmf + '.nii.gz'),
+             varLvl='map')
+    save_nii(niiOtCentre, (strNiiOt + 'ovrlp_ctnr_' + strHmf + '.nii.gz'),
+             varLvl='mask')
 
     # Export overlap ratio images:
     for idxMsk in range(0, varNumMsk):
@@ -681,10 +702,27 @@ for idxRoi in range(4):  #noqa
                   + 'prct_'
                   + strHmf
                   + '.nii.gz')
-        nib.save(niiOtTmp, strTmp)
+        save_nii(niiOtTmp, strTmp, varLvl='mask')
+
+    # Summarise timing information for current ROI:
+    lstRoiTmng.append(summarise_timing(strHmf, lstResTmng, varTmeRoi))
     # *************************************************************************
 
 
+# *****************************************************************************
+# *** Save timing report
+
+# Parameters that are relevant for the interpretation of the timing:
+dicCfg = {'processes': varPar,
+          'supersampling': varSupSmp,
+          'grid_x': int(varXstep * varSupSmp),
+          'grid_y': int(varYstep * varSupSmp),
+          'r2_threshold': varThrR}
+
+save_timing_report((strNiiOt + 'ovrlp_timing.json'), lstRoiTmng, dicCfg)
+# *****************************************************************************
+
+
 # *****************************************************************************
 # *** Report time
 
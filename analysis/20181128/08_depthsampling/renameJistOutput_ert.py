@@ -13,6 +13,12 @@ file names at underscores.
 This is a makeshift function that will hopefully become redundant once the
 CBS depth sampling has a python interface.
 
+The prefixes to remove and the directories (per condition) are
+defined in `group/rename_config.json` (stage 'jist_ert', see
+`pacman_utils.rename`). Renamed files are recorded in a manifest, so that only
+new files are renamed when the script is run again (e.g. after re-running part
+of the JIST pipeline).
+
 @author: Ingo Marquardt, 17.02.2017
 """
 
@@ -32,10 +38,12 @@ CBS depth sampling has a python interface.
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-
 import os
-from os import listdir
-from os import rename
+import sys
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.rename import load_config  #noqa
+from pacman_utils.rename import rename_sessions  #noqa
 
 
 # %% Define parameters
@@ -44,59 +52,23 @@ from os import rename
 pacman_data_path = str(os.environ['pacman_data_path'])
 pacman_sub_id = str(os.environ['pacman_sub_id'])
 
-# Subject IDs & number of prefixes to remove for that subject:
-dicSubId = {pacman_sub_id: 6}
-
-# Paths with files to be renamed (subject ID left open):
-lstPths = [pacman_data_path + '{}/cbs/rh_era/bright_square_txtr/',
-           pacman_data_path + '{}/cbs/rh_era/bright_square_uni/',
-           pacman_data_path + '{}/cbs/rh_era/pacman_static_txtr/',
-           pacman_data_path + '{}/cbs/rh_era/pacman_static_uni/',
-           pacman_data_path + '{}/cbs/lh_era/bright_square_txtr/',
-           pacman_data_path + '{}/cbs/lh_era/bright_square_uni/',
-           pacman_data_path + '{}/cbs/lh_era/pacman_static_txtr/',
-           pacman_data_path + '{}/cbs/lh_era/pacman_static_uni/']
+# Rename config:
+strPthCfg = (str(os.environ['pacman_anly_path'])
+             + 'group/rename_config.json')
 
-# File type (suffix):
-strFleTpe = '.vtk'
-
-# Character for parsing filenames:
-strPrse = '_'
+# Rename stage:
+strStg = 'jist_ert'
 
 # %% Correct file names:
 
 print('-Rename JIST output')
 
-# Loop through subjects:
-for strSub in dicSubId:
-
-    print('---Processing: ' + strSub)
-
-    # Number of prefixes to remove for this subject:
-    varTmpPfxRmv = dicSubId[strSub]
-
-    # Loop through directories:
-    for strPth in lstPths:
-
-        print('------Directory: ' + strPth.format(strSub))
-
-        # List of all files and directories at target location:
-        lstFiles = listdir(strPth.format(strSub))
-
-        # Only keep files of specified type in the list:
-        lstFiles = [i for i in lstFiles if i[-4:] == strFleTpe]
-
-        # Loop through files:
-        for strFle in lstFiles:
-
-            # Parse file name:
-            lstTmp = strFle.split(strPrse)[varTmpPfxRmv:]
+print('---Processing: ' + pacman_sub_id)
 
-            # The new file name:
-            strTmp = '_'.join(lstTmp)
+dicOut = rename_sessions(pacman_data_path, load_config(strPthCfg),
+                         [pacman_sub_id], [strStg])
 
-            # Rename the file:
-            rename((strPth.format(strSub) + strFle),
-                   (strPth.format(strSub) + strTmp))
+for strDir, dicRen in sorted(dicOut[pacman_sub_id].items()):
+    print('------Directory: ' + strDir + ' (' + str(len(dicRen)) + ' files)')
 
 print('-Done')
@@ -38,8 +38,7 @@ aryCbs=(cbs_lh_glm_prf.LayoutXML \
 # Names of python scripts to run:
 aryPy=(renameJistOutput.py \
        renameJistOutput_ert.py \
-       postprocess_retinotopy_vtk_lh.py \
-       postprocess_retinotopy_vtk_rh.py \
+       postprocess_retinotopy_vtk.py \
        vtk_to_npy_conversion.py)
 
 # Working directory:
@@ -21,70 +21,56 @@ Function of the depth sampling pipeline.
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
-import numpy as np
+import os
+import sys
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.vtk_io import load_index  #noqa
+from pacman_utils.vtk_io import read_scalars  #noqa
 
 
 def funcLoadVtkMulti(strVtkIn,
                      strPrcdData,
                      varNumLne,
-                     varNumDpth):
+                     varNumDpth,
+                     lgcCache=True):
     """
     Function for loading vtk file with multiple data points per vertex.
 
     The vtk file to be loaded is supposed to be a cortex mesh with multiple
     values per vertex, e.g. statistical parameters at several cortical depth
     levels.
+
+    The positions of the sections of the vtk file (ASCII or binary) are
+    taken from its index (see `pacman_utils.vtk_io.load_index`), and only the
+    requested section is read. The vertex data are taken from the last
+    'SCALARS' section whose header starts with `strPrcdData`. `varNumLne`
+    (number of lines between section header and first data point) is not
+    needed anymore, and only kept for compatibility. The index is cached
+    next to the vtk file if `lgcCache` is True (for files that are read
+    repeatedly; not for files that are read once, e.g. per-volume files that
+    are deleted after conversion).
+
+    Returns the vertex data as array of shape `(vertices, varNumDpth)`, 32 bit
+    floating point precision.
     """
     # print('---------Importing vtk file with multiple values per vertex: '
     #       + strVtkIn)
 
-    # Open file:
-    fleVtkIn = open(strVtkIn, 'r')
-
-    # Read file:
-    csvIn = csv.reader(fleVtkIn,
-                       delimiter='\n',
-                       skipinitialspace=True)
-
-    # Create empty list for vertex data:
-    lstVtkData = []
-
-    # Loop through csv object to fill list with csv data:
-    for lstTmp in csvIn:
-        for strTmp in lstTmp:
-            lstVtkData.append(strTmp[:])
-
-    # Close file:
-    fleVtkIn.close()
-
-    # Get index of string (as specified above) which precedes the vertex data:
-    for idxSrch in range(0, len(lstVtkData)):
-        if lstVtkData[idxSrch].startswith((strPrcdData)):
-            varIdxTmp = idxSrch
-
-    # Get number of vertices from the line preceding the specified string:
-    strNumDataVrtx = lstVtkData[(varIdxTmp - 1)]
-
-    # The number of vertecies is preceded by the string 'POINT_DATA' in vtk
-    # files. We extract the number behind the string:
-    varNumDataVrtx = int(strNumDataVrtx[11:])
-
-    # Index of first vertex data point:
-    varIdxFrst = varIdxTmp + varNumLne
-
-    # Array for numeric vertex data:
-    aryVtkData = np.zeros((varNumDataVrtx, varNumDpth))
-
-    # Get numeric vertex data:
-    for idxData in range(0, varNumDataVrtx):
+    # Index of sections of vtk file:
+    dicIdx = load_index(strVtkIn, lgcCache=lgcCache)
 
-        # Line of current vertex in csv list:
-        varTmpStrt = varIdxFrst + idxData
+    # Get name of data section (as specified above):
+    strKey = None
+    for dicSct in dicIdx['sections']:
+        if ((dicSct['key'] == 'SCALARS') and dicSct['point_data']
+                and dicSct['line'].startswith(strPrcdData)):
+            strKey = dicSct['name']
 
-        # Put vertex data into array:
-        aryVtkData[idxData, :] = \
-            lstVtkData[varTmpStrt].split(' ')[0:varNumDpth]
+    if strKey is None:
+        raise ValueError('No data section starting with "' + strPrcdData
+                         + '" in file: ' + strVtkIn)
 
     # Return vertex data:
-    return aryVtkData
+    return read_scalars(strVtkIn, [strKey],
+                        dicIdx=dicIdx)[strKey][:, 0:varNumDpth]
@@ -38,6 +38,18 @@ pacman_wait=true
 
 # Number of parallel processes to use (for pRF finding):
 pacman_cpu="11"
+
+# File format for intermediate results of python stages. If 'nii', results
+# that are only read by subsequent pipeline stages are kept uncompressed, so
+# that they can be memory-mapped. If 'nii.gz', all files are compressed. Final
+# results are always compressed.
+pacman_wrk_fmt="nii.gz"
+
+# Scratch directory for uncompressed intermediate files that are only read by
+# python stages (optional). Leave empty to keep them next to the final results.
+# Needs to be located within the data parent directory, which is shared with
+# the docker container.
+pacman_wrk_path=""
 #-------------------------------------------------------------------------------
 
 
@@ -52,6 +64,8 @@ export pacman_data_path
 export pacman_from_bids
 export pacman_wait
 export pacman_cpu
+export pacman_wrk_fmt
+export pacman_wrk_path
 export USER=john
 #-------------------------------------------------------------------------------
 
@@ -71,6 +85,8 @@ docker run -it --rm \
     -e pacman_from_bids \
     -e pacman_wait \
     -e pacman_cpu \
+    -e pacman_wrk_fmt \
+    -e pacman_wrk_path \
     -e USER \
     dockerimage_surface_jessie ${pacman_anly_path}${pacman_sub_id}/metascript_02.sh
 #-------------------------------------------------------------------------------
@@ -0,0 +1,199 @@
+"""
+Create FSL EV files.
+
+Create EV files for an FSL FEAT analysis from custom-made event matrices used
+for stimulus presentation. The event matrices of all runs are loaded at once,
+events are grouped by run and event type with boolean masks, and the EV files
+of all variants (e.g. sustained responses, and transient onset & offset
+responses) are written in one pass.
+
+Usage (input directory containing `Run_XX_eventmatrix.txt` files; by default,
+EV files are written to the input directory, and to the same directory with
+the suffix of the variant, e.g. `version_03_transients/`):
+
+    python py_create_fsl_ev_files.py /path/to/version_03/ [--out /path/]
+
+(C) Ingo Marquardt, 2017
+"""
+
+
+# -----------------------------------------------------------------------------
+# *** Import modules
+
+import os
+import glob
+import argparse
+import numpy as np
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# *** Define parameters
+
+# Input file name (with run number left open):
+strFleNme = 'Run_{}_eventmatrix.txt'
+
+# The name of the events, in the order of their indexing in the event matrix,
+# per version of the experiment (name of the input directory). I.e., if REST
+# is coded as 1 and TARGET as 2, REST needs to be first, and TARGET second in
+# this list, etc.
+dicEventTypes = {'version_01': ['Rest',
+                                'Target',
+                                'Kanizsa',
+                                'Dark_square',
+                                'Bright_square'],
+                 'version_02': ['Rest',
+                                'Target',
+                                'Kanizsa',
+                                'Kanizsa_rotated',
+                                'Bright_square'],
+                 'version_03': ['Rest',
+                                'Target',
+                                'PacMan_static',
+                                'Bright_square']}
+
+# EV file variants, and suffix of their output directory. Sustained: one
+# entry per event (onset & duration of the event). Transients: onset and
+# offset of each event are modelled as separate events with a duration of one
+# second.
+dicVariants = {'sustained': '',
+               'transients': '_transients'}
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# *** Define functions
+
+def get_ev(vecOns, vecDur, strVar):
+    """
+    Create EV file content (three column format) for one event type.
+
+    Parameters
+    ----------
+    vecOns : np.array
+        Onset times of events [s].
+    vecDur : np.array
+        Durations of events [s].
+    strVar : str
+        EV file variant (see `dicVariants`).
+
+    Returns
+    -------
+    aryEv : np.array
+        EV file content (onset, duration, weight), one row per event.
+    """
+    vecOne = np.ones(vecOns.shape)
+    if strVar == 'sustained':
+        return np.stack((vecOns, vecDur, vecOne), axis=1)
+    elif strVar == 'transients':
+        # Onset and offset of each event, in consecutive rows:
+        aryEv = np.stack((np.stack((vecOns, vecOne, vecOne), axis=1),
+                          np.stack(((vecOns + vecDur), vecOne, vecOne),
+                                   axis=1)),
+                         axis=1)
+        return aryEv.reshape((-1, 3))
+    raise ValueError('Unknown EV file variant: ' + strVar)
+# -----------------------------------------------------------------------------
+
+
+# -----------------------------------------------------------------------------
+# *** Create EV files
+
+if __name__ == '__main__':
+
+    objPrsr = argparse.ArgumentParser(description='Create FSL EV files.')
+    objPrsr.add_argument('input',
+                         help='Directory containing event matrices.')
+    objPrsr.add_argument('--out', default=None,
+                         help='Output directory (default: input directory).'
+                         + ' EV file variants other than sustained are'
+                         + ' written to the output directory with suffix'
+                         + ' (e.g. `_transients`).')
+    objPrsr.add_argument('--runs', nargs='+', default=None,
+                         help='Runs (e.g. 01 02). Default: all event'
+                         + ' matrices in the input directory.')
+    objPrsr.add_argument('--events', nargs='+', default=None,
+                         help='Names of event types, in the order of their'
+                         + ' coding in the event matrix. Default: by version'
+                         + ' (name of input directory).')
+    objPrsr.add_argument('--variants', nargs='+',
+                         default=sorted(dicVariants.keys()),
+                         choices=sorted(dicVariants.keys()),
+                         help='EV file variants.')
+    objArgs = objPrsr.parse_args()
+
+    strPathInput = os.path.normpath(objArgs.input)
+    if objArgs.out is None:
+        strPathOutput = strPathInput
+    else:
+        strPathOutput = os.path.normpath(objArgs.out)
+
+    if objArgs.events is None:
+        lstEventTypes = dicEventTypes[os.path.basename(strPathInput)]
+    else:
+        lstEventTypes = objArgs.events
+
+    # List of runs (all event matrices in the input directory by default):
+    if objArgs.runs is None:
+        lstRuns = sorted(
+            [os.path.basename(strTmp).split('_')[1] for strTmp in
+             glob.glob(os.path.join(strPathInput, strFleNme.format('*')))])
+    else:
+        lstRuns = objArgs.runs
+
+    print('-Create FSL EV files: ' + strPathInput)
+
+    # Read event matrices of all runs (event type, onset, duration), and
+    # concatenate them, with run index:
+    lstData = [np.loadtxt(os.path.join(strPathInput, strFleNme.format(strRun)),
+                          dtype='float',
+                          comments='#',
+                          delimiter=' ',
+                          skiprows=0,
+                          usecols=(0, 1, 2),
+                          ndmin=2)
+               for strRun in lstRuns]
+    aryData = np.concatenate(lstData, axis=0)
+    vecRun = np.repeat(np.arange(len(lstRuns)),
+                       [aryTmp.shape[0] for aryTmp in lstData])
+
+    for strVar in objArgs.variants:
+        strTmp = strPathOutput + dicVariants[strVar]
+        if not os.path.isdir(strTmp):
+            os.makedirs(strTmp)
+
+    # Loop through runs & event types (one EV file per run, event type, and
+    # variant):
+    for idxRun, strRun in enumerate(lstRuns):
+
+        lgcRun = np.equal(vecRun, idxRun)
+
+        for idxCon, strCon in enumerate(lstEventTypes):
+
+            # Events of current type in current run (the event type is coded
+            # in the first column of the event matrix, starting at one):
+            lgcTmp = np.logical_and(lgcRun,
+                                    np.equal(aryData[:, 0], (idxCon + 1)))
+
+            print('---Run ' + strRun + ', ' + strCon + ': '
+                  + str(np.sum(lgcTmp)) + ' events')
+
+            for strVar in objArgs.variants:
+
+                aryOutput = get_ev(aryData[lgcTmp, 1], aryData[lgcTmp, 2],
+                                   strVar)
+
+                # Create file name:
+                strTmpFilename = os.path.join(
+                    (strPathOutput + dicVariants[strVar]),
+                    ('EV_func_' + strRun + '_' + strCon + '.txt'))
+
+                # Save EV file:
+                np.savetxt(strTmpFilename,
+                           aryOutput,
+                           fmt='%.2f %.2f %.1f',
+                           delimiter=' ',
+                           newline='\n')
+
+    print('done')
+# -----------------------------------------------------------------------------
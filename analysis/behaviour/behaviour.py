@@ -3,7 +3,15 @@
 Read experiment log files and evaluate behavioural performance.
 
 Experiment log files are read, and subjects' behavioural performance on
-central fixation task is evaluated.
+central fixation task is evaluated. Log files are parsed into event tables
+(cached next to the log files, see `parse_log.py`), and targets are matched
+with hits & misses, giving a trial table with reaction times. Thus, runs that
+were aborted (i.e. without performance summary in the log file) are included,
+as long as there were any targets.
+
+The log files of all sessions are parsed in parallel (one process per log
+file). A per-trial table, per-run summaries, and per-subject summaries are
+saved as csv files.
 """
 
 # Part of PacMan analysis library
@@ -23,9 +31,14 @@ central fixation task is evaluated.
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import csv
 import glob
+import multiprocessing as mp
 import numpy as np
-from load_csv_log import load_csv_log
+from parse_log import load_events
+from parse_log import get_performance
+from parse_log import get_trials
 
 
 # *****************************************************************************
@@ -35,57 +48,193 @@ from load_csv_log import load_csv_log
 lstSubIds = ['20181029',
              '20181105',
              '20181107',
-             '20181108']
+             '20181108',
+             '20181128',
+             '20190207']
 
 # Path of log files. Subject ID, subject ID, and filname left open.
 strPthLog = '/media/sf_D_DRIVE/MRI_Data_PhD/09_surface/{}/log/surface_stim/log/{}/{}.log'
-# *****************************************************************************
 
+# Output directory (for csv files with per-trial table, per-run and
+# per-subject summaries):
+strPthOut = '/media/sf_D_DRIVE/MRI_Data_PhD/09_surface/group/behaviour/'
 
+# Number of parallel processes:
+try:
+    varPar = int(os.environ['pacman_cpu'])
+except (KeyError, ValueError):
+    varPar = mp.cpu_count()
 # *****************************************************************************
-# *** Read log files
-
-print('-Evaluiate behavioural performance')
-
-# Number of subjects:
-varNumSub = len(lstSubIds)
-
-# List for percent hits:
-lstHits = []
-
-for idxSub in range(varNumSub):
-
-    print(('--Subject ' + lstSubIds[idxSub]))
-
-    # Current log directory path (with wildcard for filname):
-    strTmp = strPthLog.format(lstSubIds[idxSub], lstSubIds[idxSub], '*')
 
-    # Get list of log files for current subjcet:
-    lstFls = sorted(glob.glob(strTmp))
 
-    # Loop through log files (i.e. runs):
-    for idxRun in range(len(lstFls)):
-
-        try:
-            # Get percent of hits from log file:
-            varPcntHit = load_csv_log(lstFls[idxRun])
-
-            print(('---Run ' + str(idxRun + 1) + ': ' + str(varPcntHit)))
-
-            lstHits.append(varPcntHit)
-
-        except StopIteration:
-            # If the run was aborted, there is no information on percent hits
-            # in the log file.
-            pass
+# *****************************************************************************
+# *** Define functions
+
+def evaluate_run(tplTsk):
+    """
+    Parse log file of one run, and get trial table & run completion.
+
+    Parameters
+    ----------
+    tplTsk : tuple
+        Subject ID, run index (zero based), path of log file.
+
+    Returns
+    -------
+    tplOut : tuple
+        Subject ID, run index, trial table (see `parse_log.get_trials`), and
+        whether the run was completed.
+    """
+    strSub, idxRun, strPthTmp = tplTsk
+    dicEvnt = load_events(strPthTmp)
+    return (strSub,
+            idxRun,
+            get_trials(dicEvnt),
+            get_performance(dicEvnt)['complete'])
+
+
+def summarise(vecHit, vecRt):
+    """
+    Summarise trials (hits & reaction times).
+
+    Parameters
+    ----------
+    vecHit : np.array
+        Hits (1.0), misses (0.0), and targets without response (NaN).
+    vecRt : np.array
+        Reaction times (NaN for trials without hit).
+
+    Returns
+    -------
+    lstOut : list
+        Number of targets, hits & misses, percentage of hits (NaN if there
+        were no responses), mean & median reaction time (NaN if there were no
+        hits).
+    """
+    varNumHit = int(np.sum(np.equal(vecHit, 1.0)))
+    varNumMis = int(np.sum(np.equal(vecHit, 0.0)))
+    if 0 < (varNumHit + varNumMis):
+        varPcntHit = 100.0 * float(varNumHit) / float(varNumHit + varNumMis)
+    else:
+        varPcntHit = np.nan
+    vecRt = vecRt[np.isfinite(vecRt)]
+    if 0 < vecRt.size:
+        varRtMne = float(np.mean(vecRt))
+        varRtMdn = float(np.median(vecRt))
+    else:
+        varRtMne = np.nan
+        varRtMdn = np.nan
+    return [vecHit.size, varNumHit, varNumMis, varPcntHit, varRtMne,
+            varRtMdn]
+
+
+def write_csv(strPthCsv, lstHdr, lstRow):
+    """Write table (list of rows) to csv file."""
+    with open(strPthCsv, 'w', newline='') as objFle:
+        objCsv = csv.writer(objFle)
+        objCsv.writerow(lstHdr)
+        objCsv.writerows(lstRow)
+# *****************************************************************************
 
-# List to array:
-aryHits = np.array(lstHits)
 
-# Average performance across subjects:
-varMne = np.mean(aryHits)
-varSd = np.std(aryHits)
+# *****************************************************************************
+# *** Read log files
 
-print(('--Mean percent hits across subjects: ' + str(varMne)))
-print(('--Standard deviation:                ' + str(varSd)))
+if __name__ == '__main__':
+
+    print('-Evaluiate behavioural performance')
+
+    # List of log files (i.e. runs) of all subjects:
+    lstTsk = []
+    for strSub in lstSubIds:
+        lstFls = sorted(glob.glob(strPthLog.format(strSub, strSub, '*')))
+        for idxRun, strPthTmp in enumerate(lstFls):
+            lstTsk.append((strSub, idxRun, strPthTmp))
+
+    print(('--Parsing ' + str(len(lstTsk)) + ' log files ('
+           + str(varPar) + ' processes)'))
+
+    # Parse log files in parallel (results in order of tasks):
+    if varPar > 1:
+        objPool = mp.Pool(processes=max(min(varPar, len(lstTsk)), 1))
+        lstRes = objPool.map(evaluate_run, lstTsk)
+        objPool.close()
+        objPool.join()
+    else:
+        lstRes = [evaluate_run(tplTsk) for tplTsk in lstTsk]
+
+    # Per-trial table, per-run summaries, and per-subject trials:
+    lstRowTrl = []
+    lstRowRun = []
+    dicSubTrl = dict([(strSub, []) for strSub in lstSubIds])
+    lstHits = []
+
+    for strSub, idxRun, dicTrl, lgcCmpl in lstRes:
+
+        for idxTrl in range(dicTrl['hit'].size):
+            lstRowTrl.append([strSub,
+                              (idxRun + 1),
+                              (idxTrl + 1),
+                              dicTrl['block'][idxTrl],
+                              dicTrl['condition'][idxTrl],
+                              dicTrl['scheduled'][idxTrl],
+                              dicTrl['time'][idxTrl],
+                              dicTrl['hit'][idxTrl],
+                              dicTrl['rt'][idxTrl]])
+
+        lstSmry = summarise(dicTrl['hit'], dicTrl['rt'])
+        lstRowRun.append([strSub, (idxRun + 1), int(lgcCmpl)] + lstSmry)
+        dicSubTrl[strSub].append(dicTrl)
+
+        strTmp = ('---Subject ' + strSub + ', run ' + str(idxRun + 1) + ': '
+                  + str(lstSmry[3]))
+        if not lgcCmpl:
+            strTmp = strTmp + ' (aborted)'
+        print(strTmp)
+
+        # Runs without any responses (e.g. aborted before the first target)
+        # are not included in the average across runs:
+        if not np.isnan(lstSmry[3]):
+            lstHits.append(lstSmry[3])
+
+    lstRowSub = []
+    for strSub in lstSubIds:
+        lstTrl = dicSubTrl[strSub]
+        if len(lstTrl) == 0:
+            continue
+        lstRowSub.append(
+            [strSub, len(lstTrl)]
+            + summarise(np.concatenate([dicTrl['hit'] for dicTrl in lstTrl]),
+                        np.concatenate([dicTrl['rt'] for dicTrl in lstTrl])))
+
+    lstHdrSmry = ['num_target', 'num_hit', 'num_miss', 'pcnt_hit',
+                  'rt_mean', 'rt_median']
+
+    if not os.path.isdir(strPthOut):
+        os.makedirs(strPthOut)
+
+    write_csv((strPthOut + 'behaviour_trials.csv'),
+              ['subject', 'run', 'trial', 'block', 'condition', 'scheduled',
+               'time', 'hit', 'rt'],
+              lstRowTrl)
+    write_csv((strPthOut + 'behaviour_runs.csv'),
+              (['subject', 'run', 'complete'] + lstHdrSmry),
+              lstRowRun)
+    write_csv((strPthOut + 'behaviour_subjects.csv'),
+              (['subject', 'num_run'] + lstHdrSmry),
+              lstRowSub)
+
+    # List to array:
+    aryHits = np.array(lstHits)
+
+    # Average performance across subjects:
+    varMne = np.mean(aryHits)
+    varSd = np.std(aryHits)
+
+    print(('--Mean percent hits across subjects: ' + str(varMne)))
+    print(('--Standard deviation:                ' + str(varSd)))
+
+    for lstRow in lstRowSub:
+        print(('---Subject ' + lstRow[0] + ': median reaction time '
+               + str(lstRow[-1])))
 # *****************************************************************************
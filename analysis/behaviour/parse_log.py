@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Parse PacMan experiment log files into event tables.
+
+Each PsychoPy log file (lines of the form `<time> \t<LEVEL> \t<message>`) is
+read once and tokenised with regular expressions over the whole file. The
+result is an event table, i.e. a dictionary of equally long arrays (one entry
+per logged event): log time, event type, block, condition of the block,
+scheduled time (of blocks & targets), and key (of key presses). Behavioural
+metrics are computed from the events (not from the summary at the end of the
+log, which is missing if a run was aborted). Targets are matched with hits &
+misses to obtain a trial table with reaction times.
+
+Event tables are cached as columnar npz files next to the log files; the
+cache is used as long as the log file has not been modified.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import numpy as np
+
+
+# Event types (the event type of each event is stored as index into this
+# list):
+lstEvnt = ['other',
+           'rest_start',
+           'rest_end',
+           'stimulus_start',
+           'stimulus_end',
+           'target',
+           'hit',
+           'miss',
+           'keypress',
+           'end',
+           'abort']
+
+# Log messages of event types (messages that do not match any of these are
+# of type 'other'):
+dicEvntRgx = {'rest_start': r'REST start of block \d+ scheduled for: ',
+              'rest_end': r'REST end of event \d+',
+              'stimulus_start': r'STIMULUS start of block \d+, condition ',
+              'stimulus_end': r'STIMULUS end of event \d+',
+              'target': r'TARGET scheduled for: ',
+              'hit': r'Hit$',
+              'miss': r'Miss$',
+              'keypress': r'Keypress: ',
+              'end': r'-+End of the experiment\.-+',
+              'abort': r'-+Experiment aborted by user\.-+'}
+
+# One log entry (time, level, message):
+objRgxLne = re.compile(r'^\s*([-+]?\d+(?:\.\d*)?)\s+([A-Z]+)\s+(.*?)\s*$',
+                       flags=re.MULTILINE)
+
+# Event type of message (one named group per event type):
+objRgxEvnt = re.compile('|'.join(['(?P<' + strEvnt + '>'
+                                  + dicEvntRgx[strEvnt] + ')'
+                                  for strEvnt in lstEvnt[1:]]))
+
+# Numbers in message (block, condition, scheduled time):
+objRgxNum = re.compile(r'[-+]?\d+(?:\.\d*)?')
+
+
+def parse_log(strPthLog):
+    """
+    Parse experiment log file into event table.
+
+    Parameters
+    ----------
+    strPthLog : str
+        Path of PacMan experiment log file.
+
+    Returns
+    -------
+    dicEvnt : dict
+        Event table, with the following arrays (one entry per event):
+        'time' (log time [s]), 'event' (event type, index into `lstEvnt`),
+        'block' (index of the current block, as logged, -1 before the first
+        block), 'condition' (condition of the current block, 1 for rest
+        blocks, 0 before the first block), 'scheduled' (scheduled time of
+        blocks & targets [s], NaN for other events), 'key' (key of key
+        presses, empty for other events).
+    """
+    with open(strPthLog, 'r', errors='replace') as objFle:
+        strLog = objFle.read()
+
+    # Log entries (lines that do not match, e.g. continuation lines of
+    # multi-line messages, are skipped):
+    lstLne = objRgxLne.findall(strLog)
+    varNumEvnt = len(lstLne)
+
+    vecTme = np.array([float(tplLne[0]) for tplLne in lstLne],
+                      dtype=np.float64)
+    vecEvnt = np.zeros(varNumEvnt, dtype=np.int8)
+    vecBlkStrt = np.full(varNumEvnt, -1, dtype=np.int32)
+    vecCon = np.zeros(varNumEvnt, dtype=np.float32)
+    vecSch = np.full(varNumEvnt, np.nan, dtype=np.float64)
+    vecKey = np.zeros(varNumEvnt, dtype='<U16')
+
+    for idxEvnt, (_, _, strMsg) in enumerate(lstLne):
+
+        objMtch = objRgxEvnt.match(strMsg)
+        if objMtch is None:
+            continue
+        strEvnt = objMtch.lastgroup
+        vecEvnt[idxEvnt] = lstEvnt.index(strEvnt)
+
+        if strEvnt == 'keypress':
+            vecKey[idxEvnt] = strMsg[objMtch.end():].strip()
+
+        elif strEvnt in ('rest_start', 'stimulus_start', 'target'):
+            lstNum = objRgxNum.findall(strMsg)
+            vecSch[idxEvnt] = float(lstNum[-1])
+            if strEvnt == 'rest_start':
+                vecBlkStrt[idxEvnt] = int(lstNum[0])
+                vecCon[idxEvnt] = 1.0
+            elif strEvnt == 'stimulus_start':
+                vecBlkStrt[idxEvnt] = int(lstNum[0])
+                vecCon[idxEvnt] = float(lstNum[1])
+
+    # Block & condition of all events (those of the last preceding block
+    # start):
+    vecIdx = np.where(np.greater_equal(vecBlkStrt, 0),
+                      np.arange(varNumEvnt), -1)
+    vecIdx = np.maximum.accumulate(vecIdx) if varNumEvnt > 0 else vecIdx
+    lgcBlk = np.greater_equal(vecIdx, 0)
+    vecBlk = np.where(lgcBlk, vecBlkStrt[vecIdx], -1).astype(np.int32)
+    vecCon = np.where(lgcBlk, vecCon[vecIdx], 0.0).astype(np.float32)
+
+    return {'time': vecTme,
+            'event': vecEvnt,
+            'block': vecBlk,
+            'condition': vecCon,
+            'scheduled': vecSch,
+            'key': vecKey}
+
+
+def get_cache_path(strPthLog):
+    """Path of cached event table of log file."""
+    return os.path.splitext(strPthLog)[0] + '_events.npz'
+
+
+def load_events(strPthLog, lgcCache=True):
+    """
+    Load event table of experiment log file (cached).
+
+    Parameters
+    ----------
+    strPthLog : str
+        Path of PacMan experiment log file.
+    lgcCache : bool
+        Whether to use (and create) the cached event table (see
+        `get_cache_path`). The cache is ignored if the log file has been
+        modified, or if the event types have changed.
+
+    Returns
+    -------
+    dicEvnt : dict
+        Event table (see `parse_log`).
+    """
+    objStat = os.stat(strPthLog)
+    strPthCache = get_cache_path(strPthLog)
+
+    if lgcCache and os.path.isfile(strPthCache):
+        with np.load(strPthCache, allow_pickle=False) as objNpz:
+            if ((int(objNpz['size']) == objStat.st_size)
+                    and (int(objNpz['mtime_ns']) == objStat.st_mtime_ns)
+                    and (list(objNpz['event_names']) == lstEvnt)):
+                return dict([(strKey, objNpz[strKey]) for strKey
+                             in ['time', 'event', 'block', 'condition',
+                                 'scheduled', 'key']])
+
+    dicEvnt = parse_log(strPthLog)
+
+    if lgcCache:
+        # The cache is written to a temporary file and replaced, so that an
+        # interrupted run does not leave a corrupt cache behind:
+        strPthTmp = strPthCache[:-4] + '_tmp.npz'
+        np.savez(strPthTmp,
+                 size=objStat.st_size,
+                 mtime_ns=objStat.st_mtime_ns,
+                 event_names=np.array(lstEvnt),
+                 **dicEvnt)
+        os.replace(strPthTmp, strPthCache)
+
+    return dicEvnt
+
+
+def get_performance(dicEvnt):
+    """
+    Target detection performance from event table.
+
+    Parameters
+    ----------
+    dicEvnt : dict
+        Event table (see `parse_log`).
+
+    Returns
+    -------
+    dicPrf : dict
+        Number of targets ('num_target'), hits ('num_hit') and misses
+        ('num_miss'), percentage of hits ('pcnt_hit', NaN if there were no
+        responses), and whether the run was completed ('complete').
+    """
+    vecEvnt = dicEvnt['event']
+    varNumHit = int(np.sum(np.equal(vecEvnt, lstEvnt.index('hit'))))
+    varNumMis = int(np.sum(np.equal(vecEvnt, lstEvnt.index('miss'))))
+
+    if 0 < (varNumHit + varNumMis):
+        varPcntHit = (100.0 * float(varNumHit)
+                      / float(varNumHit + varNumMis))
+    else:
+        varPcntHit = np.nan
+
+    return {'num_target': int(np.sum(np.equal(vecEvnt,
+                                              lstEvnt.index('target')))),
+            'num_hit': varNumHit,
+            'num_miss': varNumMis,
+            'pcnt_hit': varPcntHit,
+            'complete': bool(np.any(np.equal(vecEvnt,
+                                             lstEvnt.index('end'))))}
+
+
+def get_trials(dicEvnt):
+    """
+    Trial table (one entry per target) from event table.
+
+    Each target is matched with the first response (hit or miss) logged after
+    it, and before the next target.
+
+    Parameters
+    ----------
+    dicEvnt : dict
+        Event table (see `parse_log`).
+
+    Returns
+    -------
+    dicTrl : dict
+        Trial table, with the following arrays (one entry per target):
+        'time' (log time of target onset [s]), 'scheduled' (scheduled onset
+        time of target [s]), 'block' & 'condition' (block in which the
+        target occurred), 'hit' (1.0 for hits, 0.0 for misses, NaN if no
+        response was logged, e.g. if the run was aborted), 'rt' (reaction
+        time, i.e. time between logged target onset and hit [s], NaN for
+        misses).
+
+    Notes
+    -----
+    Target onset and hits are logged by the stimulus script on the first
+    frame on which the target is drawn and on the frame after the key press,
+    respectively, so that reaction times are resolved at the frame rate.
+    """
+    vecEvnt = dicEvnt['event']
+    vecIdxTrgt = np.flatnonzero(np.equal(vecEvnt, lstEvnt.index('target')))
+    vecIdxRsp = np.flatnonzero(
+        np.isin(vecEvnt, [lstEvnt.index('hit'), lstEvnt.index('miss')]))
+
+    # Target preceding each response (responses before the first target are
+    # ignored):
+    vecRspTrgt = np.searchsorted(vecIdxTrgt, vecIdxRsp, side='right') - 1
+    lgcTmp = np.greater_equal(vecRspTrgt, 0)
+    vecRspTrgt = vecRspTrgt[lgcTmp]
+    vecIdxRsp = vecIdxRsp[lgcTmp]
+
+    # First response after each target:
+    vecRspTrgt, vecTmp = np.unique(vecRspTrgt, return_index=True)
+    vecIdxRsp = vecIdxRsp[vecTmp]
+
+    varNumTrgt = vecIdxTrgt.size
+    vecHit = np.full(varNumTrgt, np.nan, dtype=np.float64)
+    vecRt = np.full(varNumTrgt, np.nan, dtype=np.float64)
+
+    lgcHit = np.equal(vecEvnt[vecIdxRsp], lstEvnt.index('hit'))
+    vecHit[vecRspTrgt] = lgcHit.astype(np.float64)
+    vecRt[vecRspTrgt[lgcHit]] = (dicEvnt['time'][vecIdxRsp[lgcHit]]
+                                 - dicEvnt['time'][vecIdxTrgt[
+                                     vecRspTrgt[lgcHit]]])
+
+    return {'time': dicEvnt['time'][vecIdxTrgt],
+            'scheduled': dicEvnt['scheduled'][vecIdxTrgt],
+            'block': dicEvnt['block'][vecIdxTrgt],
+            'condition': dicEvnt['condition'][vecIdxTrgt],
+            'hit': vecHit,
+            'rt': vecRt}
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Group average of surface event-related time courses.
+
+Event-related time courses of all sessions (converted to npy format by
+`vtk_to_npy_conversion.py` in the depth sampling directory of each session)
+are reduced within ROIs to mean time courses per cortical depth, and averaged
+across subjects. Group means, standard errors, and the number of subjects &
+ROI vertices are saved in one compressed npz file (see
+`pacman_utils.group_era`).
+
+ROIs are defined by layers of the per-hemisphere surface dataset of each
+subject (`cbs/<hemisphere>/surface`, created by
+`postprocess_retinotopy_vtk.py`).
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Import modules
+import os
+import sys
+import json
+import multiprocessing as mp
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.group_era import group_era  #noqa
+from pacman_utils.group_era import save_group  #noqa
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Define parameters
+
+# Load environmental variable defining the input data path:
+pacman_data_path = str(os.environ['pacman_data_path'])
+
+# Number of parallel processes:
+try:
+    varPar = int(os.environ['pacman_cpu'])
+except (KeyError, ValueError):
+    varPar = mp.cpu_count()
+
+# Subject IDs:
+lstSub = ['20181029',
+          '20181105',
+          '20181107',
+          '20181108',
+          '20181128',
+          '20190207']
+
+# Conditions of each session (sessions had different stimuli), as defined in
+# the sessions file (`sessions.json` in this directory). Subjects for which a
+# condition does not exist are left out of the average of that condition:
+strPthSes = (str(os.environ['pacman_anly_path'])
+             + 'group/sessions.json')
+
+# ROIs. Key: ROI name. Value: hemisphere, name of layer in the surface dataset
+# of each subject, and threshold (vertices with layer values above the
+# threshold are included):
+dicRoi = {'lh_R2': ('lh', 'pRF_results_R2_mid_GM', 0.1),
+          'rh_R2': ('rh', 'pRF_results_R2_mid_GM', 0.1)}
+
+# Output file:
+strPthOut = (pacman_data_path + 'group/era_group.npz')
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Group average
+
+if __name__ == '__main__':
+
+    print('-Group average of event-related time courses')
+
+    # Conditions per session, and all conditions (in order of first
+    # occurrence):
+    with open(strPthSes, 'r') as objFle:
+        dicSes = json.load(objFle)
+    dicSubCon = dict([(strSub, dicSes[strSub]['conditions'])
+                      for strSub in lstSub])
+    lstCon = []
+    for strSub in lstSub:
+        for strCon in dicSubCon[strSub]:
+            if strCon not in lstCon:
+                lstCon.append(strCon)
+
+    print('--Reducing ' + str(len(lstSub)) + ' subjects ('
+          + str(varPar) + ' processes)')
+
+    dicOut = group_era(pacman_data_path, lstSub, lstCon, dicRoi,
+                       varPar=varPar, dicSubCon=dicSubCon)
+
+    for idxCon, strCon in enumerate(dicOut['conditions']):
+        for idxRoi, strRoi in enumerate(dicOut['rois']):
+            print('---' + strCon + ', ' + strRoi + ': '
+                  + str(dicOut['num_sub'][idxCon, idxRoi]) + ' subjects')
+
+    print('--Saving: ' + strPthOut)
+
+    if not os.path.isdir(os.path.dirname(strPthOut)):
+        os.makedirs(os.path.dirname(strPthOut))
+
+    save_group(strPthOut, dicOut)
+
+    print('-Done.')
+# *****************************************************************************
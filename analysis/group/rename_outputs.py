@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Rename pipeline outputs of all sessions.
+
+Removes the `_e1` suffix that dcm2niix appends to some nii files, and the
+prefixes that the JIST process manager adds to depth sampling outputs. The
+rename rules, directories, and sessions are defined in `rename_config.json`
+(in this directory; the conditions of each session are read from
+`sessions.json`); the same config is used by the per-session rename
+scripts (`00_get_data/n_03_py_rename.py`, `08_depthsampling/renameJist*.py`).
+All directories are scanned and renamed concurrently. Renames are recorded in
+a manifest per session (see `pacman_utils.rename`), so that the script can be
+run repeatedly; only new files are renamed.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# *****************************************************************************
+# *** Import modules
+import os
+import sys
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(str(os.environ['pacman_anly_path']))
+from pacman_utils.rename import load_config  #noqa
+from pacman_utils.rename import rename_sessions  #noqa
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Define parameters
+
+# Load environmental variable defining the input data path:
+pacman_data_path = str(os.environ['pacman_data_path'])
+
+# Rename config:
+strPthCfg = (str(os.environ['pacman_anly_path'])
+             + 'group/rename_config.json')
+
+# Sessions (None for all sessions in the config):
+lstSub = None
+
+# Rename stages:
+lstStg = ['dcm2niix', 'jist', 'jist_ert']
+
+# Only list renames, without renaming files?
+lgcDry = False
+# *****************************************************************************
+
+
+# *****************************************************************************
+# *** Rename files
+
+if __name__ == '__main__':
+
+    print('-Rename pipeline outputs')
+
+    dicCfg = load_config(strPthCfg)
+
+    if lstSub is None:
+        lstSub = sorted(dicCfg['sessions'].keys())
+
+    dicOut = rename_sessions(pacman_data_path, dicCfg, lstSub, lstStg,
+                             lgcDry=lgcDry)
+
+    for strSub in lstSub:
+        for strDir, dicRen in sorted(dicOut[strSub].items()):
+            print('---' + strDir + ': ' + str(len(dicRen)) + ' files')
+
+    print('-Done.')
+# *****************************************************************************
@@ -0,0 +1,24 @@
+"""
+Shared utilities for the PacMan analysis pipeline.
+
+The session directories (e.g. `analysis/20181029/`) contain the pipeline
+scripts for each session. Functionality that is needed across sessions is
+collected here. Scripts add the analysis parent directory (environmental
+variable `pacman_anly_path`) to the python path in order to import it.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Anisotropic diffusion based smoothing of 3D volumes.
+
+Adapted from the Segmentator library (development branch, see
+https://github.com/ofgulban/segmentator/tree/devel/segmentator/utils.py). The
+volume is processed in slabs along the first axis on a thread pool (numpy
+releases the GIL during ufunc calls). All intermediate results are computed
+in preallocated buffers (per thread, of the size of one slab), so that no
+full-volume temporaries are created during the iterations. Optionally, only
+the bounding box of a mask (e.g. brain mask) is diffused.
+"""
+
+# Part of the Segmentator library
+# Copyright (C) 2016  Omer Faruk Gulban and Marian Schneider
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import warnings
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pacman_utils.nii_gzip import get_num_thrd
+from pacman_utils.mask import get_bbox
+
+
+def _conduct(aryDlt, aryBuf, kappa, varStp, option):
+    """Replace gradients by fluxes (conductance times gradient), in place."""
+    # Conductance, scaled by step size:
+    np.divide(aryDlt, kappa, out=aryBuf)
+    np.square(aryBuf, out=aryBuf)
+    if option == 1:
+        np.negative(aryBuf, out=aryBuf)
+        np.exp(aryBuf, out=aryBuf)
+    else:
+        np.add(aryBuf, 1.0, out=aryBuf)
+        np.reciprocal(aryBuf, out=aryBuf)
+    np.divide(aryBuf, varStp, out=aryBuf)
+    np.multiply(aryDlt, aryBuf, out=aryDlt)
+
+
+def _slab_update(aryIn, aryUpd, varSrt, varEnd, objLcl, varNumMax, kappa,
+                 step, option):
+    """Compute update (divergence of fluxes) for one slab."""
+    varNumZ = aryIn.shape[0]
+    varNumSlb = varEnd - varSrt
+
+    # Buffers of current thread (allocated once, for the largest slab plus
+    # one plane on each side):
+    if not hasattr(objLcl, 'aryDlt'):
+        objLcl.aryDlt = np.empty(((varNumMax + 2),) + aryIn.shape[1:],
+                                 dtype=np.float32)
+        objLcl.aryBuf = np.empty_like(objLcl.aryDlt)
+
+    aryOut = aryUpd[varSrt:varEnd]
+
+    # --- First axis (slab including one neighbouring plane on each side)
+    varLo = max((varSrt - 1), 0)
+    varHi = min((varEnd + 1), varNumZ)
+    varNum = varHi - varLo
+    aryDlt = objLcl.aryDlt[:varNum]
+    aryBuf = objLcl.aryBuf[:varNum]
+    np.subtract(aryIn[(varLo + 1):varHi], aryIn[varLo:(varHi - 1)],
+                out=aryDlt[:-1])
+    if varHi == varNumZ:
+        # No flux across the last plane of the volume:
+        aryDlt[-1] = 0.0
+    _conduct(aryDlt[:-1], aryBuf[:-1], kappa, step[0], option)
+
+    # Flux into plane minus flux from previous plane:
+    varOff = varSrt - varLo
+    np.copyto(aryOut, aryDlt[varOff:(varOff + varNumSlb)])
+    if varOff == 1:
+        np.subtract(aryOut, aryDlt[:varNumSlb], out=aryOut)
+    else:
+        np.subtract(aryOut[1:], aryDlt[:(varNumSlb - 1)], out=aryOut[1:])
+
+    # --- Second & third axis (within slab)
+    arySlb = aryIn[varSrt:varEnd]
+    for idxAx in (1, 2):
+        aryDlt = objLcl.aryDlt[:varNumSlb]
+        aryBuf = objLcl.aryBuf[:varNumSlb]
+        tplHi = (slice(None),) * idxAx + (slice(1, None),)
+        tplLo = (slice(None),) * idxAx + (slice(None, -1),)
+        tplLst = (slice(None),) * idxAx + (-1,)
+        np.subtract(arySlb[tplHi], arySlb[tplLo], out=aryDlt[tplLo])
+        aryDlt[tplLst] = 0.0
+        _conduct(aryDlt[tplLo], aryBuf[tplLo], kappa, step[idxAx], option)
+        np.add(aryOut, aryDlt, out=aryOut)
+        np.subtract(aryOut[tplHi], aryDlt[tplLo], out=aryOut[tplHi])
+
+
+def _slab_apply(aryIn, aryUpd, varSrt, varEnd, gamma):
+    """Add scaled update to slab, in place."""
+    aryTmp = aryUpd[varSrt:varEnd]
+    np.multiply(aryTmp, gamma, out=aryTmp)
+    np.add(aryIn[varSrt:varEnd], aryTmp, out=aryIn[varSrt:varEnd])
+
+
+def aniso_diff_3D(stack, niter=1, kappa=50, gamma=0.1, step=(1., 1., 1.),
+                  option=1, varNumThrd=None, varSlb=None, aryMsk=None,
+                  varHalo=None):
+    """3D anisotropic diffusion based smoothing.
+
+    Acknowledgements
+    ----------------
+    This script is adapted from a stackoverflow  post by user ali_m:
+    [1] http://stackoverflow.com/questions/10802611/anisotropic-diffusion-2d-image  #noqa
+    [2] http://pastebin.com/sBsPX4Y7
+
+    Parameters
+    ----------
+    stack : 3d numpy array
+        Input stack/image/volume/data.
+    niter : int
+        Number of iterations
+    kappa : float
+        Conduction coefficient (20-100?). Controls conduction as a function of
+        gradient.  If kappa is low small intensity gradients are able to block
+        conduction and hence diffusion across step edges. A large value reduces
+        the influence of intensity gradients on conduction.
+    gamma : float
+        Controls speed of diffusion (you usually want it at a maximum of 0.25
+        for stability).
+    step : tuple
+        The distance between adjacent pixels in (z,y,x). Step is used to scale
+        the gradients in case the spacing between adjacent pixels differs in
+        the x,y and/or z axes.
+    option : int, 1 or 2
+        1 favours high contrast edges over low contrast ones (Perona & Malik
+        [1] diffusion equation No 1).
+        2 favours wide regions over smaller ones (Perona & Malik [1] diffusion
+        equation No 2).
+    varNumThrd : int
+        Number of threads. By default, as specified by the environmental
+        variable `pacman_cpu`, or number of CPUs.
+    varSlb : int
+        Number of planes (along the first axis) per slab. By default, the
+        volume is split into one slab per thread.
+    aryMsk : 3d numpy array
+        Binary mask (e.g. brain mask). If given, only the bounding box of the
+        mask (extended by `varHalo` voxels on each side) is diffused; voxels
+        outside of it keep their input values.
+    varHalo : int
+        Extent of the bounding box around the mask. Intensity information
+        travels one voxel per iteration, so that the result within the
+        bounding box of the mask is identical to that of the full volume if
+        the halo is at least `niter` voxels (default).
+
+    Returns
+    -------
+    stackout : 3d numpy array
+        Diffused stack/image/volume/data (32 bit floating point precision).
+
+    Reference
+    ---------
+    [1] P. Perona and J. Malik.
+        Scale-space and edge detection using ansotropic diffusion.
+        IEEE Transactions on Pattern Analysis and Machine
+        Intelligence, 12(7):629-639, July 1990.
+
+    Notes
+    -----
+    Original MATLAB code by Peter Kovesi
+    School of Computer Science & Software Engineering,
+    The University of Western Australia
+    <http://www.csse.uwa.edu.au>
+
+    Translated to Python and optimised by Alistair Muldal
+    Department of Pharmacology, University of Oxford
+    <alistair.muldal@pharm.ox.ac.uk>
+
+    June 2000  original version.
+    March 2002 corrected diffusion equation No 2.
+    July 2012 translated to Python
+    January 2017 docstring reorganization.
+
+    Apart from the output volume, one full-size buffer (the update of the
+    current iteration) is allocated. Each iteration first computes the update
+    of all slabs (from the previous iteration's volume; slabs read one
+    neighbouring plane on each side), and then applies it, so that the result
+    does not depend on the slab size or number of threads.
+    """
+    if stack.ndim == 4:
+        warnings.warn('Only grayscale stacks allowed, converting to 3D '
+                      + 'matrix')
+        stack = stack.mean(3)
+
+    if varNumThrd is None:
+        varNumThrd = get_num_thrd()
+
+    if aryMsk is not None:
+
+        # Diffuse bounding box of mask only, and paste the result into the
+        # input volume:
+        if varHalo is None:
+            varHalo = niter
+        stackout = np.array(stack, dtype=np.float32, copy=True)
+        if not np.any(aryMsk):
+            return stackout
+        tplBox = get_bbox(np.not_equal(aryMsk, 0), varHalo)
+        stackout[tplBox] = aniso_diff_3D(stackout[tplBox], niter=niter,
+                                         kappa=kappa, gamma=gamma, step=step,
+                                         option=option, varNumThrd=varNumThrd,
+                                         varSlb=varSlb)
+        return stackout
+
+    # Initialize output array & update buffer:
+    stackout = np.array(stack, dtype=np.float32, copy=True)
+    aryUpd = np.empty_like(stackout)
+
+    varNumZ = stackout.shape[0]
+    if varSlb is None:
+        varSlb = int(np.ceil(float(varNumZ) / float(varNumThrd)))
+    varSlb = max(int(varSlb), 1)
+    lstSlb = [(varSrt, min((varSrt + varSlb), varNumZ))
+              for varSrt in range(0, varNumZ, varSlb)]
+
+    # Thread-local buffers:
+    objLcl = threading.local()
+
+    def _update(tplSlb):
+        _slab_update(stackout, aryUpd, tplSlb[0], tplSlb[1], objLcl, varSlb,
+                     kappa, step, option)
+
+    def _apply(tplSlb):
+        _slab_apply(stackout, aryUpd, tplSlb[0], tplSlb[1], gamma)
+
+    with ThreadPoolExecutor(max_workers=varNumThrd) as objPool:
+        for _ in range(niter):
+            # All slabs are updated before the update is applied (the
+            # results are consumed, so that exceptions are raised):
+            list(objPool.map(_update, lstSlb))
+            list(objPool.map(_apply, lstSlb))
+
+    return stackout
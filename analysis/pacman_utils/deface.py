@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+Data-driven defacing of anatomical images.
+
+A face mask is computed once from one contrast (e.g. the MP2RAGE PDw image)
+and applied to all contrasts of a session. The face mask is a bounding box
+(anterior to the face, inferior to the forehead, and spanning the full
+left-right extent), so that it can be stored compactly and applied
+slab-by-slab with simple slicing.
+
+The head is found in a maximum intensity projection along the left-right axis.
+The projection is computed from a subsample of slices of the reference image
+(only every n-th slice along the last dimension is read), so that computing
+the face mask costs a fraction of a full read of the image. Array axes are
+related to anatomical directions by means of the affine, so that the face mask
+does not depend on the orientation of the data.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import numpy as np
+import nibabel as nb
+from pacman_utils.nii_io import find_nii
+
+
+def get_axes(aryAff):
+    """
+    Relate array axes to anatomical directions.
+
+    Parameters
+    ----------
+    aryAff : np.array
+        Affine of image.
+
+    Returns
+    -------
+    dicAx : dict
+        For each anatomical axis ('LR', 'PA', 'IS'), a tuple of (array axis,
+        direction), where direction is +1 if the array index increases
+        towards right / anterior / superior, and -1 otherwise.
+    """
+    aryOrnt = nb.orientations.io_orientation(aryAff)
+    dicAx = {}
+    for idxAx in range(3):
+        strAx = ['LR', 'PA', 'IS'][int(aryOrnt[idxAx, 0])]
+        dicAx[strAx] = (idxAx, int(aryOrnt[idxAx, 1]))
+    return dicAx
+
+
+def project(strPthIn, varNumSlc=16, varStp=1, lgcMin=False):
+    """
+    Maximum (and minimum) intensity projection along the left-right axis.
+
+    The image is read slab-by-slab. Optionally, only every `varStp`-th slice
+    along the last dimension is read.
+
+    Parameters
+    ----------
+    strPthIn : str
+        Path of image (3D). Uncompressed working copies are used if available
+        (see `nii_io.find_nii`).
+    varNumSlc : int
+        Number of slices (along the last dimension) read per slab.
+    varStp : int
+        Only every `varStp`-th slice along the last dimension is read. If the
+        last dimension is not the left-right axis, the projection is
+        upsampled to the full resolution (each slice that is read also fills
+        the following `varStp - 1` slices).
+    lgcMin : bool
+        Whether to also compute the minimum intensity projection (e.g. to
+        obtain the minimum and maximum of the image after defacing, see
+        `box_min_max`).
+
+    Returns
+    -------
+    aryMax : np.array
+        Maximum intensity projection (2D, the array axes other than the
+        left-right axis, in their original order).
+    aryMin : np.array
+        Minimum intensity projection (None if `lgcMin` is False).
+    aryAff : np.array
+        Affine of image.
+    tplShp : tuple
+        Shape of image.
+
+    Notes
+    -----
+    Compressed files are decompressed up to the last slice that is read (but
+    slices that are skipped are not converted or reduced). Reading only a
+    fraction of the data requires an uncompressed file.
+    """
+    objNii = nb.load(find_nii(strPthIn))
+    aryAff = objNii.affine
+    tplShp = objNii.shape
+    idxLr = get_axes(aryAff)['LR'][0]
+
+    # Shape of projections:
+    tplPrj = tuple([tplShp[idxAx] for idxAx in range(3) if idxAx != idxLr])
+
+    lstPrj = [(np.full(tplPrj, -np.inf, dtype=np.float32), np.amax,
+               np.maximum)]
+    if lgcMin:
+        lstPrj.append((np.full(tplPrj, np.inf, dtype=np.float32), np.amin,
+                       np.minimum))
+
+    varNumTtl = tplShp[2]
+    for idxSrt in range(0, varNumTtl, (varNumSlc * varStp)):
+
+        idxEnd = min((idxSrt + varNumSlc * varStp), varNumTtl)
+        aryBlk = np.asarray(objNii.dataobj[..., idxSrt:idxEnd:varStp],
+                            dtype=np.float32)
+
+        for aryPrj, fncRdc, fncAcc in lstPrj:
+            aryTmp = fncRdc(aryBlk, axis=idxLr)
+            if idxLr == 2:
+                # Slabs along left-right axis are reduced across slabs:
+                fncAcc(aryPrj, aryTmp, out=aryPrj)
+            else:
+                # Slabs along the last axis of the projection (upsampled to
+                # full resolution if slices were skipped):
+                aryPrj[:, idxSrt:idxEnd] = np.repeat(
+                    aryTmp, varStp, axis=1)[:, :(idxEnd - idxSrt)]
+
+    if lgcMin:
+        aryMin = lstPrj[1][0]
+    else:
+        aryMin = None
+
+    return lstPrj[0][0], aryMin, aryAff, tplShp
+
+
+def face_box(aryMip, aryAff, tplShp, varDpth=25.0, varTop=100.0, varHgt=None,
+             varThr=0.1, varMinExt=5.0, varMaxFrc=0.2):
+    """
+    Compute face mask (bounding box) from maximum intensity projection.
+
+    Parameters
+    ----------
+    aryMip : np.array
+        Maximum intensity projection along the left-right axis (see
+        `project`).
+    aryAff : np.array
+        Affine of image.
+    tplShp : tuple
+        Shape of image.
+    varDpth : float
+        Depth of face mask [mm], i.e. distance from the most anterior point of
+        the face to the posterior boundary of the face mask.
+    varTop : float
+        Distance [mm] from the most superior point of the head to the
+        superior boundary of the face mask. Only the part of the head
+        inferior to this boundary (i.e. the face, not the forehead) is
+        considered when searching for the most anterior point.
+    varHgt : float
+        Height of face mask [mm], measured from the inferior boundary of the
+        field of view. Overrides `varTop` if not None.
+    varThr : float
+        Intensity threshold for the head, as a fraction of the 99th
+        percentile of the projection.
+    varMinExt : float
+        Minimum superior-inferior extent [mm] of the head at an
+        anterior-posterior position (within the face mask) for it to count
+        as part of the head (so that isolated bright voxels, e.g. artefacts
+        anterior to the head, are ignored).
+    varMaxFrc : float
+        Maximum fraction of the anterior-posterior extent of the head that
+        may be covered by the face mask.
+
+    Returns
+    -------
+    lstBox : list
+        Bounding box of face mask in array coordinates, one `[start, end]`
+        pair (end exclusive) per array axis. Empty (zero size) if no head is
+        found.
+
+    Raises
+    ------
+    ValueError
+        If the face mask would cover more than `varMaxFrc` of the
+        anterior-posterior extent of the head (e.g. if the forehead, or an
+        artefact, was taken as the most anterior point of the face, so that
+        the face mask would reach the brain).
+    """
+    dicAx = get_axes(aryAff)
+    idxLr = dicAx['LR'][0]
+    idxAp, varDirAp = dicAx['PA']
+    idxIs, varDirIs = dicAx['IS']
+
+    # Voxel size along each array axis:
+    vecVox = np.sqrt(np.sum(np.square(aryAff[:3, :3]), axis=0))
+
+    # Head (threshold relative to robust maximum), with axes of the
+    # projection in the order anterior-posterior, superior-inferior:
+    aryHd = np.greater(aryMip, (varThr * np.percentile(aryMip, 99.0)))
+    aryHd = np.transpose(aryHd, ((idxAp - int(idxAp > idxLr)),
+                                 (idxIs - int(idxIs > idxLr))))
+
+    lstBox = [[0, tplShp[idxAx]] for idxAx in range(3)]
+
+    vecIs = np.flatnonzero(np.any(aryHd, axis=0))
+    if vecIs.size == 0:
+        lstBox[idxAp] = [0, 0]
+        return lstBox
+
+    # Superior boundary of face mask:
+    if varHgt is not None:
+        varNumHgt = min(int(np.round(varHgt / vecVox[idxIs])), tplShp[idxIs])
+        if varDirIs > 0:
+            lstBox[idxIs] = [0, varNumHgt]
+        else:
+            lstBox[idxIs] = [(tplShp[idxIs] - varNumHgt), tplShp[idxIs]]
+    else:
+        varNumTop = int(np.round(varTop / vecVox[idxIs]))
+        if varDirIs > 0:
+            lstBox[idxIs] = [0, max((int(vecIs[-1]) - varNumTop + 1), 0)]
+        else:
+            lstBox[idxIs] = [min((int(vecIs[0]) + varNumTop), tplShp[idxIs]),
+                             tplShp[idxIs]]
+
+    # Anterior-posterior positions of the head, within the face mask and
+    # overall:
+    varNumExt = max(int(np.round(varMinExt / vecVox[idxIs])), 1)
+    vecAp = np.flatnonzero(np.greater_equal(
+        np.sum(aryHd[:, lstBox[idxIs][0]:lstBox[idxIs][1]], axis=1),
+        varNumExt))
+    vecApHd = np.flatnonzero(np.greater_equal(np.sum(aryHd, axis=1),
+                                              varNumExt))
+    if vecAp.size == 0:
+        lstBox[idxAp] = [0, 0]
+        return lstBox
+
+    # Posterior boundary of face mask (number of voxels behind the most
+    # anterior point of the face):
+    varNumDpth = int(np.round(varDpth / vecVox[idxAp]))
+    if varDirAp > 0:
+        lstBox[idxAp] = [max((int(vecAp[-1]) - varNumDpth + 1), 0),
+                         tplShp[idxAp]]
+    else:
+        lstBox[idxAp] = [0, min((int(vecAp[0]) + varNumDpth),
+                                tplShp[idxAp])]
+
+    # Fraction of the anterior-posterior extent of the head covered by the
+    # face mask:
+    varNumHd = int(vecApHd[-1]) - int(vecApHd[0]) + 1
+    varNumCvr = max((min(lstBox[idxAp][1], (int(vecApHd[-1]) + 1))
+                     - max(lstBox[idxAp][0], int(vecApHd[0]))), 0)
+    varFrc = float(varNumCvr) / float(varNumHd)
+    if varFrc > varMaxFrc:
+        raise ValueError('Face mask would cover '
+                         + str(np.around((100.0 * varFrc), decimals=1))
+                         + ' % of the anterior-posterior extent of the head'
+                         + ' (maximum: '
+                         + str(np.around((100.0 * varMaxFrc), decimals=1))
+                         + ' %), bounding box: ' + str(lstBox)
+                         + '. Check the reference image, or define the face'
+                         + ' mask manually.')
+
+    return lstBox
+
+
+def box_min_max(aryMin, aryMax, aryAff, lstBox):
+    """
+    Minimum & maximum of image after defacing, from projections.
+
+    Parameters
+    ----------
+    aryMin, aryMax : np.array
+        Minimum & maximum projections along the left-right axis (see
+        `project`).
+    aryAff : np.array
+        Affine of image.
+    lstBox : list
+        Bounding box of face mask (see `face_box`). Voxels within the box are
+        zero after defacing.
+
+    Returns
+    -------
+    varMin, varMax : float
+        Minimum & maximum of defaced image.
+    """
+    idxLr = get_axes(aryAff)['LR'][0]
+    lstBoxPrj = [lstBox[idxAx] for idxAx in range(3) if idxAx != idxLr]
+
+    # The face mask spans the full left-right axis, so that projections can
+    # be masked directly:
+    aryLgc = np.ones(aryMin.shape, dtype=np.bool_)
+    aryLgc[lstBoxPrj[0][0]:lstBoxPrj[0][1],
+           lstBoxPrj[1][0]:lstBoxPrj[1][1]] = False
+
+    varMin = float(np.amin(aryMin[aryLgc])) if np.any(aryLgc) else 0.0
+    varMax = float(np.amax(aryMax[aryLgc])) if np.any(aryLgc) else 0.0
+    if not np.all(aryLgc):
+        varMin = min(varMin, 0.0)
+        varMax = max(varMax, 0.0)
+
+    return varMin, varMax
+
+
+def apply_box(aryBlk, idxSrt, lstBox):
+    """
+    Set voxels within face mask to zero, for one slab (in place).
+
+    Parameters
+    ----------
+    aryBlk : np.array
+        Slab of image, shape `(x, y, number of slices)`.
+    idxSrt : int
+        Index (along the last dimension) of the first slice of the slab.
+    lstBox : list
+        Bounding box of face mask (see `face_box`).
+
+    Returns
+    -------
+    aryBlk : np.array
+        Defaced slab.
+    """
+    varSrt = max((lstBox[2][0] - idxSrt), 0)
+    varEnd = min((lstBox[2][1] - idxSrt), aryBlk.shape[2])
+    if varSrt < varEnd:
+        aryBlk[lstBox[0][0]:lstBox[0][1],
+               lstBox[1][0]:lstBox[1][1],
+               varSrt:varEnd] = 0.0
+    return aryBlk
+
+
+def save_box(strPthOut, lstBox, strPthRef, dicPrm=None):
+    """
+    Save face mask (bounding box) to json file.
+
+    Parameters
+    ----------
+    strPthOut : str
+        Output path (json file).
+    lstBox : list
+        Bounding box of face mask (see `face_box`).
+    strPthRef : str
+        Path of reference image from which the face mask was computed (for
+        documentation).
+    dicPrm : dict
+        Parameters with which the face mask was computed (json serialisable,
+        see `load_box`).
+
+    Notes
+    -----
+    The face mask has to be reused when defacing the same images again. It
+    cannot be recomputed from defaced images (the anterior extent of the head
+    would be underestimated, and the face mask would move posteriorly).
+    """
+    with open(strPthOut, 'w') as objFle:
+        json.dump({'box': [[int(varTmp) for varTmp in lstTmp]
+                           for lstTmp in lstBox],
+                   'reference': os.path.basename(strPthRef),
+                   'parameters': dicPrm},
+                  objFle,
+                  indent=2)
+
+
+def load_box(strPthIn, dicPrm=None):
+    """
+    Load face mask (bounding box) from json file.
+
+    Parameters
+    ----------
+    strPthIn : str
+        Path of json file (see `save_box`).
+    dicPrm : dict
+        Parameters of the face mask (as passed to `save_box`). If not None,
+        the parameters stored with the face mask have to be the same.
+
+    Returns
+    -------
+    lstBox : list or None
+        Bounding box of face mask (see `face_box`), or None if the file does
+        not exist.
+
+    Raises
+    ------
+    ValueError
+        If the face mask was computed with different parameters. The face
+        mask cannot be recomputed from defaced images, so that the original
+        images have to be restored, and the json file removed, before the
+        images can be defaced with new parameters.
+    """
+    if not os.path.isfile(strPthIn):
+        return None
+    with open(strPthIn, 'r') as objFle:
+        dicBox = json.load(objFle)
+    # Parameters are compared after conversion to json (e.g. tuples become
+    # lists):
+    if ((dicPrm is not None)
+            and (dicBox.get('parameters') != json.loads(json.dumps(dicPrm)))):
+        raise ValueError('Face mask was computed with different parameters ('
+                         + str(dicBox.get('parameters')) + ', expected '
+                         + str(dicPrm) + '): ' + strPthIn + '. Restore the'
+                         + ' original images and remove the face mask to'
+                         + ' deface them with new parameters.')
+    return dicBox['box']
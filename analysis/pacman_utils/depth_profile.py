@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Cortical depth profiles of event-related time courses.
+
+Event-related time courses sampled on the cortical surface are stored as npy
+arrays of shape `(depths, volumes, vertices)` (see `vtk_to_npy_conversion.py`
+in the depth sampling directories, files `aryErt_<condition>.npy`). This
+module reduces these arrays to ROI time courses per cortical depth, and
+derives peak amplitudes and response latencies per depth.
+
+The arrays are memory-mapped and read in blocks of volumes, so that several
+ROIs are reduced in one pass over the array. Reduced time courses are cached
+next to the array, so that repeated analyses (e.g. of many ROIs or with
+different parameters) do not need to read the full array again. If a
+vertex-chunked copy of the array exists (see `pacman_utils.ert_chunks`), only
+the chunks containing ROI vertices are read.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from pacman_utils.surface import load_layer
+from pacman_utils.ert_chunks import load_chunk_index
+from pacman_utils.ert_chunks import get_chunk_path
+from pacman_utils.ert_chunks import get_roi_chunks
+
+
+def load_ert(strPthNpy):
+    """
+    Memory-map event-related time courses.
+
+    Parameters
+    ----------
+    strPthNpy : str
+        Path of npy file (e.g. `aryErt_<condition>.npy`).
+
+    Returns
+    -------
+    aryErt : np.memmap
+        Read-only array of shape `(depths, volumes, vertices)`.
+    """
+    return np.load(strPthNpy, mmap_mode='r')
+
+
+def get_roi(aryMsk, varThr=0.0):
+    """
+    Get vertex indices of ROI from mask.
+
+    Parameters
+    ----------
+    aryMsk : np.array
+        Mask, shape `(vertices,)` or `(vertices, 1)`; boolean, or numeric
+        (e.g. pRF overlap ratio sampled on the mesh).
+    varThr : float
+        Vertices with values greater than the threshold are included
+        (ignored for boolean masks).
+
+    Returns
+    -------
+    vecIdx : np.array
+        Sorted vertex indices (int64).
+    """
+    vecMsk = np.asarray(aryMsk).reshape(-1)
+    if vecMsk.dtype != np.bool_:
+        vecMsk = np.greater(vecMsk, varThr)
+    return np.flatnonzero(vecMsk)
+
+
+def load_roi(strPthSrf, strLyr, varThr=0.0, idxCmp=0):
+    """
+    Get vertex indices of ROI from layer of surface dataset.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset (see `pacman_utils.surface`).
+    strLyr : str
+        Name of layer (e.g. pRF overlap sampled on the mesh).
+    varThr : float
+        Vertices with values greater than the threshold are included.
+    idxCmp : int
+        Component of the layer (e.g. cortical depth) to use.
+
+    Returns
+    -------
+    vecIdx : np.array
+        Sorted vertex indices (int64).
+    """
+    return get_roi(load_layer(strPthSrf, strLyr)[:, idxCmp], varThr=varThr)
+
+
+def _roi_key(strPthNpy, vecIdx):
+    """Cache key of ROI (depends on array file & vertex indices)."""
+    objStt = os.stat(strPthNpy)
+    objHsh = hashlib.sha1()
+    objHsh.update(np.ascontiguousarray(vecIdx, dtype=np.int64).tobytes())
+    objHsh.update((str(objStt.st_size) + '_'
+                   + str(objStt.st_mtime_ns)).encode())
+    return objHsh.hexdigest()[:16]
+
+
+def _cache_path(strPthNpy, strKey):
+    """Path of cached ROI time course."""
+    strDir, strFle = os.path.split(strPthNpy)
+    return os.path.join(strDir, 'roi_cache',
+                        (os.path.splitext(strFle)[0] + '_' + strKey + '.npy'))
+
+
+def roi_timecourses(strPthNpy, dicRoi, lgcCache=True, varNumVol=None):
+    """
+    Mean time courses per cortical depth for several ROIs.
+
+    Parameters
+    ----------
+    strPthNpy : str
+        Path of npy file with event-related time courses, shape `(depths,
+        volumes, vertices)`.
+    dicRoi : dict
+        ROIs (key: ROI name, value: vertex indices, see `get_roi`).
+    lgcCache : bool
+        Whether to use (and create) cached ROI time courses (saved in
+        directory 'roi_cache' next to the npy file). The cache is invalidated
+        if the npy file changes.
+    varNumVol : int
+        Number of volumes read at once. By default, blocks of about 256 MB are
+        read.
+
+    Returns
+    -------
+    dicTc : OrderedDict
+        Mean time course of each ROI (key: ROI name), shape `(depths,
+        volumes)`, 64 bit floating point precision. NaN for empty ROIs.
+
+    Notes
+    -----
+    All ROIs that are not cached are reduced in a single pass over the array.
+    The sum over the vertices of all ROIs is computed as one matrix product
+    per block of volumes (with a vertices-by-ROIs weight matrix). If there is
+    an up-to-date vertex-chunked store of the array (see
+    `ert_chunks.write_chunks`), the matrix product is computed per chunk
+    instead, and only chunks that contain ROI vertices are read.
+    """
+    dicTc = OrderedDict()
+    lstRoiNew = []
+
+    for strRoi, vecIdx in dicRoi.items():
+        vecIdx = np.asarray(vecIdx, dtype=np.int64)
+        if lgcCache:
+            strPthCch = _cache_path(strPthNpy, _roi_key(strPthNpy, vecIdx))
+            if os.path.isfile(strPthCch):
+                dicTc[strRoi] = np.load(strPthCch)
+                continue
+        dicTc[strRoi] = None
+        lstRoiNew.append((strRoi, vecIdx))
+
+    if len(lstRoiNew) > 0:
+
+        aryErt = load_ert(strPthNpy)
+        varNumDpth, varNumVolTtl, varNumVrtx = aryErt.shape
+
+        # Weight matrix (vertices by ROIs), one over number of vertices for
+        # vertices of the ROI, zero otherwise:
+        aryWght = np.zeros((varNumVrtx, len(lstRoiNew)), dtype=np.float64)
+        for idxRoi, (_, vecIdx) in enumerate(lstRoiNew):
+            if vecIdx.size > 0:
+                aryWght[vecIdx, idxRoi] = 1.0 / float(vecIdx.size)
+
+        # Only vertices that belong to any ROI need to be considered:
+        vecVrtx = np.flatnonzero(np.any(np.greater(aryWght, 0.0), axis=1))
+        aryWght = aryWght[vecVrtx, :]
+
+        if varNumVol is None:
+            varNumVol = max(int((256 * 1024 * 1024)
+                                // (4 * varNumDpth * varNumVrtx)), 1)
+
+        aryOut = np.zeros((varNumDpth, varNumVolTtl, len(lstRoiNew)),
+                          dtype=np.float64)
+
+        dicIdx = load_chunk_index(strPthNpy)
+
+        if dicIdx is not None:
+
+            # Chunks (vertices, depths, volumes) are contiguous on disk:
+            aryChk = np.load(os.path.join(get_chunk_path(strPthNpy),
+                                          'data.npy'),
+                             mmap_mode='r')
+            vecChk, lstRow = get_roi_chunks(dicIdx, vecVrtx)
+            for idxChk, (vecSel, vecRow) in zip(vecChk, lstRow):
+                aryOut += np.tensordot(
+                    aryChk[idxChk][vecRow].astype(np.float64),
+                    aryWght[vecSel, :],
+                    axes=(0, 0))
+
+        else:
+
+            # Blocks of volumes are contiguous on disk:
+            for idxVol in range(0, varNumVolTtl, varNumVol):
+                aryBlk = np.asarray(aryErt[:, idxVol:(idxVol + varNumVol), :])
+                aryOut[:, idxVol:(idxVol + varNumVol), :] = np.dot(
+                    aryBlk[:, :, vecVrtx].astype(np.float64), aryWght)
+
+        for idxRoi, (strRoi, vecIdx) in enumerate(lstRoiNew):
+            aryTc = aryOut[:, :, idxRoi].copy()
+            if vecIdx.size == 0:
+                aryTc[:] = np.nan
+            dicTc[strRoi] = aryTc
+            if lgcCache:
+                strPthCch = _cache_path(strPthNpy,
+                                        _roi_key(strPthNpy, vecIdx))
+                if not os.path.isdir(os.path.dirname(strPthCch)):
+                    os.makedirs(os.path.dirname(strPthCch))
+                np.save(strPthCch, aryTc)
+
+    return dicTc
+
+
+def depth_profiles(dicPthNpy, dicRoi, lgcCache=True):
+    """
+    Mean time courses per cortical depth for several conditions and ROIs.
+
+    Parameters
+    ----------
+    dicPthNpy : dict
+        Npy files with event-related time courses (key: condition name, value:
+        path of npy file). All conditions need to have the same number of
+        depths & volumes.
+    dicRoi : dict
+        ROIs (key: ROI name, value: vertex indices, see `get_roi`).
+    lgcCache : bool
+        Whether to use (and create) cached ROI time courses.
+
+    Returns
+    -------
+    aryTc : np.array
+        Time courses, shape `(conditions, ROIs, depths, volumes)`.
+    lstCon : list
+        Condition names (order of first dimension of `aryTc`).
+    lstRoi : list
+        ROI names (order of second dimension of `aryTc`).
+    """
+    lstCon = list(dicPthNpy.keys())
+    lstRoi = list(dicRoi.keys())
+
+    lstTc = []
+    for strCon in lstCon:
+        dicTc = roi_timecourses(dicPthNpy[strCon], dicRoi, lgcCache=lgcCache)
+        lstTc.append(np.stack([dicTc[strRoi] for strRoi in lstRoi], axis=0))
+
+    return np.stack(lstTc, axis=0), lstCon, lstRoi
+
+
+def subtract_baseline(aryTc, idxSrt, idxEnd):
+    """
+    Subtract baseline (mean over time window) from time courses.
+
+    Parameters
+    ----------
+    aryTc : np.array
+        Time courses, time along the last dimension (e.g. shape `(conditions,
+        ROIs, depths, volumes)`).
+    idxSrt, idxEnd : int
+        First and last (exclusive) volume of the baseline window.
+
+    Returns
+    -------
+    aryOut : np.array
+        Baseline-corrected time courses (same shape as input).
+    """
+    return aryTc - np.mean(aryTc[..., idxSrt:idxEnd], axis=-1,
+                           keepdims=True)
+
+
+def peak_amplitude(aryTc, idxSrt=0, idxEnd=None, lgcNeg=False):
+    """
+    Peak amplitude & time of peak within time window.
+
+    Parameters
+    ----------
+    aryTc : np.array
+        Time courses, time along the last dimension (e.g. shape `(conditions,
+        ROIs, depths, volumes)`).
+    idxSrt, idxEnd : int
+        First and last (exclusive) volume of the window in which to search
+        for the peak. Until the end of the time course if `idxEnd` is None.
+    lgcNeg : bool
+        Whether to search for a negative peak (minimum) instead of a positive
+        peak (maximum).
+
+    Returns
+    -------
+    aryPeak : np.array
+        Peak amplitudes (shape of input without last dimension).
+    aryIdxPeak : np.array
+        Volume index of peak, relative to the start of the time course.
+    """
+    aryWin = aryTc[..., idxSrt:idxEnd]
+    if lgcNeg:
+        aryIdx = np.argmin(aryWin, axis=-1)
+    else:
+        aryIdx = np.argmax(aryWin, axis=-1)
+    aryPeak = np.take_along_axis(aryWin, aryIdx[..., None], axis=-1)[..., 0]
+    return aryPeak, (aryIdx + idxSrt)
+
+
+def response_latency(aryTc, varTr, idxSrt=0, idxEnd=None, varFrc=0.5):
+    """
+    Response latency (time at which a fraction of the peak is reached).
+
+    Parameters
+    ----------
+    aryTc : np.array
+        Time courses, time along the last dimension (e.g. shape `(conditions,
+        ROIs, depths, volumes)`). Should be baseline-corrected.
+    varTr : float
+        Volume TR [s].
+    idxSrt, idxEnd : int
+        First and last (exclusive) volume of the window in which to search
+        for the response (e.g. from stimulus onset until the end of the time
+        course).
+    varFrc : float
+        Fraction of the peak amplitude (e.g. 0.5 for the time at half
+        maximum).
+
+    Returns
+    -------
+    aryLtnc : np.array
+        Latency [s] relative to the start of the window (shape of input
+        without last dimension), linearly interpolated between volumes. NaN
+        if the peak is not positive.
+    """
+    aryWin = np.asarray(aryTc[..., idxSrt:idxEnd], dtype=np.float64)
+    aryPeak, aryIdxPeak = peak_amplitude(aryWin)
+    aryLvl = aryPeak * varFrc
+
+    # First volume at which the level is reached (only up to the peak):
+    varNumVol = aryWin.shape[-1]
+    vecTme = np.arange(varNumVol)
+    aryLgc = np.logical_and(np.greater_equal(aryWin, aryLvl[..., None]),
+                            np.less_equal(vecTme, aryIdxPeak[..., None]))
+    aryIdx = np.argmax(aryLgc, axis=-1)
+
+    # Linear interpolation between previous volume and crossing:
+    aryIdxPre = np.maximum((aryIdx - 1), 0)
+    aryVal = np.take_along_axis(aryWin, aryIdx[..., None], axis=-1)[..., 0]
+    aryValPre = np.take_along_axis(aryWin, aryIdxPre[..., None],
+                                   axis=-1)[..., 0]
+    aryDiff = aryVal - aryValPre
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aryFrc = np.where(np.greater(aryDiff, 0.0),
+                          ((aryLvl - aryValPre) / aryDiff),
+                          1.0)
+    aryFrc = np.where(np.greater(aryIdx, 0), aryFrc, 0.0)
+    aryLtnc = ((aryIdxPre + aryFrc) * varTr)
+
+    # Undefined latency if there is no positive peak:
+    aryLtnc = np.where(np.greater(aryPeak, 0.0), aryLtnc, np.nan)
+
+    return aryLtnc
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Vertex-chunked storage of event-related time courses.
+
+Event-related time courses are converted from vtk meshes into npy arrays of
+shape `(depths, volumes, vertices)` (see `vtk_to_npy_conversion.py`). In this
+layout, the time courses of a few thousand scattered ROI vertices are spread
+over every page of the file. A chunked store holds the same data vertex-major,
+in blocks of vertices, so that the time courses of one vertex (all depths &
+volumes) are contiguous on disk, and an ROI query only reads the chunks that
+contain ROI vertices. The store is a directory next to the npy file
+(`<name>_chunks/`):
+
+    data.npy      Time courses, float32, shape (chunks, vertices per chunk,
+                  depths, volumes). The last chunk is padded with zeros.
+    order.npy     Original vertex index at each position of the store, int64,
+                  shape (vertices,). Vertices of ROIs given when creating the
+                  store are grouped together, so that each ROI occupies as
+                  few chunks as possible.
+    index.json    Shape of the source array, chunk size, size & modification
+                  time of the source npy file (the store is ignored if the
+                  source file changes), and the chunks of each ROI.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import numpy as np
+
+
+def get_chunk_path(strPthNpy):
+    """
+    Get directory of chunked store belonging to npy file.
+
+    Parameters
+    ----------
+    strPthNpy : str
+        Path of npy file (e.g. `aryErt_<condition>.npy`).
+
+    Returns
+    -------
+    strPthChk : str
+        Directory of chunked store (`<name>_chunks` next to the npy file).
+    """
+    return os.path.splitext(strPthNpy)[0] + '_chunks'
+
+
+def _get_order(varNumVrtx, dicRoi):
+    """Order of vertices in store (ROI vertices grouped by ROI first)."""
+    if not dicRoi:
+        return np.arange(varNumVrtx, dtype=np.int64)
+
+    # Vertices that belong to several ROIs are placed with the first ROI:
+    lstIdx = [np.asarray(vecIdx, dtype=np.int64) for vecIdx in dicRoi.values()]
+    vecRoi = np.concatenate(lstIdx + [np.arange(varNumVrtx, dtype=np.int64)])
+    _, vecFrst = np.unique(vecRoi, return_index=True)
+    return vecRoi[np.sort(vecFrst)]
+
+
+def _roi_chunks(vecPos, varChkSze, dicRoi):
+    """Chunks that contain the vertices of each ROI."""
+    dicChk = {}
+    for strRoi, vecIdx in dicRoi.items():
+        vecIdx = np.asarray(vecIdx, dtype=np.int64)
+        dicChk[strRoi] = np.unique(vecPos[vecIdx] // varChkSze).tolist()
+    return dicChk
+
+
+def write_chunks(strPthNpy, dicRoi=None, varChkSze=1024, varMem=256):
+    """
+    Create chunked store from npy file.
+
+    Parameters
+    ----------
+    strPthNpy : str
+        Path of npy file with event-related time courses, shape `(depths,
+        volumes, vertices)`.
+    dicRoi : dict
+        ROIs (key: ROI name, value: vertex indices, see
+        `depth_profile.get_roi`). The vertices of each ROI are stored next to
+        each other, and the chunks of each ROI are recorded in the index.
+        Vertices keep their original order if None.
+    varChkSze : int
+        Number of vertices per chunk.
+    varMem : int
+        Approximate amount of memory [MB] used when reading the source
+        array. The source array is read in blocks of vertices (one pass per
+        block).
+
+    Returns
+    -------
+    strPthChk : str
+        Directory of chunked store. An existing store is replaced.
+    """
+    if dicRoi is None:
+        dicRoi = {}
+
+    aryErt = np.load(strPthNpy, mmap_mode='r')
+    varNumDpth, varNumVol, varNumVrtx = aryErt.shape
+    varNumChk = int(np.ceil(float(varNumVrtx) / float(varChkSze)))
+
+    vecOrd = _get_order(varNumVrtx, dicRoi)
+    vecPos = np.empty(varNumVrtx, dtype=np.int64)
+    vecPos[vecOrd] = np.arange(varNumVrtx)
+
+    strPthChk = get_chunk_path(strPthNpy)
+    if not os.path.isdir(strPthChk):
+        os.makedirs(strPthChk)
+
+    # The index is removed first, and written last, so that an incomplete
+    # store is never used:
+    strPthIdx = os.path.join(strPthChk, 'index.json')
+    if os.path.isfile(strPthIdx):
+        os.remove(strPthIdx)
+
+    strPthTmp = os.path.join(strPthChk, 'data.tmp.npy')
+    aryChk = np.lib.format.open_memmap(strPthTmp,
+                                       mode='w+',
+                                       dtype=np.float32,
+                                       shape=(varNumChk,
+                                              varChkSze,
+                                              varNumDpth,
+                                              varNumVol))
+
+    # Number of chunks per block (blocks of vertices are read from the
+    # source array at once):
+    varNumChkBlk = max(int((varMem * 1024 * 1024)
+                           // (4 * varNumDpth * varNumVol * varChkSze)), 1)
+
+    for idxChk in range(0, varNumChk, varNumChkBlk):
+        idxSrt = idxChk * varChkSze
+        idxEnd = min(((idxChk + varNumChkBlk) * varChkSze), varNumVrtx)
+        vecIdx = vecOrd[idxSrt:idxEnd]
+
+        # Contiguous, ascending vertices are read as a slice (only ROI
+        # vertices are out of order):
+        if np.all(np.equal(np.diff(vecIdx), 1)):
+            aryBlk = aryErt[:, :, vecIdx[0]:(vecIdx[-1] + 1)]
+        else:
+            aryBlk = aryErt[:, :, vecIdx]
+
+        # Vertex-major (vertices, depths, volumes), padded to full chunks:
+        aryBlk = np.transpose(aryBlk, (2, 0, 1))
+        varNumPad = (-aryBlk.shape[0]) % varChkSze
+        if varNumPad > 0:
+            aryBlk = np.concatenate(
+                (aryBlk,
+                 np.zeros((varNumPad, varNumDpth, varNumVol),
+                          dtype=aryBlk.dtype)),
+                axis=0)
+        aryChk[idxChk:(idxChk + (aryBlk.shape[0] // varChkSze))] = \
+            aryBlk.reshape(-1, varChkSze, varNumDpth, varNumVol)
+
+    aryChk.flush()
+
+    # Check that the vertices of each ROI (first chunk of the ROI) are in the
+    # positions recorded in the order, before the store is marked as complete:
+    for strRoi, vecIdx in dicRoi.items():
+        vecIdx = np.asarray(vecIdx, dtype=np.int64)[:varChkSze]
+        vecTmp = vecPos[vecIdx]
+        aryTmp = aryChk[(vecTmp // varChkSze), (vecTmp % varChkSze)]
+        if not np.array_equal(aryTmp,
+                              np.transpose(aryErt[:, :, vecIdx],
+                                           (2, 0, 1)).astype(np.float32)):
+            raise RuntimeError('Chunked store does not match vertex order '
+                               + '(ROI ' + strRoi + '): ' + strPthNpy)
+
+    del(aryChk)
+    os.replace(strPthTmp, os.path.join(strPthChk, 'data.npy'))
+
+    np.save(os.path.join(strPthChk, 'order.npy'), vecOrd)
+
+    objStt = os.stat(strPthNpy)
+    dicIdx = {'shape': [varNumDpth, varNumVol, varNumVrtx],
+              'chunk_size': varChkSze,
+              'size': objStt.st_size,
+              'mtime_ns': objStt.st_mtime_ns,
+              'roi': _roi_chunks(vecPos, varChkSze, dicRoi)}
+    with open(strPthIdx, 'w') as objFle:
+        json.dump(dicIdx, objFle, indent=2)
+
+    return strPthChk
+
+
+def load_chunk_index(strPthNpy):
+    """
+    Load index of chunked store.
+
+    Parameters
+    ----------
+    strPthNpy : str
+        Path of npy file from which the store was created.
+
+    Returns
+    -------
+    dicIdx : dict or None
+        Index of chunked store (see module docstring), with additional item
+        'position' (position of each original vertex in the store). None if
+        there is no complete store, or if the npy file has changed since the
+        store was created.
+    """
+    strPthIdx = os.path.join(get_chunk_path(strPthNpy), 'index.json')
+    if not os.path.isfile(strPthIdx):
+        return None
+
+    with open(strPthIdx, 'r') as objFle:
+        dicIdx = json.load(objFle)
+
+    objStt = os.stat(strPthNpy)
+    if ((dicIdx['size'] != objStt.st_size)
+            or (dicIdx['mtime_ns'] != objStt.st_mtime_ns)):
+        return None
+
+    vecOrd = np.load(os.path.join(get_chunk_path(strPthNpy), 'order.npy'))
+    vecPos = np.empty(vecOrd.size, dtype=np.int64)
+    vecPos[vecOrd] = np.arange(vecOrd.size)
+    dicIdx['position'] = vecPos
+
+    return dicIdx
+
+
+def get_roi_chunks(dicIdx, vecIdx):
+    """
+    Get chunks containing vertices, and position of vertices within chunks.
+
+    Parameters
+    ----------
+    dicIdx : dict
+        Index of chunked store (see `load_chunk_index`).
+    vecIdx : np.array
+        Vertex indices (in the original vertex order).
+
+    Returns
+    -------
+    vecChk : np.array
+        Sorted indices of chunks that contain any of the vertices.
+    lstRow : list
+        For each chunk in `vecChk`, a tuple of (positions of the vertices in
+        `vecIdx` that are in this chunk, rows of these vertices within the
+        chunk).
+    """
+    vecPos = dicIdx['position'][np.asarray(vecIdx, dtype=np.int64)]
+    varChkSze = dicIdx['chunk_size']
+
+    # Vertices sorted by position in store, split at chunk boundaries:
+    vecSrt = np.argsort(vecPos, kind='stable')
+    vecChkVrtx = vecPos[vecSrt] // varChkSze
+    vecChk, vecSplt = np.unique(vecChkVrtx, return_index=True)
+
+    lstRow = []
+    for vecSel in np.split(vecSrt, vecSplt[1:]):
+        lstRow.append((vecSel, (vecPos[vecSel] % varChkSze)))
+
+    return vecChk, lstRow
+
+
+def read_vertices(strPthNpy, vecIdx, dicIdx=None):
+    """
+    Read time courses of vertices from chunked store.
+
+    Only the chunks that contain any of the vertices are read.
+
+    Parameters
+    ----------
+    strPthNpy : str
+        Path of npy file from which the store was created.
+    vecIdx : np.array
+        Vertex indices (in the original vertex order).
+    dicIdx : dict
+        Index of chunked store (loaded if None, see `load_chunk_index`).
+
+    Returns
+    -------
+    aryOut : np.array
+        Time courses, float32, shape `(depths, volumes, vertices)` (vertices
+        in the order of `vecIdx`, as for `aryErt[:, :, vecIdx]`).
+    """
+    if dicIdx is None:
+        dicIdx = load_chunk_index(strPthNpy)
+        if dicIdx is None:
+            raise ValueError('No up-to-date chunked store for: ' + strPthNpy)
+
+    aryChk = np.load(os.path.join(get_chunk_path(strPthNpy), 'data.npy'),
+                     mmap_mode='r')
+
+    vecIdx = np.asarray(vecIdx, dtype=np.int64)
+    aryOut = np.empty(((vecIdx.size,) + aryChk.shape[2:]), dtype=np.float32)
+
+    vecChk, lstRow = get_roi_chunks(dicIdx, vecIdx)
+    for idxChk, (vecSel, vecRow) in zip(vecChk, lstRow):
+        aryOut[vecSel] = aryChk[idxChk][vecRow]
+
+    return np.transpose(aryOut, (1, 2, 0))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Group average of event-related time courses across subjects.
+
+Each session directory converts its event-related time courses into npy
+arrays of shape `(depths, volumes, vertices)` (see `vtk_to_npy_conversion.py`,
+files `cbs/<hemisphere>_era/<condition>/aryErt_<condition>.npy`). Since every
+subject has its own mesh, the arrays are first reduced within ROIs to time
+courses per depth (see `depth_profile.roi_timecourses`); ROIs are defined by
+layers of the per-hemisphere surface dataset of each subject (see
+`pacman_utils.surface`). The reduced time courses are then averaged across
+subjects.
+
+The arrays of all subjects and conditions are memory-mapped and reduced in
+parallel (process pool). Group means and standard errors are accumulated as
+the results of the subjects arrive (running mean & sum of squared deviations),
+so that the data of all subjects are never held in memory at once.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import warnings
+import multiprocessing as mp
+import numpy as np
+from pacman_utils.depth_profile import load_roi
+from pacman_utils.depth_profile import roi_timecourses
+
+
+def get_ert_path(strPthData, strSub, strHmsph, strCon):
+    """
+    Get path of npy file with event-related time courses of one subject.
+
+    Parameters
+    ----------
+    strPthData : str
+        Data directory (environmental variable `pacman_data_path`).
+    strSub : str
+        Subject ID (e.g. '20181029').
+    strHmsph : str
+        Hemisphere ('lh' or 'rh').
+    strCon : str
+        Condition (e.g. 'kanizsa').
+
+    Returns
+    -------
+    strPthNpy : str
+        Path of npy file.
+    """
+    return os.path.join(strPthData, strSub, 'cbs', (strHmsph + '_era'),
+                        strCon, ('aryErt_' + strCon + '.npy'))
+
+
+def _reduce_subject(tplTsk):
+    """Reduce event-related time courses of one subject & condition."""
+    (idxSub, idxCon, strPthNpy, strPthSrf, lstRoi, lgcCache) = tplTsk
+
+    # Vertex indices of ROIs (from layers of subject's surface dataset):
+    dicRoi = {}
+    for strRoi, strLyr, varThr in lstRoi:
+        dicRoi[strRoi] = load_roi(strPthSrf, strLyr, varThr=varThr)
+
+    dicTc = roi_timecourses(strPthNpy, dicRoi, lgcCache=lgcCache)
+
+    # Number of vertices per ROI (for reporting):
+    vecNumVrtx = np.array([dicRoi[tplRoi[0]].size for tplRoi in lstRoi])
+
+    return (idxSub, idxCon, [tplRoi[0] for tplRoi in lstRoi],
+            np.stack([dicTc[tplRoi[0]] for tplRoi in lstRoi], axis=0),
+            vecNumVrtx)
+
+
+def group_era(strPthData, lstSub, lstCon, dicRoi, varPar=1, lgcCache=True,
+              dicSubCon=None):
+    """
+    Group mean & SEM of ROI time courses per depth.
+
+    Parameters
+    ----------
+    strPthData : str
+        Data directory (environmental variable `pacman_data_path`).
+    lstSub : list
+        Subject IDs (e.g. ['20181029', '20181105']).
+    lstCon : list
+        Conditions (e.g. ['bright_square', 'kanizsa']). Subjects for which a
+        condition is missing are left out of the average of that condition.
+    dicRoi : dict
+        ROI definitions (key: ROI name). Each value is a tuple of (hemisphere,
+        name of layer in the surface dataset `cbs/<hemisphere>/surface` of
+        each subject, threshold), e.g. `('lh', 'V1_lh', 0.5)`. Vertices with
+        layer values greater than the threshold are included.
+    varPar : int
+        Number of parallel processes.
+    lgcCache : bool
+        Whether to use (and create) cached ROI time courses (see
+        `depth_profile.roi_timecourses`).
+    dicSubCon : dict
+        Conditions of each subject (key: subject ID, value: list of
+        conditions), e.g. if different sessions had different stimuli. Only
+        these conditions (out of `lstCon`) are read for the subject. All
+        conditions are read for subjects that are not listed, or if None.
+
+    Returns
+    -------
+    dicOut : dict
+        Group results:
+        'mean' : Group mean, shape `(conditions, ROIs, depths, volumes)`.
+        'sem' : Standard error of the mean (same shape), NaN if there are
+            fewer than two subjects.
+        'num_sub' : Number of subjects contributing to each mean, shape
+            `(conditions, ROIs)`.
+        'num_vrtx' : Number of ROI vertices per subject, shape `(subjects,
+            ROIs)`.
+        'conditions', 'rois', 'subjects' : Names along the dimensions.
+    """
+    lstRoiNme = list(dicRoi.keys())
+    lstHmsph = sorted(set([tplRoi[0] for tplRoi in dicRoi.values()]))
+
+    # One task per subject, condition, and hemisphere (all ROIs of a
+    # hemisphere are reduced in one pass over the array):
+    lstTsk = []
+    for idxSub, strSub in enumerate(lstSub):
+        for idxCon, strCon in enumerate(lstCon):
+            if ((dicSubCon is not None) and (strSub in dicSubCon)
+                    and (strCon not in dicSubCon[strSub])):
+                continue
+            for strHmsph in lstHmsph:
+                strPthNpy = get_ert_path(strPthData, strSub, strHmsph, strCon)
+                if not os.path.isfile(strPthNpy):
+                    print('---Missing (skipped): ' + strPthNpy)
+                    continue
+                strPthSrf = os.path.join(strPthData, strSub, 'cbs', strHmsph,
+                                         'surface')
+                lstRoi = [(strRoi, dicRoi[strRoi][1], dicRoi[strRoi][2])
+                          for strRoi in lstRoiNme
+                          if dicRoi[strRoi][0] == strHmsph]
+                lstTsk.append((idxSub, idxCon, strPthNpy, strPthSrf, lstRoi,
+                               lgcCache))
+
+    # Index of each ROI of a task in the output arrays:
+    dicIdxRoi = dict([(strRoi, idxRoi)
+                      for idxRoi, strRoi in enumerate(lstRoiNme)])
+
+    aryMne = None
+    arySsq = None
+    aryNum = np.zeros((len(lstCon), len(lstRoiNme)), dtype=np.int64)
+    aryNumVrtx = np.zeros((len(lstSub), len(lstRoiNme)), dtype=np.int64)
+
+    # Subjects that contribute to at least one mean:
+    setSubCntr = set()
+
+    if varPar > 1:
+        objPool = mp.Pool(processes=varPar)
+        objItr = objPool.imap_unordered(_reduce_subject, lstTsk)
+    else:
+        objPool = None
+        objItr = map(_reduce_subject, lstTsk)
+
+    try:
+        for idxSub, idxCon, lstRoiTsk, aryTc, vecNumVrtx in objItr:
+
+            if aryMne is None:
+                tplShp = ((len(lstCon), len(lstRoiNme)) + aryTc.shape[1:])
+                aryMne = np.zeros(tplShp, dtype=np.float64)
+                arySsq = np.zeros(tplShp, dtype=np.float64)
+            elif aryTc.shape[1:] != aryMne.shape[2:]:
+                raise ValueError('Time courses of subject ' + lstSub[idxSub]
+                                 + ' have shape ' + str(aryTc.shape[1:])
+                                 + ', expected ' + str(aryMne.shape[2:]))
+
+            # Running mean & sum of squared deviations (Welford):
+            for idxTsk, strRoi in enumerate(lstRoiTsk):
+                idxRoi = dicIdxRoi[strRoi]
+                aryNumVrtx[idxSub, idxRoi] = vecNumVrtx[idxTsk]
+                # Subjects without ROI vertices are left out:
+                if vecNumVrtx[idxTsk] == 0:
+                    continue
+                aryNum[idxCon, idxRoi] += 1
+                setSubCntr.add(idxSub)
+                aryDlt = aryTc[idxTsk] - aryMne[idxCon, idxRoi]
+                aryMne[idxCon, idxRoi] += (aryDlt
+                                           / float(aryNum[idxCon, idxRoi]))
+                arySsq[idxCon, idxRoi] += (aryDlt
+                                           * (aryTc[idxTsk]
+                                              - aryMne[idxCon, idxRoi]))
+
+    finally:
+        if objPool is not None:
+            objPool.close()
+            objPool.join()
+
+    if aryMne is None:
+        raise ValueError('No event-related time courses found.')
+
+    # Subjects that do not contribute to any condition & ROI (e.g. missing
+    # data, or conditions that do not match):
+    for idxSub, strSub in enumerate(lstSub):
+        if idxSub not in setSubCntr:
+            warnings.warn('Subject ' + strSub + ' does not contribute to the'
+                          + ' group average of any condition & ROI.')
+
+    # Standard error of the mean (sample standard deviation over square root
+    # of number of subjects):
+    aryNumTmp = aryNum[:, :, None, None].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arySem = np.sqrt(arySsq / (aryNumTmp - 1.0)) / np.sqrt(aryNumTmp)
+    arySem[np.less(aryNum, 2)] = np.nan
+    aryMne[np.less(aryNum, 1)] = np.nan
+
+    return {'mean': aryMne,
+            'sem': arySem,
+            'num_sub': aryNum,
+            'num_vrtx': aryNumVrtx,
+            'conditions': list(lstCon),
+            'rois': lstRoiNme,
+            'subjects': list(lstSub)}
+
+
+def save_group(strPthOut, dicOut):
+    """
+    Save group results (see `group_era`) to compressed npz file.
+
+    Parameters
+    ----------
+    strPthOut : str
+        Output path (npz file).
+    dicOut : dict
+        Group results, as returned by `group_era`.
+    """
+    np.savez_compressed(strPthOut,
+                        mean=dicOut['mean'].astype(np.float32),
+                        sem=dicOut['sem'].astype(np.float32),
+                        num_sub=dicOut['num_sub'],
+                        num_vrtx=dicOut['num_vrtx'],
+                        conditions=np.array(dicOut['conditions']),
+                        rois=np.array(dicOut['rois']),
+                        subjects=np.array(dicOut['subjects']))
+
+
+def load_group(strPthIn):
+    """
+    Load group results saved with `save_group`.
+
+    Parameters
+    ----------
+    strPthIn : str
+        Path of npz file.
+
+    Returns
+    -------
+    dicOut : dict
+        Group results (see `group_era`).
+    """
+    with np.load(strPthIn) as objNpz:
+        dicOut = dict([(strKey, objNpz[strKey]) for strKey in objNpz.files])
+    for strKey in ('conditions', 'rois', 'subjects'):
+        dicOut[strKey] = [str(strTmp) for strTmp in dicOut[strKey]]
+    return dicOut
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Construction of binary masks (brain masks, white matter masks).
+
+Masks are created from an image by an intensity threshold, followed by a
+cluster size threshold and a chain of morphological operations. The cluster
+size threshold is applied with a lookup table over the label image (one pass
+over the volume, independent of the number of clusters). Repeated dilations
+or erosions are applied as one operation (thresholded distance transform
+within the bounding box of the mask). A two-class intensity model (Otsu
+threshold) provides a fast approximate tissue estimate, e.g. white matter in
+a T1 map.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from scipy import ndimage
+from skimage.measure import label
+from skimage.filters import threshold_otsu
+
+# Morphological operations that can be used in a chain (see
+# `apply_morphology`), as sequences of elementary operations (closing is
+# dilation followed by erosion, opening is erosion followed by dilation):
+dicMrph = {'dilation': ['dilation'],
+           'erosion': ['erosion'],
+           'opening': ['erosion', 'dilation'],
+           'closing': ['dilation', 'erosion']}
+
+
+def filter_clusters(aryMsk, varCluSzeThr, varCon=2):
+    """
+    Remove connected clusters below size threshold from binary mask.
+
+    Parameters
+    ----------
+    aryMsk : np.array
+        Binary mask (non-zero voxels are considered part of the mask).
+    varCluSzeThr : int
+        Cluster size threshold. Clusters with fewer voxels are removed.
+    varCon : int
+        Connectivity of clusters, i.e. maximum number of orthogonal steps
+        between neighbouring voxels (1 to number of dimensions, see
+        `skimage.measure.label`).
+
+    Returns
+    -------
+    aryMsk : np.array
+        Binary mask (boolean) without small clusters.
+    """
+    # Labelled clusters (zero is background):
+    aryLbls = label(np.not_equal(aryMsk, 0), connectivity=varCon)
+
+    # Number of voxels per label (labels are contiguous, starting at zero):
+    vecCnt = np.bincount(aryLbls.ravel())
+
+    # Lookup table (label to mask value); the background is never included:
+    vecLut = np.greater_equal(vecCnt, varCluSzeThr)
+    vecLut[0] = False
+
+    return vecLut[aryLbls]
+
+
+def two_class_mask(aryData, aryMsk=None, lgcLow=True, varNumBin=256):
+    """
+    Separate image into two intensity classes (Otsu threshold).
+
+    Parameters
+    ----------
+    aryData : np.array
+        Input image (e.g. T1 map).
+    aryMsk : np.array
+        Voxels used to estimate the threshold, and to be classified (e.g.
+        voxels within an intensity range). All non-zero voxels if None.
+    lgcLow : bool
+        Whether to return the class with low intensities (e.g. white matter
+        in a T1 map), or the class with high intensities.
+    varNumBin : int
+        Number of histogram bins used to estimate the threshold.
+
+    Returns
+    -------
+    aryOut : np.array
+        Voxels of the selected class (boolean).
+    varThr : float
+        Intensity threshold between the two classes.
+    """
+    if aryMsk is None:
+        aryMsk = np.not_equal(aryData, 0)
+    else:
+        aryMsk = np.not_equal(aryMsk, 0)
+
+    varThr = float(threshold_otsu(aryData[aryMsk], nbins=varNumBin))
+
+    if lgcLow:
+        aryOut = np.less_equal(aryData, varThr)
+    else:
+        aryOut = np.greater(aryData, varThr)
+
+    return np.logical_and(aryOut, aryMsk), varThr
+
+
+def get_bbox(aryMsk, varPad=0):
+    """
+    Get bounding box of binary mask.
+
+    Parameters
+    ----------
+    aryMsk : np.array
+        Binary mask (needs to contain at least one non-zero voxel).
+    varPad : int
+        Number of voxels by which the bounding box is extended on each side
+        (within the bounds of the array).
+
+    Returns
+    -------
+    tplBox : tuple
+        Slices of bounding box (one per dimension).
+    """
+    lstSlc = []
+    for idxDim in range(aryMsk.ndim):
+        vecAx = tuple([idxAx for idxAx in range(aryMsk.ndim)
+                       if idxAx != idxDim])
+        vecIdx = np.flatnonzero(np.any(aryMsk, axis=vecAx))
+        lstSlc.append(slice(max((vecIdx[0] - varPad), 0),
+                            min((vecIdx[-1] + varPad + 1),
+                                aryMsk.shape[idxDim])))
+    return tuple(lstSlc)
+
+
+def dilate(aryMsk, varNum=1):
+    """
+    Dilate binary mask repeatedly, in one operation.
+
+    Parameters
+    ----------
+    aryMsk : np.array
+        Binary mask.
+    varNum : int
+        Number of dilations.
+
+    Returns
+    -------
+    aryOut : np.array
+        Dilated mask (boolean).
+
+    Notes
+    -----
+    Repeated dilation with the default (cross-shaped) structuring element is
+    equivalent to including all voxels within a city block distance of
+    `varNum` from the mask. The distance transform is only computed within
+    the bounding box of the mask (padded by `varNum` voxels). The result is
+    identical to `varNum` calls of `skimage.morphology.binary_dilation`.
+    """
+    aryMsk = np.not_equal(aryMsk, 0)
+    aryOut = np.zeros(aryMsk.shape, dtype=np.bool_)
+    if (varNum < 1) or not np.any(aryMsk):
+        aryOut[aryMsk] = True
+        return aryOut
+
+    tplBox = get_bbox(aryMsk, varNum)
+    aryDst = ndimage.distance_transform_cdt(np.logical_not(aryMsk[tplBox]),
+                                            metric='taxicab')
+    aryOut[tplBox] = np.less_equal(aryDst, varNum)
+    return aryOut
+
+
+def erode(aryMsk, varNum=1):
+    """
+    Erode binary mask repeatedly, in one operation.
+
+    Parameters
+    ----------
+    aryMsk : np.array
+        Binary mask.
+    varNum : int
+        Number of erosions.
+
+    Returns
+    -------
+    aryOut : np.array
+        Eroded mask (boolean).
+
+    Notes
+    -----
+    Voxels are kept if their city block distance from the nearest voxel
+    outside the mask is greater than `varNum`. As for
+    `skimage.morphology.binary_erosion`, voxels outside of the array are
+    considered part of the mask. The result is identical to `varNum` calls of
+    `skimage.morphology.binary_erosion`.
+    """
+    aryMsk = np.not_equal(aryMsk, 0)
+    aryOut = np.zeros(aryMsk.shape, dtype=np.bool_)
+    if (varNum < 1) or not np.any(aryMsk):
+        aryOut[aryMsk] = True
+        return aryOut
+
+    tplBox = get_bbox(aryMsk, varNum)
+    aryMskBox = aryMsk[tplBox]
+
+    # Without background in the bounding box, the mask is not eroded (the
+    # array border is not treated as background):
+    if np.all(aryMskBox):
+        aryOut[tplBox] = True
+        return aryOut
+
+    aryDst = ndimage.distance_transform_cdt(aryMskBox, metric='taxicab')
+    aryOut[tplBox] = np.greater(aryDst, varNum)
+    return aryOut
+
+
+def _get_steps(lstMrph):
+    """Convert chain of operations into runs of dilations & erosions."""
+    lstStp = []
+    for objMrph in lstMrph:
+        if isinstance(objMrph, str):
+            strMrph, varNum = objMrph, 1
+        else:
+            strMrph, varNum = objMrph
+        if strMrph not in dicMrph:
+            raise ValueError('Unknown morphological operation: ' + strMrph
+                             + ' (available: '
+                             + ', '.join(sorted(dicMrph.keys())) + ')')
+        for strStp in dicMrph[strMrph]:
+            for _ in range(int(varNum)):
+                # Consecutive operations of the same type are merged:
+                if (len(lstStp) > 0) and (lstStp[-1][0] == strStp):
+                    lstStp[-1][1] += 1
+                else:
+                    lstStp.append([strStp, 1])
+    return lstStp
+
+
+def apply_morphology(aryMsk, lstMrph):
+    """
+    Apply chain of morphological operations to binary mask.
+
+    Parameters
+    ----------
+    aryMsk : np.array
+        Binary mask.
+    lstMrph : list
+        Names of morphological operations (keys of `dicMrph`), applied in the
+        given order, e.g. `['dilation', 'dilation', 'erosion']`. An operation
+        can be repeated by giving a tuple of name and number of repetitions,
+        e.g. `[('dilation', 5)]`. Each operation uses the default
+        (cross-shaped) structuring element; consecutive dilations (or
+        erosions) are applied in one step (see `dilate` and `erode`).
+
+    Returns
+    -------
+    aryMsk : np.array
+        Binary mask (boolean).
+    """
+    aryMsk = np.not_equal(aryMsk, 0)
+    for strStp, varNum in _get_steps(lstMrph):
+        if strStp == 'dilation':
+            aryMsk = dilate(aryMsk, varNum)
+        else:
+            aryMsk = erode(aryMsk, varNum)
+    return aryMsk
+
+
+def make_mask(aryData, varIntThr=None, varCluSzeThr=None, varCon=2,
+              lstMrphPre=None, lstMrphPost=None):
+    """
+    Create binary mask from image.
+
+    Parameters
+    ----------
+    aryData : np.array
+        Input image.
+    varIntThr : float
+        Intensity threshold; voxels with values greater than or equal to the
+        threshold are included. If None, all non-zero voxels are included
+        (e.g. for binary input images).
+    varCluSzeThr : int
+        Cluster size threshold (see `filter_clusters`). Not applied if None.
+    varCon : int
+        Connectivity of clusters (see `filter_clusters`).
+    lstMrphPre : list
+        Morphological operations applied before the cluster size threshold
+        (see `apply_morphology`).
+    lstMrphPost : list
+        Morphological operations applied after the cluster size threshold.
+
+    Returns
+    -------
+    aryMsk : np.array
+        Binary mask (boolean).
+    """
+    if varIntThr is None:
+        aryMsk = np.not_equal(aryData, 0)
+    else:
+        aryMsk = np.greater_equal(aryData, float(varIntThr))
+
+    if lstMrphPre:
+        aryMsk = apply_morphology(aryMsk, lstMrphPre)
+
+    if varCluSzeThr is not None:
+        aryMsk = filter_clusters(aryMsk, varCluSzeThr, varCon=varCon)
+
+    if lstMrphPost:
+        aryMsk = apply_morphology(aryMsk, lstMrphPost)
+
+    return aryMsk
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel gzip compression and decompression of nii files.
+
+Nii files are compressed in independent blocks, which are compressed (and
+decompressed) in parallel threads. Each block is written as a separate gzip
+member; a file consisting of several concatenated gzip members is a valid
+gzip file, so that the output can be read by any gzip-capable software (e.g.
+FSL, nibabel, gzip). The compressed size of each member is stored in the
+'extra' field of the member header (similar to the BGZF format), so that
+members can be located without decompressing the file, which allows for
+parallel decompression.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import numbers
+import zlib
+import struct
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nb
+
+
+# Compression level for different types of output (zlib levels, 1 is fastest,
+# 9 gives smallest files). Large 4D time series are compressed at a low level,
+# binary masks compress well at any level.
+dicGzLvl = {'default': 6,
+            'timeseries': 1,
+            'map': 4,
+            'mask': 1}
+
+# Size of uncompressed blocks [bytes]:
+varBlkSze = 4 * 1024 * 1024
+
+# Identifier of the 'extra' subfield holding the compressed member size:
+bytSubId = b'PM'
+
+# Length of member header (10 byte gzip header, 2 byte XLEN, 4 byte subfield
+# header, 4 byte member size):
+varHdrLen = 20
+
+
+def get_num_thrd():
+    """
+    Get number of threads for compression.
+
+    Returns
+    -------
+    varNumThrd : int
+        Number of threads, as specified by the environmental variable
+        `pacman_cpu`, or number of CPUs if not specified.
+    """
+    try:
+        return max(int(os.environ['pacman_cpu']), 1)
+    except (KeyError, ValueError):
+        return mp.cpu_count()
+
+
+def _compress_block(bytBlk, varLvl):
+    """Compress one block into a gzip member with size information."""
+    objCmp = zlib.compressobj(varLvl, zlib.DEFLATED, -zlib.MAX_WBITS)
+    bytCmp = objCmp.compress(bytBlk) + objCmp.flush()
+
+    # Total size of the gzip member:
+    varMmbSze = varHdrLen + len(bytCmp) + 8
+
+    # Gzip header: magic number, deflate, FEXTRA flag, no time stamp, unknown
+    # OS; followed by the 'extra' field with the member size:
+    bytHdr = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff'
+              + struct.pack('<H', 8)
+              + bytSubId
+              + struct.pack('<HI', 4, varMmbSze))
+
+    # Gzip trailer: CRC32 and uncompressed size:
+    bytTrl = struct.pack('<II',
+                         (zlib.crc32(bytBlk) & 0xffffffff),
+                         (len(bytBlk) & 0xffffffff))
+
+    return bytHdr + bytCmp + bytTrl
+
+
+def save_nii_gz(objNii, strPathOut, varLvl=None, varNumThrd=None):
+    """
+    Save nii image as gzip compressed file, using parallel threads.
+
+    Parameters
+    ----------
+    objNii : nibabel image object
+        Nii image to save.
+    strPathOut : str
+        Output path (`*.nii.gz`).
+    varLvl : int or str
+        Compression level (1 to 9), or output type (key of `dicGzLvl`, e.g.
+        'timeseries' or 'mask'). Default compression level if None.
+    varNumThrd : int
+        Number of threads. See `get_num_thrd` if None.
+
+    Notes
+    -----
+    The uncompressed file is created in memory before compression, so that
+    memory demands are about the size of the uncompressed file.
+    """
+    # Create uncompressed nii file in memory (header and data):
+    objBuf = io.BytesIO()
+    objNii.to_file_map(objNii.make_file_map({'image': objBuf,
+                                             'header': objBuf}))
+    objMem = objBuf.getbuffer()
+
+    # Blocks of uncompressed data (memoryviews, i.e. without copy):
+    lstBlk = [objMem[idx:(idx + varBlkSze)]
+              for idx in range(0, len(objMem), varBlkSze)]
+
+    with open(strPathOut, 'wb') as objFle:
+        write_gz(objFle, lstBlk, varLvl=varLvl, varNumThrd=varNumThrd)
+
+
+def write_gz(objFle, itrBuf, varLvl=None, varNumThrd=None):
+    """
+    Compress a stream of data and write it to an open file, using threads.
+
+    Parameters
+    ----------
+    objFle : file object
+        File opened for writing in binary mode.
+    itrBuf : iterable
+        Iterable of bytes-like objects (e.g. bytes, memoryviews, or numpy
+        arrays), which are written in the given order. Data are regrouped
+        into blocks of `varBlkSze` bytes before compression.
+    varLvl : int or str
+        Compression level (1 to 9), or output type (key of `dicGzLvl`).
+        Default compression level if None.
+    varNumThrd : int
+        Number of threads. See `get_num_thrd` if None.
+
+    Notes
+    -----
+    The input is consumed lazily. Only a few blocks per thread are held in
+    memory at any time, so that files larger than the available memory can
+    be written.
+    """
+    if varLvl is None:
+        varLvl = dicGzLvl['default']
+    elif isinstance(varLvl, numbers.Integral):
+        # Numpy integers are not accepted by zlib:
+        varLvl = int(varLvl)
+    else:
+        varLvl = dicGzLvl[varLvl]
+
+    if varNumThrd is None:
+        varNumThrd = get_num_thrd()
+
+    # Maximum number of blocks that are being compressed at the same time:
+    varNumMax = 2 * varNumThrd
+
+    def _iter_blocks():
+        """Regroup input data into blocks of `varBlkSze` bytes."""
+        objBlk = bytearray()
+        for objBuf in itrBuf:
+            objBuf = memoryview(objBuf).cast('B')
+            varPos = 0
+            while varPos < len(objBuf):
+                if ((len(objBlk) == 0)
+                        and ((len(objBuf) - varPos) >= varBlkSze)):
+                    # Full block, without copy:
+                    yield objBuf[varPos:(varPos + varBlkSze)]
+                    varPos += varBlkSze
+                    continue
+                varNum = min((varBlkSze - len(objBlk)),
+                             (len(objBuf) - varPos))
+                objBlk += objBuf[varPos:(varPos + varNum)]
+                varPos += varNum
+                if len(objBlk) == varBlkSze:
+                    yield bytes(objBlk)
+                    objBlk = bytearray()
+        if len(objBlk) > 0:
+            yield bytes(objBlk)
+
+    # Compress blocks in parallel (zlib releases the GIL) and write them to
+    # disk in the original order:
+    with ThreadPoolExecutor(max_workers=varNumThrd) as objPool:
+        lstFtr = []
+        for bytBlk in _iter_blocks():
+            lstFtr.append(objPool.submit(_compress_block, bytBlk, varLvl))
+            if len(lstFtr) >= varNumMax:
+                objFle.write(lstFtr.pop(0).result())
+        for objFtr in lstFtr:
+            objFle.write(objFtr.result())
+
+
+def _index_members(bytIn):
+    """
+    Locate gzip members written by `save_nii_gz`.
+
+    Returns a list of tuples (offset, compressed size, uncompressed size), or
+    None if the file was not written by `save_nii_gz`.
+    """
+    lstMmb = []
+    varPos = 0
+    varLen = len(bytIn)
+
+    while varPos < varLen:
+
+        # Check for gzip header with 'extra' field holding the member size:
+        if ((bytIn[varPos:(varPos + 4)] != b'\x1f\x8b\x08\x04')
+                or (bytIn[(varPos + 12):(varPos + 14)] != bytSubId)):
+            return None
+
+        varMmbSze = struct.unpack('<I', bytIn[(varPos + 16):(varPos + 20)])[0]
+
+        # Uncompressed size (last four bytes of the member):
+        varRawSze = struct.unpack(
+            '<I', bytIn[(varPos + varMmbSze - 4):(varPos + varMmbSze)])[0]
+
+        lstMmb.append((varPos, varMmbSze, varRawSze))
+        varPos += varMmbSze
+
+    return lstMmb
+
+
+def is_blocked_gz(strPathIn):
+    """
+    Check whether a file was compressed by `save_nii_gz`.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of gzip file.
+
+    Returns
+    -------
+    lgcBlk : bool
+        True if the first gzip member contains the member size in its header
+        (i.e. the file can be decompressed in parallel).
+    """
+    with open(strPathIn, 'rb') as objFle:
+        bytHdr = objFle.read(varHdrLen)
+
+    return ((bytHdr[0:4] == b'\x1f\x8b\x08\x04')
+            and (bytHdr[12:14] == bytSubId))
+
+
+def read_gz(strPathIn, varNumThrd=None):
+    """
+    Decompress gzip file, using parallel threads if possible.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of gzip file.
+    varNumThrd : int
+        Number of threads. See `get_num_thrd` if None.
+
+    Returns
+    -------
+    objMem : bytearray
+        Uncompressed file content.
+
+    Notes
+    -----
+    Files written by `save_nii_gz` are decompressed in parallel. Other gzip
+    files are decompressed sequentially.
+    """
+    if varNumThrd is None:
+        varNumThrd = get_num_thrd()
+
+    with open(strPathIn, 'rb') as objFle:
+        bytIn = objFle.read()
+
+    lstMmb = _index_members(bytIn)
+
+    # Access compressed data without copying:
+    objIn = memoryview(bytIn)
+
+    # Sequential decompression for other gzip files (wbits=47 handles gzip
+    # headers; concatenated members are handled in the loop):
+    if lstMmb is None:
+        objMem = bytearray()
+        bytRem = bytIn
+        while len(bytRem) > 0:
+            objDcmp = zlib.decompressobj(47)
+            objMem += objDcmp.decompress(bytRem)
+            bytRem = objDcmp.unused_data
+        return objMem
+
+    # Offsets of blocks in uncompressed data:
+    vecOff = np.cumsum([0] + [tplMmb[2] for tplMmb in lstMmb])
+
+    # Preallocate output:
+    objMem = bytearray(int(vecOff[-1]))
+    objView = memoryview(objMem)
+
+    def _decompress_block(idxMmb):
+        """Decompress one member into its place in the output."""
+        varPos, varMmbSze, varRawSze = lstMmb[idxMmb]
+        bytBlk = zlib.decompress(
+            objIn[(varPos + varHdrLen):(varPos + varMmbSze - 8)],
+            -zlib.MAX_WBITS)
+        objView[int(vecOff[idxMmb]):int(vecOff[idxMmb + 1])] = bytBlk
+
+    with ThreadPoolExecutor(max_workers=varNumThrd) as objPool:
+        list(objPool.map(_decompress_block, range(len(lstMmb))))
+
+    objView.release()
+    objIn.release()
+
+    return objMem
+
+
+def load_nii_gz(strPathIn, varNumThrd=None):
+    """
+    Load gzip compressed nii file, using parallel threads if possible.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path to nii file to load (`*.nii.gz`).
+    varNumThrd : int
+        Number of threads. See `get_num_thrd` if None.
+
+    Returns
+    -------
+    aryNii : np.array
+        Array containing nii data. 32 bit floating point precision.
+    objHdr : header object
+        Header of nii file.
+    aryAff : np.array
+        Array containing 'affine', i.e. information about spatial positioning
+        of nii data.
+    """
+    objMem = read_gz(strPathIn, varNumThrd=varNumThrd)
+
+    # Create nii image from uncompressed file content:
+    objBuf = io.BytesIO(objMem)
+    objNii = nb.Nifti1Image.from_file_map(
+        nb.Nifti1Image.make_file_map({'image': objBuf, 'header': objBuf}))
+
+    aryNii = np.asarray(objNii.dataobj).astype(np.float32)
+
+    return aryNii, objNii.header, objNii.affine
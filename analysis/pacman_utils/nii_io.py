@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Load and save nii files.
+
+A single loader for nii files, used across all pipeline stages. Depending on
+file type and available memory, the data are either memory-mapped, read at
+once, or read chunk-by-chunk. In all cases, the data are returned at 32 bit
+floating point precision.
+
+Intermediate results (i.e. files that are only read by subsequent pipeline
+stages) can be kept in an uncompressed working format, which can be
+memory-mapped and avoids repeated gzip compression and decompression. The
+working format is controlled by two environmental variables:
+
+    pacman_wrk_fmt  : 'nii.gz' (default) or 'nii'.
+    pacman_wrk_path : Optional scratch directory for intermediate files that
+                      are only read by python stages. If not set, working
+                      copies are placed next to the original file path.
+
+Final deliverables are always saved in the format given by their file path.
+Compressed files are written (and, if written by this module, read) with
+parallel threads, see `nii_gzip`.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import numpy as np
+import nibabel as nb
+from nibabel.openers import ImageOpener
+from pacman_utils.nii_gzip import save_nii_gz
+from pacman_utils.nii_gzip import load_nii_gz
+from pacman_utils.nii_gzip import is_blocked_gz
+
+
+def get_avail_mem():
+    """
+    Get amount of memory available for new processes.
+
+    Returns
+    -------
+    varMem : float or None
+        Available memory [MB]. None if it cannot be determined on the current
+        platform.
+    """
+    # On Linux, 'MemAvailable' accounts for reclaimable page cache:
+    try:
+        with open('/proc/meminfo', 'r') as objFle:
+            for strLne in objFle:
+                if strLne.startswith('MemAvailable:'):
+                    # Value is given in kB (i.e. KiB):
+                    return (float(strLne.split()[1]) * 1024.0
+                            / 1000000.0)
+    except (IOError, OSError):
+        pass
+
+    # Otherwise, fall back on free physical pages:
+    try:
+        varPge = os.sysconf('SC_AVPHYS_PAGES')
+        varPgeSze = os.sysconf('SC_PAGE_SIZE')
+        return float(varPge * varPgeSze) / 1000000.0
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_wrk_path(strPath, lgcScrtch=False):
+    """
+    Get path of a file in the intermediate working format.
+
+    Parameters
+    ----------
+    strPath : str
+        Path of the file in the deliverable format (e.g. `*.nii.gz`).
+    lgcScrtch : bool
+        Whether to place the file in the scratch directory (if one is
+        specified by `pacman_wrk_path`). Only use this for files that are
+        exclusively read by python stages (shell stages expect their input
+        at the original location).
+
+    Returns
+    -------
+    strPathWrk : str
+        Path of the file in the working format. Identical to `strPath` if the
+        working format is 'nii.gz'.
+    """
+    # Working format (default is to keep compressed files):
+    strFmt = os.environ.get('pacman_wrk_fmt', 'nii.gz')
+
+    if (strFmt != 'nii') or (not strPath.endswith('.nii.gz')):
+        return strPath
+
+    # Remove gzip suffix:
+    strPathWrk = strPath[:-3]
+
+    # Place file in scratch directory (mirroring its location relative to the
+    # data directory):
+    strScrtch = os.environ.get('pacman_wrk_path', '')
+    if lgcScrtch and (strScrtch != ''):
+        strData = os.environ.get('pacman_data_path', '')
+        if (strData != '') and strPathWrk.startswith(strData):
+            strPathWrk = strPathWrk[len(strData):]
+        else:
+            strPathWrk = os.path.basename(strPathWrk)
+        strPathWrk = os.path.join(strScrtch, strPathWrk.lstrip(os.sep))
+
+    return strPathWrk
+
+
+def find_nii(strPath):
+    """
+    Find most recent version of a nii file, including working copies.
+
+    Parameters
+    ----------
+    strPath : str
+        Path of the file in the deliverable format (e.g. `*.nii.gz`).
+
+    Returns
+    -------
+    strPathFnd : str
+        Path of a working copy of the file (in the scratch directory or
+        uncompressed next to the original file), if it exists and is not
+        older than the original file. Otherwise `strPath`.
+    """
+    if os.environ.get('pacman_wrk_fmt', 'nii.gz') != 'nii':
+        return strPath
+
+    # Modification time of original file (if it exists):
+    if os.path.isfile(strPath):
+        varTme = os.path.getmtime(strPath)
+    else:
+        varTme = -1.0
+
+    # Candidates: scratch directory first, then next to original file.
+    for strPathTmp in [get_wrk_path(strPath, lgcScrtch=True),
+                       get_wrk_path(strPath, lgcScrtch=False)]:
+        if ((strPathTmp != strPath) and os.path.isfile(strPathTmp)
+                and (os.path.getmtime(strPathTmp) >= varTme)):
+            return strPathTmp
+
+    return strPath
+
+
+def save_nii(objNii, strPathOut, lgcFinal=True, lgcScrtch=False,
+             varLvl=None):
+    """
+    Save nii file.
+
+    Parameters
+    ----------
+    objNii : nibabel image object
+        Nii image to save.
+    strPathOut : str
+        Output path in the deliverable format (e.g. `*.nii.gz`).
+    lgcFinal : bool
+        Whether the file is a final deliverable. Final deliverables are saved
+        at `strPathOut`. Intermediate files are saved in the working format
+        (see `get_wrk_path`).
+    lgcScrtch : bool
+        Whether intermediate files may be placed in the scratch directory.
+    varLvl : int or str
+        Gzip compression level (1 to 9), or output type (e.g. 'timeseries',
+        'map', or 'mask', see `nii_gzip.dicGzLvl`). Only used if the file is
+        saved in compressed format.
+
+    Returns
+    -------
+    strPathWrk : str
+        Path at which the file was saved.
+    """
+    if lgcFinal:
+        strPathWrk = strPathOut
+    else:
+        strPathWrk = get_wrk_path(strPathOut, lgcScrtch=lgcScrtch)
+
+    if not(strPathWrk.endswith('.gz')) and (strPathWrk != strPathOut):
+
+        # Uncompressed working copies are saved at 32 bit floating point
+        # precision without scaling, so that they can be memory-mapped:
+        objNii = nb.Nifti1Image(np.asarray(objNii.dataobj, dtype=np.float32),
+                                objNii.affine,
+                                header=objNii.header)
+        objNii.set_data_dtype(np.float32)
+
+        # Create scratch directory if necessary:
+        strDir = os.path.dirname(strPathWrk)
+        if (strDir != '') and not(os.path.isdir(strDir)):
+            os.makedirs(strDir)
+
+    if strPathWrk.endswith('.gz'):
+        save_nii_gz(objNii, strPathWrk, varLvl=varLvl)
+    else:
+        nb.save(objNii, strPathWrk)
+
+    return strPathWrk
+
+
+def iter_chunks(objNii, varNumChnk):
+    """
+    Read nii data chunk-by-chunk along the last dimension.
+
+    Parameters
+    ----------
+    objNii : nibabel image object
+        Nii image (as returned by `nibabel.load`).
+    varNumChnk : int
+        Number of elements along the last dimension (e.g. volumes of a 4D
+        file, or slices of a 3D file) per chunk.
+
+    Yields
+    ------
+    idxSrt : int
+        Index (along the last dimension) of the first element in the chunk.
+    aryChnk : np.array
+        Chunk of data, 32 bit floating point precision, shape
+        `objNii.shape[:-1] + (chunk length,)`.
+
+    Notes
+    -----
+    Nii data are stored in Fortran order, so that each chunk along the last
+    dimension is a contiguous block of bytes. The file is read sequentially
+    (also if it is gzip compressed), so that each byte is only decompressed
+    once, and only one chunk needs to be held in memory at a time.
+    """
+    tplSze = objNii.shape
+    varNumLst = tplSze[-1]
+
+    # On-disk data type (including byte order):
+    objDtype = objNii.header.get_data_dtype()
+
+    # Scaling parameters (nan if not set):
+    varSlope = objNii.dataobj.slope
+    varInter = objNii.dataobj.inter
+
+    # Number of voxels per element along the last dimension:
+    varNumVox = int(np.prod(tplSze[:-1]))
+
+    with ImageOpener(objNii.file_map['image'].filename, 'rb') as objFle:
+
+        objFle.seek(objNii.dataobj.offset)
+
+        for idxSrt in range(0, varNumLst, varNumChnk):
+
+            # Number of elements in current chunk (last chunk may be
+            # shorter):
+            varTmpNum = min(varNumChnk, (varNumLst - idxSrt))
+
+            # Read raw bytes of current chunk:
+            varTmpByt = varNumVox * varTmpNum * objDtype.itemsize
+            aryChnk = np.frombuffer(objFle.read(varTmpByt), dtype=objDtype)
+
+            aryChnk = aryChnk.reshape((tplSze[:-1] + (varTmpNum,)),
+                                      order='F').astype(np.float32)
+
+            # Apply scaling:
+            if not(np.isnan(varSlope)) and (varSlope != 1.0):
+                aryChnk *= varSlope
+            if not(np.isnan(varInter)) and (varInter != 0.0):
+                aryChnk += varInter
+
+            yield idxSrt, aryChnk
+
+
+def load_nii(strPathIn, varMemFrc=0.5, lgcMmap=True):
+    """
+    Load nii file.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path to nii file to load. If the working format is 'nii' and an
+        uncompressed working copy of the file exists, the working copy is
+        loaded instead (see `find_nii`).
+    varMemFrc : float
+        Fraction of the available memory that may be used for reading the
+        data at once. If the data need more memory, they are read
+        chunk-by-chunk. Default is 0.5.
+    lgcMmap : bool
+        Whether to memory-map uncompressed nii files (only possible if the
+        data are stored at 32 bit floating point precision without scaling).
+
+    Returns
+    -------
+    aryNii : np.array
+        Array containing nii data. 32 bit floating point precision.
+    objHdr : header object
+        Header of nii file.
+    aryAff : np.array
+        Array containing 'affine', i.e. information about spatial positioning
+        of nii data.
+
+    Notes
+    -----
+    The loading strategy is chosen as follows:
+    (1) Uncompressed nii files with 32 bit float data are memory-mapped
+        (copy-on-write, i.e. changes to the array are not written to the
+        file). Do not save the result to the file it was loaded from while
+        the array is still in use.
+    (2) If the data fit into the specified fraction of the available memory
+        (taking into account temporary arrays during type conversion), they
+        are read at once.
+    (3) Otherwise, the data are read chunk-by-chunk along the last dimension
+        into a preallocated array, so that only one chunk at a time is held
+        at on-disk precision.
+    The data are never converted to less than 32 bit precision.
+    """
+    # Use working copy of the file, if available:
+    strPathIn = find_nii(strPathIn)
+
+    # Load nii file (this does not load the data into memory yet):
+    objNii = nb.load(strPathIn, mmap='c')
+
+    # Get headers:
+    objHdr = objNii.header
+
+    # Get 'affine':
+    aryAff = objNii.affine
+
+    # Image dimensions:
+    tplSze = objNii.shape
+
+    # On-disk data type:
+    objDtype = objHdr.get_data_dtype()
+
+    # Is the data scaled?
+    varSlope = objNii.dataobj.slope
+    varInter = objNii.dataobj.inter
+    lgcScl = (not(np.isnan(varSlope)) and (varSlope != 1.0)) \
+        or (not(np.isnan(varInter)) and (varInter != 0.0))
+
+    # Is the file compressed?
+    lgcGz = strPathIn.endswith('.gz')
+
+    # (1) Memory-map uncompressed float32 data:
+    if (lgcMmap and (not lgcGz) and (not lgcScl)
+            and (objDtype.kind == 'f') and (objDtype.itemsize == 4)):
+
+        print(('---------Memory-mapping: ' + strPathIn))
+
+        aryNii = np.asanyarray(objNii.dataobj)
+
+        # Convert byte order if necessary (this reads the data):
+        if not(objDtype.isnative):
+            aryNii = aryNii.astype(np.float32)
+
+        return aryNii, objHdr, aryAff
+
+    # Size of data at 32 bit precision [MB]:
+    varSze = float(np.prod(tplSze)) * 4.0 / 1000000.0
+
+    # Peak memory when reading at once: on-disk array plus float32 copy.
+    varSzePeak = varSze + varSze * float(objDtype.itemsize) / 4.0
+
+    # Available memory:
+    varMem = get_avail_mem()
+
+    # (2) Read at once:
+    if (varMem is None) or (varSzePeak < (varMem * varMemFrc)):
+
+        # Files compressed in blocks are decompressed in parallel (the
+        # uncompressed file is held in memory in addition):
+        if lgcGz and is_blocked_gz(strPathIn) and (
+                (varMem is None)
+                or ((varSzePeak + varSze) < (varMem * varMemFrc))):
+            return load_nii_gz(strPathIn)
+
+        aryNii = np.asarray(objNii.dataobj).astype(np.float32)
+
+        return aryNii, objHdr, aryAff
+
+    # (3) Read chunk-by-chunk:
+    print(('---------Large file size (' + str(np.around(varSze))
+           + ' MB at float32, ' + str(np.around(varMem))
+           + ' MB available), reading chunk-by-chunk'))
+
+    if np.greater(varSze, (varMem * varMemFrc)):
+        print('---------WARNING: Data may not fit into memory.')
+
+    # Number of elements along the last dimension per chunk, such that one
+    # chunk takes up no more than 5 percent of the available memory:
+    varNumVox = float(np.prod(tplSze[:-1]))
+    varNumChnk = int(np.floor((varMem * 0.05 * 1000000.0)
+                              / (varNumVox * 4.0)))
+    varNumChnk = max(varNumChnk, 1)
+
+    # Create empty array for nii data:
+    aryNii = np.zeros(tplSze, dtype=np.float32)
+
+    # Loop through chunks:
+    for idxSrt, aryChnk in iter_chunks(objNii, varNumChnk):
+        aryNii[..., idxSrt:(idxSrt + aryChnk.shape[-1])] = aryChnk
+
+    return aryNii, objHdr, aryAff
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+Iterate over volumes of 4D nii time series (or slices of 3D images).
+
+Volumes (or blocks of volumes) are read lazily from disk, at 32 bit floating
+point precision. 3D images are read in the same way in slabs of slices along
+the last dimension. The next block is read on a background thread while the
+current block is being processed, so that reading and computation overlap.
+Blocks can be written to disk one at a time in the same way. Only a few
+blocks are held in memory at any time, independent of the length of the time
+series.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import numpy as np
+import nibabel as nb
+from nibabel.openers import ImageOpener
+from pacman_utils.nii_io import find_nii
+from pacman_utils.nii_io import get_wrk_path
+from pacman_utils.nii_io import iter_chunks
+from pacman_utils.nii_gzip import write_gz
+
+
+def _put(queOut, objItm, objStop):
+    """Put item into queue, unless the consumer has stopped."""
+    while not objStop.is_set():
+        try:
+            queOut.put(objItm, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _read_ahead(objItr, queOut, objStop):
+    """Read blocks from iterator and put them into queue."""
+    try:
+        for tplBlk in objItr:
+            if not _put(queOut, tplBlk, objStop):
+                return
+        _put(queOut, None, objStop)
+    except Exception as objErr:
+        _put(queOut, objErr, objStop)
+
+
+def iter_vols(strPathIn, varNumVol=1, varNumAhd=1, lgcRev=False):
+    """
+    Iterate over blocks of volumes of a 4D nii file.
+
+    3D nii files are read in blocks of slices along the last dimension (all
+    volume-related parameters refer to slices in this case).
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of 4D (or 3D) nii file. Uncompressed working copies are used if
+        available (see `nii_io.find_nii`).
+    varNumVol : int
+        Number of volumes per block.
+    varNumAhd : int
+        Number of blocks to read ahead on the background thread. If zero,
+        blocks are read on the calling thread.
+    lgcRev : bool
+        If True, blocks are yielded in reverse temporal order (i.e. starting
+        with the last block). The volumes within each block keep their
+        original order.
+
+    Yields
+    ------
+    idxVol : int
+        Index of the first volume in the block.
+    aryBlk : np.array
+        Block of volumes, 32 bit floating point precision, shape
+        `(x, y, z, number of volumes in block)`. The last block may contain
+        fewer volumes.
+
+    Notes
+    -----
+    Compressed files are read sequentially, so that each byte is only
+    decompressed once. For reverse iteration, compressed files are first
+    decompressed into a temporary uncompressed file next to the input file
+    (unless an uncompressed working copy is available), which is then
+    memory-mapped.
+    """
+    strPathIn = find_nii(strPathIn)
+
+    objNii = nb.load(strPathIn, mmap='c')
+
+    if len(objNii.shape) not in (3, 4):
+        raise ValueError('Expected 3D or 4D nii file: ' + strPathIn)
+
+    varNumVolTtl = objNii.shape[-1]
+
+    if lgcRev:
+        objItr = _iter_rev(objNii, varNumVol, varNumVolTtl)
+    else:
+        objItr = iter_chunks(objNii, varNumVol)
+
+    # Read on calling thread:
+    if varNumAhd < 1:
+        for tplBlk in objItr:
+            yield tplBlk
+        return
+
+    # Read ahead on background thread:
+    queOut = queue.Queue(maxsize=varNumAhd)
+    objStop = threading.Event()
+    objThrd = threading.Thread(target=_read_ahead,
+                               args=(objItr, queOut, objStop))
+    objThrd.daemon = True
+    objThrd.start()
+
+    try:
+        while True:
+            objBlk = queOut.get()
+            if objBlk is None:
+                break
+            if isinstance(objBlk, Exception):
+                raise objBlk
+            yield objBlk
+    finally:
+        # Stop background thread (e.g. if the consumer stops early):
+        objStop.set()
+        objThrd.join()
+
+
+def load_hdr(strPathIn):
+    """
+    Load header and affine of nii file, without loading the data.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of nii file.
+
+    Returns
+    -------
+    objHdr : header object
+        Header of nii file, including the data scaling (slope and intercept)
+        of the file on disk. (Nibabel moves the scaling from the header to the
+        data object when loading a file, so that it would otherwise be lost
+        when writing the data with `save_vols`.)
+    aryAff : np.array
+        Array containing 'affine', i.e. information about spatial positioning
+        of nii data.
+    """
+    objNii = nb.load(find_nii(strPathIn), mmap='c')
+    objHdr = objNii.header.copy()
+    objHdr.set_slope_inter(objNii.dataobj.slope, objNii.dataobj.inter)
+    return objHdr, objNii.affine
+
+
+def _iter_rev(objNii, varNumVol, varNumVolTtl):
+    """
+    Read blocks of volumes in reverse order.
+
+    Compressed files cannot be read backwards efficiently. They are
+    decompressed once (sequentially, without loading the data into memory)
+    into a temporary uncompressed file, which is then memory-mapped.
+    """
+    strPathIn = objNii.file_map['image'].filename
+    strPathTmp = None
+
+    if strPathIn.endswith('.gz'):
+        objTmp = tempfile.NamedTemporaryFile(
+            suffix='.nii',
+            dir=os.path.dirname(os.path.abspath(strPathIn)),
+            delete=False)
+        strPathTmp = objTmp.name
+        with ImageOpener(strPathIn, 'rb') as objFle:
+            shutil.copyfileobj(objFle, objTmp, (16 * 1024 * 1024))
+        objTmp.close()
+        objNii = nb.load(strPathTmp, mmap='r')
+
+    try:
+        for idxEnd in range(varNumVolTtl, 0, -varNumVol):
+            idxSrt = max((idxEnd - varNumVol), 0)
+            aryBlk = np.asarray(objNii.dataobj[..., idxSrt:idxEnd],
+                                dtype=np.float32)
+            yield idxSrt, aryBlk
+    finally:
+        if strPathTmp is not None:
+            del(objNii)
+            os.remove(strPathTmp)
+
+
+def save_vols(itrBlk, strPathOut, objHdr, aryAff, lgcFinal=True,
+              lgcScrtch=False, varLvl=None, varNumThrd=None):
+    """
+    Save 4D nii file block-by-block.
+
+    3D nii files are saved in the same way, in blocks of slices along the
+    last dimension.
+
+    Parameters
+    ----------
+    itrBlk : iterable
+        Blocks of volumes in temporal order, each of shape
+        `(x, y, z, number of volumes in block)` (e.g. as yielded by
+        `iter_vols`, without the volume index). For 3D files, blocks of
+        slices of shape `(x, y, number of slices in block)`.
+    strPathOut : str
+        Output path in the deliverable format (e.g. `*.nii.gz`).
+    objHdr : header object
+        Header of the output file (e.g. as returned by `load_hdr`). The shape
+        of the output (including the total number of volumes), the on-disk
+        data type, and the data scaling are taken from the header.
+    aryAff : np.array
+        Affine of the output file.
+    lgcFinal : bool
+        Whether the file is a final deliverable (see `nii_io.save_nii`).
+    lgcScrtch : bool
+        Whether intermediate files may be placed in the scratch directory.
+    varLvl : int or str
+        Gzip compression level (1 to 9), or output type (e.g. 'timeseries',
+        see `nii_gzip.dicGzLvl`). Only used for compressed output.
+    varNumThrd : int
+        Number of compression threads (see `nii_gzip.write_gz`), e.g. to
+        share the CPUs between several processes that save files at the same
+        time. Only used for compressed output.
+
+    Returns
+    -------
+    strPathWrk : str
+        Path at which the file was saved.
+
+    Notes
+    -----
+    Data are saved with the on-disk data type and scaling (slope and
+    intercept) of the header (see `load_hdr`); values are rounded for integer
+    data types. Uncompressed working copies are saved at 32 bit floating point
+    precision without scaling.
+    """
+    if lgcFinal:
+        strPathWrk = strPathOut
+    else:
+        strPathWrk = get_wrk_path(strPathOut, lgcScrtch=lgcScrtch)
+
+    tplShp = tuple(objHdr.get_data_shape())
+
+    # Image with header information, without data in memory (zero-stride
+    # placeholder array):
+    objNii = nb.Nifti1Image(np.broadcast_to(np.zeros(1, dtype=np.float32),
+                                            tplShp),
+                            aryAff,
+                            header=objHdr)
+
+    if strPathWrk != strPathOut:
+        objNii.set_data_dtype(np.float32)
+        objNii.header.set_slope_inter(None, None)
+    else:
+        # Scaling is reset by nibabel when creating the image:
+        objNii.header.set_slope_inter(*objHdr.get_slope_inter())
+
+    objNii.update_header()
+    objHdrOut = objNii.header
+    objHdrOut.set_data_offset(0)
+    dtpOut = objHdrOut.get_data_dtype()
+    varSlp, varInt = objHdrOut.get_slope_inter()
+    if varSlp is None:
+        varSlp = 1.0
+    if varInt is None:
+        varInt = 0.0
+
+    # Header (the data offset is set when writing the header), padded to the
+    # data offset:
+    objBuf = io.BytesIO()
+    objHdrOut.write_to(objBuf)
+    bytHdr = objBuf.getvalue()
+    bytHdr += b'\x00' * (objHdrOut.get_data_offset() - len(bytHdr))
+
+    # Number of volumes written, for consistency check:
+    lstNumVol = [0]
+
+    def _iter_bytes():
+        """Convert blocks to on-disk representation."""
+        yield bytHdr
+        for aryBlk in itrBlk:
+            if aryBlk.ndim == (len(tplShp) - 1):
+                aryBlk = aryBlk[..., None]
+            if aryBlk.shape[:-1] != tplShp[:-1]:
+                raise ValueError('Block shape does not match header: '
+                                 + str(aryBlk.shape))
+            if (varSlp != 1.0) or (varInt != 0.0):
+                aryBlk = (aryBlk - varInt) / varSlp
+            if np.issubdtype(dtpOut, np.integer):
+                aryBlk = np.clip(np.around(aryBlk),
+                                 np.iinfo(dtpOut).min,
+                                 np.iinfo(dtpOut).max)
+            lstNumVol[0] += aryBlk.shape[-1]
+            yield aryBlk.astype(dtpOut).ravel(order='F')
+
+    # Create scratch directory if necessary:
+    strDir = os.path.dirname(strPathWrk)
+    if (strDir != '') and not(os.path.isdir(strDir)):
+        os.makedirs(strDir)
+
+    with open(strPathWrk, 'wb') as objFle:
+        if strPathWrk.endswith('.gz'):
+            write_gz(objFle, _iter_bytes(), varLvl=varLvl,
+                     varNumThrd=varNumThrd)
+        else:
+            for objOut in _iter_bytes():
+                objFle.write(memoryview(objOut).cast('B'))
+
+    if lstNumVol[0] != tplShp[-1]:
+        raise ValueError('Number of volumes written (' + str(lstNumVol[0])
+                         + ') does not match header (' + str(tplShp[-1])
+                         + '): ' + strPathWrk)
+
+    return strPathWrk
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest-driven batch renaming of pipeline outputs.
+
+Some tools of the pipeline do not allow to control the names of their output
+files (e.g. dcm2niix appends an `_e1` suffix, the JIST process manager adds
+several prefixes). The rename rules for all sessions are defined in one json
+config file. The directories of all sessions are scanned and renamed
+concurrently (on a thread pool, the work is dominated by file system latency,
+e.g. on network storage).
+
+All renames are recorded in a manifest per session (original to new file
+name, per directory). Files that have been renamed before are skipped, so that
+rules are not applied twice (e.g. a prefix rule would otherwise remove further
+parts of already renamed files), and reruns only touch new files. Rules can
+be restricted to file names of a given form (regular expression), so that
+other files in the same directories (e.g. outputs of later processing steps)
+are never renamed.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pacman_utils.nii_gzip import get_num_thrd
+
+
+def _strip_suffix(strFle, dicRule, dicSes):
+    """Remove suffix before file extension (e.g. `_e1` from `a_e1.nii`)."""
+    strTkn = dicRule['token'] + '.'
+    if strTkn not in strFle:
+        return None
+    strPth, strExt = strFle.rsplit(strTkn, 1)
+    return strPth + '.' + strExt
+
+
+def _strip_prefix(strFle, dicRule, dicSes):
+    """Remove leading fields of file name (separated by underscores)."""
+    lstTmp = strFle.split('_')
+    varNumPfx = int(dicSes.get('num_prefix', dicRule.get('num_prefix', 0)))
+    if len(lstTmp) <= varNumPfx:
+        return None
+    return '_'.join(lstTmp[varNumPfx:])
+
+
+# Rename rules (referenced by name in the config file). Each rule returns the
+# new file name, or None if the file is not to be renamed.
+dicRules = {'strip_suffix': _strip_suffix,
+            'strip_prefix': _strip_prefix}
+
+
+def load_config(strPthCfg):
+    """
+    Load rename config.
+
+    Parameters
+    ----------
+    strPthCfg : str
+        Path of json config file. The config contains the rename stages (key
+        'stages'; per stage a list of rules, each with a list of directories,
+        the name of the rule, and the rule parameters) and the sessions (key
+        'sessions'; per session the parameters that are filled into the
+        directory templates, e.g. list of conditions, and optionally the
+        number of prefixes to remove). Session parameters can also be read
+        from a separate json file (key 'sessions_file', path relative to the
+        config file; e.g. the conditions of each session, which are shared
+        with other tools), in which case they are merged with those given in
+        the config. The manifest path template is given by
+        the key 'manifest'. Templates can contain the fields `{sub}`,
+        `{hemi}`, and `{con}`, and are relative to the data directory.
+        Optionally, a rule can specify a regular expression that the full
+        name of files to be renamed has to match (key 'pattern', can contain
+        the same fields; literal braces have to be doubled). Files that do
+        not match are left alone.
+
+    Returns
+    -------
+    dicCfg : dict
+        Rename config.
+    """
+    with open(strPthCfg, 'r') as objFle:
+        dicCfg = json.load(objFle)
+
+    if 'sessions_file' in dicCfg:
+        with open(os.path.join(os.path.dirname(strPthCfg),
+                               dicCfg['sessions_file']), 'r') as objFle:
+            dicSesFle = json.load(objFle)
+        dicSes = dicCfg.setdefault('sessions', {})
+        for strSub, dicTmp in dicSesFle.items():
+            dicSes[strSub] = dict(dicTmp, **dicSes.get(strSub, {}))
+
+    for strStg, lstRule in dicCfg['stages'].items():
+        for dicRule in lstRule:
+            if dicRule['rule'] not in dicRules:
+                raise ValueError('Unknown rename rule in stage ' + strStg
+                                 + ': ' + dicRule['rule'] + ' (available: '
+                                 + ', '.join(sorted(dicRules.keys())) + ')')
+
+    return dicCfg
+
+
+def get_tasks(dicCfg, strSub, lstStg):
+    """
+    List directories to be renamed for one session.
+
+    Parameters
+    ----------
+    dicCfg : dict
+        Rename config (see `load_config`).
+    strSub : str
+        Session ID.
+    lstStg : list
+        Names of rename stages.
+
+    Returns
+    -------
+    lstTsk : list
+        One tuple per directory: directory (relative to the data directory),
+        rule parameters (with the fields of the file name pattern filled in),
+        session parameters.
+    """
+    dicSes = dicCfg['sessions'][strSub]
+    lstTsk = []
+    for strStg in lstStg:
+        for dicRule in dicCfg['stages'][strStg]:
+            for strDir in dicRule['dirs']:
+                for strHmsph in dicCfg.get('hemispheres', ['lh', 'rh']):
+                    for strCon in dicSes.get('conditions', ['']):
+                        strTmp = strDir.format(sub=strSub, hemi=strHmsph,
+                                               con=strCon)
+                        dicRuleTsk = dict(dicRule)
+                        if 'pattern' in dicRule:
+                            dicRuleTsk['pattern'] = dicRule['pattern'].format(
+                                sub=re.escape(strSub),
+                                hemi=re.escape(strHmsph),
+                                con=re.escape(strCon))
+                        tplTsk = (strTmp, dicRuleTsk, dicSes)
+                        # Directory templates without hemisphere or condition
+                        # field are only listed once:
+                        if tplTsk[0] not in [tplOld[0] for tplOld in lstTsk]:
+                            lstTsk.append(tplTsk)
+    return lstTsk
+
+
+def get_manifest_path(strPthData, dicCfg, strSub):
+    """Path of the manifest of one session."""
+    return os.path.join(strPthData, dicCfg['manifest'].format(sub=strSub))
+
+
+def load_manifest(strPthMan):
+    """
+    Load rename manifest.
+
+    Parameters
+    ----------
+    strPthMan : str
+        Path of manifest (json file).
+
+    Returns
+    -------
+    dicMan : dict
+        For each directory (relative to the data directory), a dictionary of
+        original to new file names. Empty if the manifest does not exist.
+    """
+    if not os.path.isfile(strPthMan):
+        return {}
+    with open(strPthMan, 'r') as objFle:
+        return json.load(objFle)
+
+
+def save_manifest(strPthMan, dicMan):
+    """Save rename manifest (written to a temporary file and replaced)."""
+    if not os.path.isdir(os.path.dirname(strPthMan)):
+        os.makedirs(os.path.dirname(strPthMan))
+    strPthTmp = strPthMan + '.tmp'
+    with open(strPthTmp, 'w') as objFle:
+        json.dump(dicMan, objFle, indent=1, sort_keys=True)
+    os.replace(strPthTmp, strPthMan)
+
+
+def rename_dir(strPthDir, dicRule, dicSes, dicDone, lgcDry=False):
+    """
+    Rename files in one directory.
+
+    Parameters
+    ----------
+    strPthDir : str
+        Directory (absolute path).
+    dicRule : dict
+        Rule parameters (see `load_config`). Only files ending with
+        `dicRule['suffix']`, and matching `dicRule['pattern']`, are renamed
+        (all files if not specified).
+    dicSes : dict
+        Session parameters.
+    dicDone : dict
+        Files renamed before in this directory (original to new file name,
+        from the manifest). These files are not renamed again, and may be
+        replaced by new files of the same name.
+    lgcDry : bool
+        If True, renames are only determined, not carried out.
+
+    Returns
+    -------
+    dicRen : dict
+        Renames (original to new file name) carried out in this directory.
+    """
+    fncRule = dicRules[dicRule['rule']]
+    strSfx = dicRule.get('suffix', '')
+    setDone = set(dicDone.values())
+    if 'pattern' in dicRule:
+        objRgx = re.compile(dicRule['pattern'] + '$')
+    else:
+        objRgx = None
+
+    # Files in directory (one directory listing):
+    with os.scandir(strPthDir) as objIt:
+        setFls = set([objEnt.name for objEnt in objIt if objEnt.is_file()])
+
+    dicRen = {}
+    for strFle in sorted(setFls):
+        if (strFle in setDone) or (not strFle.endswith(strSfx)):
+            continue
+        if (objRgx is not None) and (objRgx.match(strFle) is None):
+            continue
+        strNew = fncRule(strFle, dicRule, dicSes)
+        if (strNew is None) or (strNew == '') or (strNew == strFle):
+            continue
+        dicRen[strFle] = strNew
+
+    # Check for conflicts before renaming anything. Existing files may only be
+    # replaced if they are outputs of previous renames:
+    lstNew = list(dicRen.values())
+    for strNew in set(lstNew):
+        if lstNew.count(strNew) > 1:
+            raise ValueError('Several files would be renamed to: '
+                             + os.path.join(strPthDir, strNew))
+        if (strNew in setFls) and (strNew not in setDone):
+            raise ValueError('Rename target exists: '
+                             + os.path.join(strPthDir, strNew))
+
+    if not lgcDry:
+        for strFle, strNew in dicRen.items():
+            os.replace(os.path.join(strPthDir, strFle),
+                       os.path.join(strPthDir, strNew))
+
+    return dicRen
+
+
+def rename_sessions(strPthData, dicCfg, lstSub, lstStg, varNumThrd=None,
+                    lgcDry=False):
+    """
+    Rename files of several sessions concurrently.
+
+    Parameters
+    ----------
+    strPthData : str
+        Data directory (containing one directory per session).
+    dicCfg : dict
+        Rename config (see `load_config`).
+    lstSub : list
+        Session IDs.
+    lstStg : list
+        Names of rename stages.
+    varNumThrd : int
+        Number of threads. By default, as specified by the environmental
+        variable `pacman_cpu`, or number of CPUs.
+    lgcDry : bool
+        If True, renames are only determined, not carried out (and the
+        manifests are not updated).
+
+    Returns
+    -------
+    dicOut : dict
+        For each session, renames carried out per directory (original to new
+        file name).
+
+    Notes
+    -----
+    Directories that do not exist are skipped (e.g. outputs that have not
+    been created yet). The manifest of each session is updated after all of
+    its directories have been processed.
+    """
+    if varNumThrd is None:
+        varNumThrd = get_num_thrd()
+
+    dicMan = {}
+    lstTsk = []
+    for strSub in lstSub:
+        dicMan[strSub] = load_manifest(get_manifest_path(strPthData, dicCfg,
+                                                         strSub))
+        for strDir, dicRule, dicSes in get_tasks(dicCfg, strSub, lstStg):
+            strPthDir = os.path.join(strPthData, strDir)
+            if not os.path.isdir(strPthDir):
+                print(('---Skipping (directory not found): ' + strPthDir))
+                continue
+            lstTsk.append((strSub, strDir, strPthDir, dicRule, dicSes))
+
+    def _rename(tplTsk):
+        strSub, strDir, strPthDir, dicRule, dicSes = tplTsk
+        return rename_dir(strPthDir, dicRule, dicSes,
+                          dicMan[strSub].get(strDir, {}), lgcDry=lgcDry)
+
+    with ThreadPoolExecutor(max_workers=max(min(varNumThrd, len(lstTsk)),
+                                            1)) as objPool:
+        lstRen = list(objPool.map(_rename, lstTsk))
+
+    dicOut = dict([(strSub, {}) for strSub in lstSub])
+    for tplTsk, dicRen in zip(lstTsk, lstRen):
+        strSub, strDir = tplTsk[:2]
+        dicOut[strSub][strDir] = dicRen
+        dicDone = dicMan[strSub].setdefault(strDir, {})
+        for strFle, strNew in dicRen.items():
+            # A file that replaces the output of a previous rename supersedes
+            # its manifest entry:
+            for strOld in [strOld for strOld in dicDone
+                           if dicDone[strOld] == strNew]:
+                del(dicDone[strOld])
+            dicDone[strFle] = strNew
+
+    if not lgcDry:
+        for strSub in lstSub:
+            if any([len(dicRen) > 0 for dicRen in dicOut[strSub].values()]):
+                save_manifest(get_manifest_path(strPthData, dicCfg, strSub),
+                              dicMan[strSub])
+
+    return dicOut
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Per-hemisphere surface datasets (mesh geometry & vertex data layers).
+
+All vtk meshes of one subject and hemisphere (e.g. polar angle, eccentricity,
+R2, event-related time courses) share the same mesh geometry. A surface
+dataset stores the geometry only once, and the vertex data of each map as a
+separate layer. A surface dataset is a directory with the following content:
+
+    surface.json        Title of the mesh & source file of the geometry.
+    points.npy          Vertex coordinates, float32, shape (vertices, 3).
+    polygons.npy        Vertex indices of polygons, int32, shape (polygons,
+                        vertices per polygon).
+    layers/<name>.npy   Vertex data, float32, shape (vertices, components).
+
+Layers are memory-mapped when loaded, so that reading (or adding) one map
+only costs the bytes of that map. Vtk files that can be opened with paraview
+are created on demand from the geometry and any selection of layers.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import numpy as np
+from pacman_utils.vtk_io import read_vtk
+from pacman_utils.vtk_io import read_scalars
+from pacman_utils.vtk_io import format_ascii
+
+# Maximum number of components of a 'SCALARS' section (legacy vtk format):
+varMaxCmp = 4
+
+
+def _save_npy(strPthOut, aryData):
+    """Save npy file via temporary file (readers never see partial files)."""
+    strPthTmp = strPthOut + '.tmp.npy'
+    np.save(strPthTmp, aryData)
+    os.replace(strPthTmp, strPthOut)
+
+
+def create_surface(strPthSrf, strPthVtk, lgcLyr=True):
+    """
+    Create surface dataset from vtk mesh.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset (created if necessary). An existing
+        geometry is replaced.
+    strPthVtk : str
+        Path of vtk mesh (ASCII or binary legacy format).
+    lgcLyr : bool
+        Whether to add the 'SCALARS' sections of the vtk file as layers.
+    """
+    dicVtk = read_vtk(strPthVtk, lgcGeom=True)
+
+    if dicVtk['polygons'] is None:
+        raise ValueError('Vtk file does not contain polygons: ' + strPthVtk)
+
+    strPthLyr = os.path.join(strPthSrf, 'layers')
+    if not os.path.isdir(strPthLyr):
+        os.makedirs(strPthLyr)
+
+    _save_npy(os.path.join(strPthSrf, 'points.npy'), dicVtk['points'])
+    _save_npy(os.path.join(strPthSrf, 'polygons.npy'), dicVtk['polygons'])
+
+    with open(os.path.join(strPthSrf, 'surface.json'), 'w') as objFle:
+        json.dump({'title': dicVtk['header'][1],
+                   'source': os.path.abspath(strPthVtk)},
+                  objFle,
+                  indent=2)
+
+    if lgcLyr:
+        for strName, aryLyr in dicVtk['scalars'].items():
+            add_layer(strPthSrf, strName, aryLyr)
+
+
+def get_num_vrtx(strPthSrf):
+    """
+    Get number of vertices of surface dataset.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+
+    Returns
+    -------
+    varNumVrtx : int
+        Number of vertices.
+    """
+    return np.load(os.path.join(strPthSrf, 'points.npy'),
+                   mmap_mode='r').shape[0]
+
+
+def load_geometry(strPthSrf):
+    """
+    Load mesh geometry of surface dataset.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+
+    Returns
+    -------
+    aryPnts : np.array
+        Vertex coordinates, float32, shape `(vertices, 3)`.
+    aryPly : np.array
+        Vertex indices of polygons, int32, shape `(polygons, vertices per
+        polygon)`.
+    """
+    aryPnts = np.load(os.path.join(strPthSrf, 'points.npy'))
+    aryPly = np.load(os.path.join(strPthSrf, 'polygons.npy'))
+    return aryPnts, aryPly
+
+
+def list_layers(strPthSrf):
+    """
+    List layers of surface dataset.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+
+    Returns
+    -------
+    lstLyr : list
+        Names of layers (sorted).
+    """
+    strPthLyr = os.path.join(strPthSrf, 'layers')
+    if not os.path.isdir(strPthLyr):
+        return []
+    return sorted([os.path.splitext(strFle)[0]
+                   for strFle in os.listdir(strPthLyr)
+                   if (strFle.endswith('.npy')
+                       and not strFle.endswith('.tmp.npy'))])
+
+
+def add_layer(strPthSrf, strName, aryData):
+    """
+    Add layer (vertex data) to surface dataset.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+    strName : str
+        Name of layer (e.g. 'PolarAngle'). An existing layer with the same
+        name is replaced.
+    aryData : np.array
+        Vertex data, shape `(vertices,)` or `(vertices, components)`. Saved at
+        32 bit floating point precision.
+    """
+    aryData = np.asarray(aryData, dtype=np.float32)
+    if aryData.ndim == 1:
+        aryData = aryData[:, None]
+
+    varNumVrtx = get_num_vrtx(strPthSrf)
+    if aryData.shape[0] != varNumVrtx:
+        raise ValueError('Layer ' + strName + ' has ' + str(aryData.shape[0])
+                         + ' vertices, surface dataset has '
+                         + str(varNumVrtx) + ': ' + strPthSrf)
+
+    _save_npy(os.path.join(strPthSrf, 'layers', (strName + '.npy')), aryData)
+
+
+def add_vtk_layer(strPthSrf, strPthVtk, strName, strNameVtk=None):
+    """
+    Add vertex data of vtk file as layer to surface dataset.
+
+    Only the vertex data are parsed, the mesh geometry of the vtk file is
+    skipped (the geometry is assumed to be identical to that of the surface
+    dataset; the number of vertices is checked).
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+    strPthVtk : str
+        Path of vtk file.
+    strName : str
+        Name of layer.
+    strNameVtk : str
+        Name of the 'SCALARS' section in the vtk file. The last section is
+        used if None.
+    """
+    dicScl = read_scalars(strPthVtk)
+    if len(dicScl) == 0:
+        raise ValueError('Vtk file does not contain vertex data: '
+                         + strPthVtk)
+    if strNameVtk is None:
+        strNameVtk = list(dicScl.keys())[-1]
+    add_layer(strPthSrf, strName, dicScl[strNameVtk])
+
+
+def load_layer(strPthSrf, strName, lgcMmap=True):
+    """
+    Load layer (vertex data) of surface dataset.
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+    strName : str
+        Name of layer.
+    lgcMmap : bool
+        Whether to memory-map the layer (read-only). Otherwise, the layer is
+        loaded into memory.
+
+    Returns
+    -------
+    aryLyr : np.array
+        Vertex data, float32, shape `(vertices, components)`.
+    """
+    strPthLyr = os.path.join(strPthSrf, 'layers', (strName + '.npy'))
+    if lgcMmap:
+        return np.load(strPthLyr, mmap_mode='r')
+    return np.load(strPthLyr)
+
+
+def write_vtk(strPthSrf, strPthOut, lstLyr=None, lgcBin=False):
+    """
+    Write surface dataset to vtk file (legacy format, e.g. for paraview).
+
+    Parameters
+    ----------
+    strPthSrf : str
+        Directory of surface dataset.
+    strPthOut : str
+        Output path of vtk file.
+    lstLyr : list
+        Names of layers to include (one 'SCALARS' section per layer). All
+        layers if None. The legacy vtk format allows at most four components
+        per 'SCALARS' section; layers with more components are written as one
+        single-component section per component (named `<layer>_<index>`).
+    lgcBin : bool
+        Whether to write binary (instead of ASCII) vtk file.
+    """
+    aryPnts, aryPly = load_geometry(strPthSrf)
+
+    if lstLyr is None:
+        lstLyr = list_layers(strPthSrf)
+
+    with open(os.path.join(strPthSrf, 'surface.json'), 'r') as objFle:
+        strTtl = json.load(objFle)['title']
+
+    varNumVrtx = aryPnts.shape[0]
+    varNumPly, varNumPlyVrtx = aryPly.shape
+
+    # Polygons are stored as number of vertices, followed by vertex indices:
+    aryPlyOut = np.hstack((np.full((varNumPly, 1), varNumPlyVrtx,
+                                   dtype=np.int32),
+                           aryPly))
+
+    if lgcBin:
+        strFmt = 'BINARY'
+    else:
+        strFmt = 'ASCII'
+
+    with open(strPthOut, 'wb') as objFle:
+
+        objFle.write(('# vtk DataFile Version 3.0\n' + strTtl + '\n' + strFmt
+                      + '\nDATASET POLYDATA\n').encode())
+
+        objFle.write(('POINTS ' + str(varNumVrtx) + ' float\n').encode())
+        if lgcBin:
+            objFle.write(aryPnts.astype('>f4').tobytes() + b'\n')
+        else:
+            objFle.write(format_ascii(aryPnts))
+
+        objFle.write(('POLYGONS ' + str(varNumPly) + ' '
+                      + str(aryPlyOut.size) + '\n').encode())
+        if lgcBin:
+            objFle.write(aryPlyOut.astype('>i4').tobytes() + b'\n')
+        else:
+            objFle.write(format_ascii(aryPlyOut, strFmt='%d'))
+
+        if len(lstLyr) > 0:
+            objFle.write(('POINT_DATA ' + str(varNumVrtx) + '\n').encode())
+
+        for strName in lstLyr:
+            aryLyr = load_layer(strPthSrf, strName)
+
+            if aryLyr.shape[1] <= varMaxCmp:
+                lstSct = [(strName, aryLyr)]
+            else:
+                lstSct = [((strName + '_' + str(idxCmp)),
+                           aryLyr[:, idxCmp:(idxCmp + 1)])
+                          for idxCmp in range(aryLyr.shape[1])]
+
+            for strSct, aryTmp in lstSct:
+                objFle.write(('SCALARS ' + strSct + ' float '
+                              + str(aryTmp.shape[1])
+                              + '\nLOOKUP_TABLE default\n').encode())
+                if lgcBin:
+                    objFle.write(aryTmp.astype('>f4').tobytes() + b'\n')
+                else:
+                    objFle.write(format_ascii(aryTmp))
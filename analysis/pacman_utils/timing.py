@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Timing and memory instrumentation for parallel analysis steps.
+
+Worker processes collect their own timing information (number of voxels,
+processing time, throughput, peak memory) and return it together with their
+results. The parent process summarises the information per ROI and writes a
+small json report, which can be used to choose chunk sizes and the number of
+parallel processes.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import json
+import time
+import resource
+import numpy as np
+
+
+def get_peak_mem():
+    """
+    Get peak memory usage of the current process.
+
+    Returns
+    -------
+    varPeakMem : float
+        Peak resident set size of the calling process [MB].
+
+    Notes
+    -----
+    On Linux, `ru_maxrss` is given in kilobytes, on macOS in bytes.
+    """
+    varPeakMem = float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+    if sys.platform == 'darwin':
+        varPeakMem = varPeakMem / 1024.0
+
+    return varPeakMem / 1024.0
+
+
+def get_worker_timing(idxPrc, varNumVox, varTmeSrt):
+    """
+    Collect timing information at the end of a worker process.
+
+    Parameters
+    ----------
+    idxPrc : int
+        Index of the worker process.
+    varNumVox : int
+        Number of voxels processed by the worker.
+    varTmeSrt : float
+        Start time of the worker (as returned by `time.time()`).
+
+    Returns
+    -------
+    dicTmng : dict
+        Worker index, number of voxels, processing time [s], throughput
+        [voxels/s], and peak memory [MB] of the worker process.
+    """
+    # Processing time of this worker:
+    varTme = time.time() - varTmeSrt
+
+    # Throughput (avoid division by zero for empty chunks):
+    if np.greater(varTme, 0.0):
+        varVoxSec = float(varNumVox) / varTme
+    else:
+        varVoxSec = 0.0
+
+    dicTmng = {'worker': int(idxPrc),
+               'voxels': int(varNumVox),
+               'seconds': float(varTme),
+               'voxels_per_s': float(varVoxSec),
+               'peak_mem_mb': get_peak_mem()}
+
+    print(('---------Worker ' + str(idxPrc) + ' done: ' + str(varNumVox)
+           + ' voxels in ' + str(np.around(varTme, decimals=1)) + ' s ('
+           + str(np.around(varVoxSec, decimals=1)) + ' voxels/s)'))
+
+    return dicTmng
+
+
+def summarise_timing(strRoi, lstWrkTmng, varTmeSrt):
+    """
+    Summarise timing information of all worker processes for one ROI.
+
+    Parameters
+    ----------
+    strRoi : str
+        Name of the ROI.
+    lstWrkTmng : list
+        List of dictionaries, as returned by `get_worker_timing`, one per
+        worker process.
+    varTmeSrt : float
+        Start time of the ROI (as returned by `time.time()`), used to
+        calculate wall time including data preparation & export.
+
+    Returns
+    -------
+    dicRoi : dict
+        ROI name, wall time [s], total number of voxels, overall throughput
+        [voxels/s], straggler ratio (slowest worker time divided by median
+        worker time), peak memory of the parent process [MB], and the timing
+        information of the individual workers.
+    """
+    # Wall time for this ROI:
+    varTme = time.time() - varTmeSrt
+
+    # Total number of voxels:
+    varNumVox = int(np.sum([dicTmp['voxels'] for dicTmp in lstWrkTmng]))
+
+    # Processing times of workers:
+    vecWrkTme = np.array([dicTmp['seconds'] for dicTmp in lstWrkTmng])
+
+    # Ratio between slowest and median worker. Values much larger than one
+    # indicate unbalanced load across chunks.
+    varMdn = np.median(vecWrkTme)
+    if np.greater(varMdn, 0.0):
+        varStrgl = float(np.max(vecWrkTme) / varMdn)
+    else:
+        varStrgl = 1.0
+
+    dicRoi = {'roi': strRoi,
+              'seconds': float(varTme),
+              'voxels': varNumVox,
+              'voxels_per_s': float(varNumVox / varTme),
+              'straggler_ratio': varStrgl,
+              'peak_mem_mb': get_peak_mem(),
+              'workers': lstWrkTmng}
+
+    print(('------ROI ' + strRoi + ': ' + str(varNumVox) + ' voxels in '
+           + str(np.around(varTme, decimals=1)) + ' s, slowest worker '
+           + str(int(np.argmax(vecWrkTme))) + ' ('
+           + str(np.around(varStrgl, decimals=2)) + ' x median)'))
+
+    return dicRoi
+
+
+def save_timing_report(strPthOut, lstRoiTmng, dicCfg):
+    """
+    Save timing report to disk (json format).
+
+    Parameters
+    ----------
+    strPthOut : str
+        Output path of json file.
+    lstRoiTmng : list
+        List of dictionaries, as returned by `summarise_timing`, one per ROI.
+    dicCfg : dict
+        Parameters of the analysis that are relevant for the interpretation
+        of the timing (e.g. number of processes, supersampling factor).
+    """
+    dicRpt = {'config': dicCfg,
+              'peak_mem_mb': get_peak_mem(),
+              'rois': lstRoiTmng}
+
+    with open(strPthOut, 'w') as objFle:
+        json.dump(dicRpt, objFle, indent=2)
+
+    print(('---Timing report saved to: ' + strPthOut))
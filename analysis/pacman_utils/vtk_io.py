@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+"""
+Read and modify legacy vtk files (polygonal meshes with vertex data).
+
+Vtk meshes (as created by CBS tools) are read in one pass over the raw bytes
+of the file. The section headers (e.g. 'POINTS', 'POLYGONS', 'SCALARS') are
+located at byte level, and numeric blocks are parsed in bulk (ASCII files) or
+read directly from the binary payload (binary files), instead of parsing the
+file line by line. The byte offsets of all sections can be cached next to the
+vtk file (index), so that individual sections can be read without scanning
+the file again. Vertex data can be replaced without rewriting the rest of the
+file.
+"""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import mmap
+from collections import OrderedDict
+import numpy as np
+
+
+# Data types of binary vtk files (big endian):
+dicVtkDtype = {'bit': '>u1',
+               'unsigned_char': '>u1',
+               'char': '>i1',
+               'unsigned_short': '>u2',
+               'short': '>i2',
+               'unsigned_int': '>u4',
+               'int': '>i4',
+               'vtkIdType': '>i4',
+               'unsigned_long': '>u8',
+               'long': '>i8',
+               'float': '>f4',
+               'double': '>f8'}
+
+# Cell sections (connectivity, number of values given in section header):
+tplCllSct = (b'POLYGONS', b'LINES', b'VERTICES', b'TRIANGLE_STRIPS')
+
+# Start of next section header in ASCII files:
+objRgxSct = re.compile(br'\n[ \t]*(POINTS|POLYGONS|LINES|VERTICES|'
+                       br'TRIANGLE_STRIPS|POINT_DATA|CELL_DATA|SCALARS|'
+                       br'COLOR_SCALARS|LOOKUP_TABLE|VECTORS|NORMALS|'
+                       br'TENSORS|TEXTURE_COORDINATES|FIELD|METADATA)\b',
+                       re.IGNORECASE)
+
+
+def _read_line(bytVtk, varPos):
+    """Read one line, return line (without line break) and next position."""
+    varEnd = bytVtk.find(b'\n', varPos)
+    if varEnd == -1:
+        varEnd = len(bytVtk)
+    return bytVtk[varPos:varEnd].strip(), (varEnd + 1)
+
+
+def _skip_space(bytVtk, varPos):
+    """Skip whitespace (e.g. empty lines between sections)."""
+    varLen = len(bytVtk)
+    while (varPos < varLen) and bytVtk[varPos:(varPos + 1)].isspace():
+        varPos += 1
+    return varPos
+
+
+def _block_end(bytVtk, varPos, varNum, strDtype, lgcBin):
+    """Get end position of numeric block of `varNum` values."""
+    if lgcBin:
+        return varPos + (varNum * np.dtype(dicVtkDtype[strDtype]).itemsize)
+
+    # ASCII: the block ends at the next section header (or at the end of the
+    # file). The search starts at the preceding line break, in case the block
+    # is empty:
+    objMtch = objRgxSct.search(bytVtk, max((varPos - 1), 0))
+    if objMtch is None:
+        return len(bytVtk)
+    return objMtch.start() + 1
+
+
+def _scan_vtk(bytVtk, strPathIn):
+    """
+    Locate sections of vtk file (without parsing numeric data).
+
+    See `build_index` for a description of the returned index.
+    """
+    # File header (version, title, format, dataset type):
+    lstHdr = []
+    varPos = 0
+    for idxLne in range(4):
+        bytLne, varPos = _read_line(bytVtk, varPos)
+        lstHdr.append(bytLne.decode('ascii', 'replace'))
+
+    if not lstHdr[0].startswith('# vtk DataFile'):
+        raise ValueError('Not a legacy vtk file: ' + strPathIn)
+
+    lgcBin = (lstHdr[2].upper() == 'BINARY')
+
+    lstSct = []
+
+    # Number of elements (vertices or cells) of current attribute data
+    # section (point data or cell data):
+    varNumEl = 0
+    lgcPntDt = False
+
+    varLen = len(bytVtk)
+    varPos = _skip_space(bytVtk, varPos)
+
+    while varPos < varLen:
+
+        varPosLne = varPos
+        bytLne, varPos = _read_line(bytVtk, varPos)
+        lstLne = bytLne.split()
+        if len(lstLne) == 0:
+            varPos = _skip_space(bytVtk, varPos)
+            continue
+        strKey = lstLne[0].decode().upper()
+
+        # Number of values & data type of numeric block following the section
+        # header (None if the section has no numeric block):
+        varNum = None
+        strDtype = 'float'
+        strName = None
+        varNumCmp = 1
+
+        if strKey == 'POINTS':
+            varNum = int(lstLne[1]) * 3
+            strDtype = lstLne[2].decode()
+
+        elif strKey.encode() in tplCllSct:
+            varNum = int(lstLne[2])
+            strDtype = 'int'
+
+        elif strKey in ('POINT_DATA', 'CELL_DATA'):
+            varNumEl = int(lstLne[1])
+            lgcPntDt = (strKey == 'POINT_DATA')
+
+        elif strKey == 'SCALARS':
+            strName = lstLne[1].decode()
+            strDtype = lstLne[2].decode()
+            if len(lstLne) > 3:
+                varNumCmp = int(lstLne[3])
+            varNum = varNumEl * varNumCmp
+            # Optional lookup table line:
+            bytNxt, varPosNxt = _read_line(bytVtk, varPos)
+            if bytNxt.upper().startswith(b'LOOKUP_TABLE'):
+                varPos = varPosNxt
+
+        elif strKey in ('VECTORS', 'NORMALS'):
+            strName = lstLne[1].decode()
+            varNum = varNumEl * 3
+            strDtype = lstLne[2].decode()
+
+        elif strKey == 'TEXTURE_COORDINATES':
+            strName = lstLne[1].decode()
+            varNum = varNumEl * int(lstLne[2])
+            strDtype = lstLne[3].decode()
+
+        elif strKey == 'LOOKUP_TABLE':
+            # Stand-alone lookup table (four values per entry):
+            strName = lstLne[1].decode()
+            varNum = int(lstLne[2]) * 4
+            strDtype = 'unsigned_char'
+
+        elif (strKey == 'FIELD') and lgcBin:
+            # Field data (arrays with individual size & type), skipped:
+            for idxArr in range(int(lstLne[2])):
+                varPos = _skip_space(bytVtk, varPos)
+                bytArr, varPos = _read_line(bytVtk, varPos)
+                lstArr = bytArr.split()
+                varPos = _block_end(bytVtk, varPos,
+                                    (int(lstArr[1]) * int(lstArr[2])),
+                                    lstArr[3].decode(), lgcBin)
+
+        elif not lgcBin:
+            # Other sections (e.g. 'FIELD' or 'METADATA'), skipped:
+            varNum = 0
+
+        else:
+            raise ValueError('Unsupported section in binary vtk file ('
+                             + bytLne.decode('ascii', 'replace') + '): '
+                             + strPathIn)
+
+        varPosDt = varPos
+        if varNum is not None:
+            varPos = _block_end(bytVtk, varPos, varNum, strDtype, lgcBin)
+
+        lstSct.append({'key': strKey,
+                       'line': bytLne.decode('ascii', 'replace'),
+                       'name': strName,
+                       'offset': varPosLne,
+                       'data': varPosDt,
+                       'end': varPos,
+                       'values': varNum,
+                       'dtype': strDtype,
+                       'elements': varNumEl,
+                       'components': varNumCmp,
+                       'point_data': lgcPntDt})
+
+        varPos = _skip_space(bytVtk, varPos)
+
+    return {'header': lstHdr,
+            'binary': lgcBin,
+            'sections': lstSct}
+
+
+def _parse_block(bytBlk, dicSct, lgcBin):
+    """Parse numeric block of section (as bytes), return float64 values."""
+    if lgcBin:
+        return np.frombuffer(bytBlk,
+                             dtype=np.dtype(dicVtkDtype[dicSct['dtype']]),
+                             count=dicSct['values'])
+
+    aryOut = np.fromstring(bytBlk, dtype=np.float64, sep=' ')
+    if aryOut.size < dicSct['values']:
+        raise ValueError('Expected ' + str(dicSct['values']) + ' values, '
+                         + 'found ' + str(aryOut.size) + ' (byte offset '
+                         + str(dicSct['data']) + ')')
+    return aryOut
+
+
+def _parse_scalars(bytBlk, dicSct, lgcBin, strPathIn):
+    """Parse 'SCALARS' section, return float32 array (vertices, comp.)."""
+    aryTmp = _parse_block(bytBlk, dicSct, lgcBin)
+    varNumEl = dicSct['elements']
+    if lgcBin:
+        varNumCmp = dicSct['components']
+    else:
+        # The number of components is taken from the data, because some
+        # software (e.g. CBS tools) does not specify it in the header:
+        if (aryTmp.size % varNumEl) != 0:
+            raise ValueError('Number of values in section ' + dicSct['name']
+                             + ' is not a multiple of the number of '
+                             + 'vertices: ' + strPathIn)
+        varNumCmp = aryTmp.size // varNumEl
+    return aryTmp.astype(np.float32).reshape(varNumEl, varNumCmp)
+
+
+def get_index_path(strPathIn):
+    """
+    Get path of the cached section index of a vtk file.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of vtk file (e.g. `/path/mesh.vtk`).
+
+    Returns
+    -------
+    strPathIdx : str
+        Path of index file (e.g. `/path/mesh.vtk_idx.json`).
+    """
+    return strPathIn + '_idx.json'
+
+
+def build_index(strPathIn, lgcCache=True):
+    """
+    Build index of the sections of a vtk file.
+
+    The byte offsets of all sections (e.g. 'POINTS', 'POLYGONS', 'POINT_DATA',
+    'SCALARS') are located in one pass over the file (which is memory-mapped,
+    numeric data are not parsed).
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of vtk file (ASCII or binary legacy format).
+    lgcCache : bool
+        Whether to save the index next to the vtk file (see `get_index_path`).
+
+    Returns
+    -------
+    dicIdx : dict
+        Index of vtk file, with the following entries:
+        'header' : list of the first four lines of the file (version, title,
+        format, dataset type), as str.
+        'binary' : bool, whether the file is in binary format.
+        'sections' : list with one dict per section, with the section keyword
+        ('key', e.g. 'SCALARS'), header line ('line'), name of the data array
+        ('name', None for geometry sections), byte offsets of the header line
+        ('offset'), of the first data value ('data'), and of the end of the
+        data ('end'), number of values in the data block ('values', None for
+        sections without data), data type ('dtype'), number of elements of the
+        attribute data ('elements'), number of components ('components', as
+        specified in the header), and whether the section belongs to the point
+        data ('point_data').
+        'size', 'mtime' : size & modification time of the vtk file, used to
+        check whether a cached index is up to date.
+    """
+    objStt = os.stat(strPathIn)
+
+    with open(strPathIn, 'rb') as objFle:
+        if objStt.st_size == 0:
+            raise ValueError('Empty vtk file: ' + strPathIn)
+        objMmap = mmap.mmap(objFle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            dicIdx = _scan_vtk(objMmap, strPathIn)
+        finally:
+            objMmap.close()
+
+    dicIdx['size'] = objStt.st_size
+    dicIdx['mtime'] = objStt.st_mtime_ns
+
+    if lgcCache:
+        # The index is not needed for reading the vtk file, so failing to
+        # save it (e.g. because of missing write permissions) is ignored:
+        try:
+            with open(get_index_path(strPathIn), 'w') as objFle:
+                json.dump(dicIdx, objFle)
+        except OSError:
+            pass
+
+    return dicIdx
+
+
+def load_index(strPathIn, lgcCache=True):
+    """
+    Load index of the sections of a vtk file.
+
+    A cached index (see `build_index`) is used if it is up to date (i.e. if
+    the size & modification time of the vtk file have not changed). Otherwise,
+    the index is built.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of vtk file.
+    lgcCache : bool
+        Whether to use (and create) the cached index.
+
+    Returns
+    -------
+    dicIdx : dict
+        Index of vtk file (see `build_index`).
+    """
+    if lgcCache:
+        try:
+            with open(get_index_path(strPathIn), 'r') as objFle:
+                dicIdx = json.load(objFle)
+            objStt = os.stat(strPathIn)
+            if ((dicIdx['size'] == objStt.st_size)
+                    and (dicIdx['mtime'] == objStt.st_mtime_ns)):
+                return dicIdx
+        except (OSError, ValueError, KeyError):
+            pass
+
+    return build_index(strPathIn, lgcCache=lgcCache)
+
+
+def read_scalars(strPathIn, lstName=None, lgcCache=True, dicIdx=None):
+    """
+    Read vertex data ('SCALARS' sections) of vtk file.
+
+    Only the requested sections are read from disk (the positions of the
+    sections are taken from the index of the file, see `load_index`).
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of vtk file.
+    lstName : list
+        Names of 'SCALARS' sections to read. All sections of the point data if
+        None.
+    lgcCache : bool
+        Whether to use (and create) the cached index.
+    dicIdx : dict
+        Index of vtk file (see `load_index`), if it has been loaded already.
+
+    Returns
+    -------
+    dicScl : OrderedDict
+        Vertex data (key: name of the section), each of shape `(vertices,
+        components)`, 32 bit floating point precision.
+    """
+    if dicIdx is None:
+        dicIdx = load_index(strPathIn, lgcCache=lgcCache)
+
+    dicSct = OrderedDict()
+    for dicTmp in dicIdx['sections']:
+        if (dicTmp['key'] == 'SCALARS') and dicTmp['point_data']:
+            dicSct[dicTmp['name']] = dicTmp
+
+    if lstName is None:
+        lstName = list(dicSct.keys())
+
+    dicScl = OrderedDict()
+    with open(strPathIn, 'rb') as objFle:
+        for strName in lstName:
+            if strName not in dicSct:
+                raise ValueError('No data section ' + strName + ' in file: '
+                                 + strPathIn)
+            dicTmp = dicSct[strName]
+            objFle.seek(dicTmp['data'])
+            bytBlk = objFle.read(dicTmp['end'] - dicTmp['data'])
+            dicScl[strName] = _parse_scalars(bytBlk, dicTmp,
+                                             dicIdx['binary'], strPathIn)
+
+    return dicScl
+
+
+def read_vtk(strPathIn, lgcGeom=True):
+    """
+    Read legacy vtk file (polygonal mesh).
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of vtk file (ASCII or binary legacy format).
+    lgcGeom : bool
+        Whether to parse the mesh geometry (vertex coordinates & polygons). If
+        False, only vertex data are parsed, which is faster.
+
+    Returns
+    -------
+    dicVtk : dict
+        Content of vtk file, with the following entries:
+        'header' : list of the first four lines of the file (version, title,
+        format, dataset type), as str.
+        'points' : vertex coordinates, shape `(vertices, 3)`, 32 bit floating
+        point precision (None if `lgcGeom` is False).
+        'polygons' : vertex indices of polygons, shape `(polygons, vertices
+        per polygon)`, 32 bit integer (None if `lgcGeom` is False, or if the
+        file does not contain polygons).
+        'scalars' : OrderedDict with one entry per 'SCALARS' section of the
+        point data (key: name of the array), each of shape `(vertices,
+        components)`, 32 bit floating point precision.
+        'scalar_headers' : OrderedDict with the header line of each 'SCALARS'
+        section (e.g. 'SCALARS EmbedVertex float 1'), as str.
+        'scalar_offsets' : OrderedDict with the byte offsets of each 'SCALARS'
+        section (start of header line, start of data, end of data).
+        'binary' : bool, whether the file is in binary format.
+
+    Notes
+    -----
+    Only point data are returned, cell data are skipped. Polygons are
+    expected to have the same number of vertices (e.g. triangles). The whole
+    file is read; use `read_scalars` to read individual sections.
+    """
+    with open(strPathIn, 'rb') as objFle:
+        bytVtk = objFle.read()
+
+    return _parse_vtk(bytVtk, strPathIn, lgcGeom)
+
+
+def _parse_vtk(bytVtk, strPathIn, lgcGeom):
+    """Parse content of vtk file (see `read_vtk`)."""
+    dicIdx = _scan_vtk(bytVtk, strPathIn)
+    lgcBin = dicIdx['binary']
+
+    dicVtk = {'header': dicIdx['header'],
+              'points': None,
+              'polygons': None,
+              'scalars': OrderedDict(),
+              'scalar_headers': OrderedDict(),
+              'scalar_offsets': OrderedDict(),
+              'binary': lgcBin}
+
+    for dicSct in dicIdx['sections']:
+
+        bytBlk = bytVtk[dicSct['data']:dicSct['end']]
+
+        if (dicSct['key'] == 'POINTS') and lgcGeom:
+            aryTmp = _parse_block(bytBlk, dicSct, lgcBin)
+            dicVtk['points'] = aryTmp[:dicSct['values']].astype(
+                np.float32).reshape(-1, 3)
+
+        elif (dicSct['key'] == 'POLYGONS') and lgcGeom:
+            aryTmp = _parse_block(bytBlk, dicSct, lgcBin)
+            aryTmp = aryTmp[:dicSct['values']].astype(np.int32)
+            varNumPly = int(dicSct['line'].split()[1])
+            # Each polygon is stored as number of vertices, followed by
+            # vertex indices:
+            if ((aryTmp.size != (varNumPly * (aryTmp[0] + 1)))
+                    or np.any(aryTmp[::(aryTmp[0] + 1)] != aryTmp[0])):
+                raise ValueError('Polygons with different number of '
+                                 + 'vertices are not supported: '
+                                 + strPathIn)
+            dicVtk['polygons'] = aryTmp.reshape(varNumPly, -1)[:, 1:]
+
+        elif (dicSct['key'] == 'SCALARS') and dicSct['point_data']:
+            strName = dicSct['name']
+            dicVtk['scalars'][strName] = _parse_scalars(bytBlk, dicSct,
+                                                        lgcBin, strPathIn)
+            dicVtk['scalar_headers'][strName] = dicSct['line']
+            dicVtk['scalar_offsets'][strName] = (dicSct['offset'],
+                                                 dicSct['data'],
+                                                 dicSct['end'])
+
+    return dicVtk
+
+
+def format_ascii(aryData, strFmt='%.9g'):
+    """
+    Format numeric array as ASCII text (one row per line).
+
+    Parameters
+    ----------
+    aryData : np.array
+        Data, shape `(rows, columns)` or `(rows,)`.
+    strFmt : str
+        Format of a single value.
+
+    Returns
+    -------
+    bytOut : bytes
+        Formatted data (values separated by spaces, rows by line breaks).
+
+    Notes
+    -----
+    All values are formatted in a single call (instead of one call per value
+    or row), which is much faster for large meshes.
+    """
+    aryData = np.asarray(aryData)
+    if aryData.ndim == 1:
+        aryData = aryData[:, None]
+    varNumRow, varNumCol = aryData.shape
+    strLne = ' '.join([strFmt] * varNumCol) + '\n'
+    return ((strLne * varNumRow) % tuple(aryData.ravel().tolist())).encode()
+
+
+def replace_scalars(strPathIn, strPathOut, strName, aryData, strNameOut=None):
+    """
+    Replace vertex data of one 'SCALARS' section in a vtk file.
+
+    Parameters
+    ----------
+    strPathIn : str
+        Path of input vtk file.
+    strPathOut : str
+        Output path. All other sections are copied from the input file
+        unchanged.
+    strName : str
+        Name of the 'SCALARS' section to replace (e.g. 'EmbedVertex').
+    aryData : np.array
+        New vertex data, shape `(vertices,)` or `(vertices, components)`.
+    strNameOut : str
+        New name of the section (e.g. 'PolarAngle'). The name is not changed
+        if None.
+    """
+    dicIdx = load_index(strPathIn)
+
+    lstSct = [dicSct for dicSct in dicIdx['sections']
+              if ((dicSct['key'] == 'SCALARS') and dicSct['point_data']
+                  and (dicSct['name'] == strName))]
+
+    if len(lstSct) == 0:
+        raise ValueError('No data section ' + strName + ' in file: '
+                         + strPathIn)
+    dicSct = lstSct[-1]
+
+    aryData = np.asarray(aryData, dtype=np.float32)
+    if aryData.ndim == 1:
+        aryData = aryData[:, None]
+
+    if aryData.shape[0] != dicSct['elements']:
+        raise ValueError('Number of vertices does not match file: '
+                         + strPathIn)
+
+    if strNameOut is None:
+        strNameOut = strName
+
+    # New section header & data:
+    bytSct = ('SCALARS ' + strNameOut + ' float ' + str(aryData.shape[1])
+              + '\nLOOKUP_TABLE default\n').encode()
+    if dicIdx['binary']:
+        bytSct += aryData.astype('>f4').tobytes()
+    else:
+        bytSct += format_ascii(aryData)
+
+    with open(strPathIn, 'rb') as objFle:
+        bytVtk = objFle.read()
+
+    with open(strPathOut, 'wb') as objFle:
+        objFle.write(bytVtk[:dicSct['offset']])
+        objFle.write(bytSct)
+        objFle.write(bytVtk[dicSct['end']:])
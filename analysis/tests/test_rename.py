@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Tests of manifest-driven batch renaming (`pacman_utils.rename`)."""
+
+# Part of PacMan analysis library
+# Copyright (C) 2018  Ingo Marquardt
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+# Shared analysis utilities (located in the analysis parent directory):
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pacman_utils.rename import load_config  #noqa
+from pacman_utils.rename import get_tasks  #noqa
+from pacman_utils.rename import rename_sessions  #noqa
+
+# Rename config of the pipeline:
+strPthCfg = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'group', 'rename_config.json')
+
+# JIST prefix of the test session (six fields):
+strPfx = '20181029_mp2rage_seg_v26_lh_brain_'
+
+
+def _touch(strPth):
+    """Create empty file."""
+    with open(strPth, 'w'):
+        pass
+
+
+def test_jist_rerun(tmpdir):
+    """Rerun after post-processing does not touch post-processing outputs."""
+    strPthData = str(tmpdir) + '/'
+    strPthDir = os.path.join(strPthData, '20181029', 'cbs', 'lh')
+    os.makedirs(strPthDir)
+    dicCfg = load_config(strPthCfg)
+
+    # First run on JIST outputs:
+    for strFle in ['pRF_results_polar_angle_mid_GM.vtk',
+                   'pRF_results_R2_mid_GM.vtk']:
+        _touch(os.path.join(strPthDir, strPfx + strFle))
+    dicOut = rename_sessions(strPthData, dicCfg, ['20181029'], ['jist'],
+                             varNumThrd=2)
+    assert len(dicOut['20181029']['20181029/cbs/lh/']) == 2
+
+    # Post-processing output (see `postprocess_retinotopy_vtk.py`), and new
+    # JIST output (e.g. after re-running part of the JIST pipeline):
+    _touch(os.path.join(strPthDir, 'pRF_results_polar_angle_mid_GM_thr.vtk'))
+    _touch(os.path.join(strPthDir, strPfx + 'pRF_results_SD_mid_GM.vtk'))
+
+    # Second run:
+    dicOut = rename_sessions(strPthData, dicCfg, ['20181029'], ['jist'],
+                             varNumThrd=2)
+    assert (dicOut['20181029']['20181029/cbs/lh/']
+            == {(strPfx + 'pRF_results_SD_mid_GM.vtk'):
+                'pRF_results_SD_mid_GM.vtk'})
+    assert (sorted(os.listdir(strPthDir))
+            == ['pRF_results_R2_mid_GM.vtk',
+                'pRF_results_SD_mid_GM.vtk',
+                'pRF_results_polar_angle_mid_GM.vtk',
+                'pRF_results_polar_angle_mid_GM_thr.vtk'])
+
+    # Third run (nothing left to rename):
+    dicOut = rename_sessions(strPthData, dicCfg, ['20181029'], ['jist'],
+                             varNumThrd=2)
+    assert dicOut['20181029']['20181029/cbs/lh/'] == {}
+    assert len(os.listdir(strPthDir)) == 4
+
+
+def test_dcm2niix_rerun(tmpdir):
+    """Files without `_e1` suffix are left alone on rerun."""
+    strPthData = str(tmpdir) + '/'
+    strPthDir = os.path.join(strPthData, '20181029', 'nii', 'raw_data')
+    os.makedirs(strPthDir)
+    dicCfg = load_config(strPthCfg)
+
+    _touch(os.path.join(strPthDir, 'func_01_e1.nii'))
+    rename_sessions(strPthData, dicCfg, ['20181029'], ['dcm2niix'],
+                    varNumThrd=2)
+    _touch(os.path.join(strPthDir, 'func_01_moco.nii'))
+    dicOut = rename_sessions(strPthData, dicCfg, ['20181029'], ['dcm2niix'],
+                             varNumThrd=2)
+
+    assert dicOut['20181029']['20181029/nii/raw_data/'] == {}
+    assert (sorted(os.listdir(strPthDir))
+            == ['func_01.nii', 'func_01_moco.nii'])
+
+
+def test_sessions_file():
+    """Conditions of each session are read from the sessions file."""
+    dicCfg = load_config(strPthCfg)
+    lstDir = [tplTsk[0] for tplTsk in get_tasks(dicCfg, '20181128',
+                                                ['jist_ert'])]
+    assert len(lstDir) == 8
+    assert '20181128/cbs/rh_era/pacman_static_uni/' in lstDir
+    assert dicCfg['sessions']['20181128']['num_prefix'] == 6